@@ -0,0 +1,314 @@
+"""NATUVISIO OS benchmarks.
+
+Generates seeded synthetic orders, payments, line items and logs over the
+BRANDS catalog, then times the dashboard hot paths against them. Each size
+runs in a fresh subprocess and data directory, so caches start cold.
+
+    python bench.py                           # 1k, 10k, 100k, 1M rows
+    python bench.py --sizes 1000,10000 --backend sqlite
+    python bench.py --compare old_bench.txt   # ratios against an earlier run
+
+Results are written as JSON to bench_output.txt (see --output).
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "natuvisio_os.py")
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_OUTPUT = "bench_output.txt"
+SEED = 20240501
+REPEATS = 5
+WRITE_OPS = 200
+SPAN_DAYS = 180
+
+STATUS_WEIGHTS = {"Pending": 0.05, "Notified": 0.08, "Dispatched": 0.12, "Completed": 0.75}
+
+# ============================================================================
+# DATA GENERATOR
+# ============================================================================
+
+def generate(app, rows, seed=SEED, now=None):
+    """Write `rows` orders (plus ~2 line items each, rows/20 payments and
+    `rows` log entries) into the current directory using `app`'s schemas."""
+    rng = np.random.default_rng(seed)
+    now = now or datetime.now().replace(microsecond=0)
+    catalog = app.get_catalog()
+
+    # Orders: one brand each, 1-3 lines drawn from that brand's products.
+    brand_ids = rng.integers(0, len(catalog.brand_names), rows)
+    lines_per_order = rng.integers(1, 4, rows)
+    order_of_line = np.repeat(np.arange(rows), lines_per_order)
+    line_brand = brand_ids[order_of_line]
+    product_ids = np.empty(len(order_of_line), dtype=np.int64)
+    for b, name in enumerate(catalog.brand_names):
+        ids = catalog.ids_for_names(catalog.products_of(name))
+        mask = line_brand == b
+        product_ids[mask] = ids[rng.integers(0, len(ids), mask.sum())]
+    qty = rng.integers(1, 4, len(order_of_line))
+    line_total, line_comm = catalog.price(product_ids, qty)
+
+    order_ids = np.array([f"NV-{i:08d}" for i in range(1, rows + 1)], dtype=object)
+    seconds = np.sort(rng.integers(0, SPAN_DAYS * 86400, rows))[::-1]
+    times = pd.to_datetime(now) - pd.to_timedelta(seconds, unit='s')
+    total = np.bincount(order_of_line, weights=line_total, minlength=rows)
+    commission = np.bincount(order_of_line, weights=line_comm, minlength=rows)
+    labels = pd.Series(catalog.product_names[product_ids] + " (x" + qty.astype(str).astype(object) + ")")
+    items = labels.groupby(order_of_line).agg(", ".join).to_numpy()
+
+    # Recent orders are still open, older ones mostly Completed.
+    status = rng.choice(list(STATUS_WEIGHTS), rows, p=list(STATUS_WEIGHTS.values()))
+    status = np.where(seconds < 3 * 86400, rng.choice(["Pending", "Notified", "Dispatched"], rows), status)
+    shipped = np.isin(status, ["Dispatched", "Completed"])
+    brand = np.asarray(catalog.brand_names, dtype=object)[brand_ids]
+    stamps = times.strftime(app.TIME_FORMAT)
+    orders = pd.DataFrame({
+        'Order_ID': order_ids,
+        'Time': stamps,
+        'Brand': brand,
+        'Customer': np.char.add("Customer ", rng.integers(0, rows, rows).astype(str)).astype(object),
+        'Phone': np.char.add("0555", rng.integers(0, 10_000_000, rows).astype(str)).astype(object),
+        'Address': np.char.add("Street ", rng.integers(1, 999, rows).astype(str)).astype(object),
+        'Items': items,
+        'Total_Value': total,
+        'Commission_Rate': commission / np.where(total > 0, total, 1),
+        'Commission_Amt': commission,
+        'Brand_Payout': total - commission,
+        'Status': status,
+        'WhatsApp_Sent': np.where(status == "Pending", "NO", "YES"),
+        'Tracking_Num': np.where(shipped, np.char.add("TRK", np.arange(rows).astype(str)), ""),
+        'Priority': rng.choice(app.PRIORITIES, rows, p=[0.9, 0.07, 0.03]),
+        'Notes': "",
+        'Created_By': "admin",
+        'Last_Modified': stamps
+    })
+    orders.to_csv(app.CSV_ORDERS, index=False, columns=app.ORDER_COLUMNS)
+
+    pd.DataFrame({
+        'Order_ID': order_ids[order_of_line],
+        'SKU': catalog.skus[product_ids],
+        'Qty': qty,
+        'Unit_Price': catalog.prices[product_ids],
+        'Commission_Amt': line_comm
+    }).to_csv(app.CSV_LINE_ITEMS, index=False, columns=app.LINE_ITEM_COLUMNS)
+
+    payments = max(1, rows // 20)
+    pay_times = pd.to_datetime(now) - pd.to_timedelta(rng.integers(0, SPAN_DAYS * 86400, payments), unit='s')
+    pd.DataFrame({
+        'Payment_ID': [f"PAY-{i:08d}" for i in range(payments)],
+        'Time': pay_times.strftime(app.TIME_FORMAT),
+        'Brand': np.asarray(catalog.brand_names, dtype=object)[rng.integers(0, len(catalog.brand_names), payments)],
+        'Amount': rng.integers(100, 20_000, payments).astype(float),
+        'Method': rng.choice(["Bank Transfer", "EFT", "Cash"], payments),
+        'Reference': np.char.add("REF", np.arange(payments).astype(str)),
+        'Notes': ""
+    }).to_csv(app.CSV_PAYMENTS, index=False, columns=app.PAYMENT_COLUMNS)
+
+    # Logs go through the storage engine so partitions and indexes are real.
+    actions = np.array(["CREATE_ORDER", "NOTIFY", "DISPATCH", "COMPLETE", "PAYMENT", "LOGIN"], dtype=object)
+    picked = rng.integers(0, len(actions), rows)
+    log_orders = np.where(actions[picked] == "LOGIN", "", order_ids[rng.integers(0, rows, rows)])
+    log_times = times[rng.permutation(rows)].sort_values()
+    logs = pd.DataFrame({
+        'Log_ID': [f"LOG-{t:%Y%m%d%H%M%S}{i % 1_000_000:06d}" for i, t in enumerate(log_times)],
+        'Time': log_times.strftime(app.TIME_FORMAT),
+        'Action': actions[picked],
+        'User': "admin",
+        'Order_ID': log_orders,
+        'Details': ""
+    })
+    storage = app.CsvStorage()
+    storage.reserve_ids(rows)  # the allocator continues after the generated ids
+    for start in range(0, rows, 100_000):
+        storage.append_logs(logs.iloc[start:start + 100_000].to_dict('records'))
+
+# ============================================================================
+# TIMING
+# ============================================================================
+
+def measure(fn, repeats=REPEATS):
+    """Cold (first call) and warm (median/min of `repeats` more) seconds."""
+    start = time.perf_counter()
+    fn()
+    cold = time.perf_counter() - start
+    warm = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        warm.append(time.perf_counter() - start)
+    return {'cold_s': cold, 'median_s': statistics.median(warm), 'min_s': min(warm), 'repeats': repeats}
+
+def measure_each(fn, count):
+    """Per-call seconds over `count` calls of fn(i)."""
+    spent = []
+    for i in range(count):
+        start = time.perf_counter()
+        fn(i)
+        spent.append(time.perf_counter() - start)
+    return {'cold_s': spent[0], 'median_s': statistics.median(spent), 'min_s': min(spent), 'repeats': count}
+
+def bench_order(app, i):
+    stamp = datetime.now().strftime(app.TIME_FORMAT)
+    return {
+        'Order_ID': app.new_order_ids()[0], 'Time': stamp, 'Brand': next(iter(app.BRANDS)),
+        'Customer': f"Bench {i}", 'Phone': "05550000000", 'Address': "Bench", 'Items': "Bench (x1)",
+        'Total_Value': 100.0, 'Commission_Rate': 0.1, 'Commission_Amt': 10.0, 'Brand_Payout': 90.0,
+        'Status': "Pending", 'WhatsApp_Sent': "NO", 'Tracking_Num': "", 'Priority': "Standard",
+        'Notes': "", 'Created_By': "bench", 'Last_Modified': stamp
+    }
+
+def bench_payment(app, i):
+    stamp = datetime.now()
+    return {
+        'Payment_ID': f"PAY-BENCH-{stamp.strftime('%Y%m%d%H%M%S%f')}", 'Time': stamp.strftime(app.TIME_FORMAT),
+        'Brand': next(iter(app.BRANDS)), 'Amount': 50.0, 'Method': "EFT", 'Reference': f"BENCH{i}", 'Notes': ""
+    }
+
+def run_size(rows, backend, repeats):
+    """Generate `rows` into the current directory and time the hot paths.
+    Runs in its own process: the app module is imported here."""
+    if backend == "sqlite":
+        os.environ["NATUVISIO_STORAGE"] = "sqlite"
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
+    import natuvisio_os as app
+
+    start = time.perf_counter()
+    generate(app, rows)
+    if backend == "sqlite":
+        app.migrate_csv_to_sqlite()
+    results = [{'name': 'generate', 'cold_s': time.perf_counter() - start, 'median_s': None, 'min_s': None, 'repeats': 1}]
+
+    brands = list(app.BRANDS)
+    cases = [
+        ('load_orders', lambda: app.load_orders()),
+        ('load_orders[summary]', lambda: app.load_orders(columns=app.SUMMARY_COLUMNS)),
+        ('get_alerts', app.get_alerts),
+        ('get_tasks', app.get_tasks),
+        ('get_vendor_health', lambda: [app.get_vendor_health(b) for b in brands]),
+        ('get_commission_shortcuts', app.get_commission_shortcuts),
+        ('all_orders[no filter]', lambda: app.search_orders()),
+        ('all_orders[brand+status]', lambda: app.search_orders(brands=brands[:1], statuses=['Pending', 'Notified'])),
+        ('all_orders[text]', lambda: app.search_orders("customer 12")),
+        ('all_orders[phone]', lambda: app.search_orders("0555 12")),
+        ('payment_ledger[balances]', lambda: app.payment_ledger().balances()),
+        ('payment_ledger[aging]', lambda: app.payment_ledger().aging()),
+    ]
+    for name, fn in cases:
+        results.append({'name': name, **measure(fn, repeats)})
+
+    results.append({'name': 'save_order', **measure_each(lambda i: app.save_order(bench_order(app, i)), WRITE_OPS)})
+    results.append({'name': 'save_payment', **measure_each(lambda i: app.save_payment(bench_payment(app, i)), WRITE_OPS)})
+    results.append({'name': 'log_action', **measure_each(lambda i: app.log_action("BENCH", "bench", "", str(i)), WRITE_OPS)})
+    writer = app.get_log_writer()
+    results.append({'name': 'log_flush', **measure_each(lambda i: writer.flush(), 1)})
+    # Reads right after writes: views patched in place vs rebuilt.
+    results.append({'name': 'get_alerts[after writes]', **measure(app.get_alerts, repeats)})
+    results.append({'name': 'all_orders[after writes]', **measure(lambda: app.search_orders(), repeats)})
+    results.append({'name': 'payment_ledger[after writes]', **measure(lambda: app.payment_ledger().balances(), repeats)})
+    # Cold tier: move old Completed orders out, then read hot-only and across both tiers.
+    results.append({'name': 'archive_orders', **measure_each(lambda i: app.archive_orders(), 1)})
+    results.append({'name': 'get_alerts[after archive]', **measure(app.get_alerts, repeats)})
+    results.append({'name': 'all_orders[after archive]', **measure(lambda: app.search_orders(), repeats)})
+    results.append({'name': 'export_frame[both tiers]', **measure(lambda: app.export_frame('orders'), repeats)})
+    writer.close()
+    return [{'rows': rows, 'backend': backend, **r} for r in results]
+
+# ============================================================================
+# DRIVER
+# ============================================================================
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(APP),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['rows'], r['backend'], r['name']): r for r in json.load(f)['results']}
+    print(f"\n{'rows':>9}  {'case':<28} {'before':>10} {'after':>10} {'ratio':>7}")
+    for r in results:
+        old = baseline.get((r['rows'], r['backend'], r['name']))
+        key = 'median_s' if r['median_s'] is not None else 'cold_s'
+        if old and old.get(key):
+            print(f"{r['rows']:>9}  {r['name']:<28} {old[key]:>10.4f} {r[key]:>10.4f} {r[key] / old[key]:>6.2f}x")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the NATUVISIO OS dashboard hot paths.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma-separated order counts")
+    parser.add_argument("--backend", choices=["csv", "sqlite"], default="csv")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--compare", help="earlier output file to print ratios against")
+    parser.add_argument("--keep", action="store_true", help="keep the generated data directories")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        json.dump(run_size(args.worker, args.backend, args.repeats), sys.stdout)
+        return
+
+    results = []
+    root = tempfile.mkdtemp(prefix="natuvisio-bench-")
+    try:
+        for rows in (int(s) for s in args.sizes.split(",") if s):
+            workdir = os.path.join(root, str(rows))
+            os.makedirs(workdir)
+            print(f"{rows:>9} rows ({args.backend}) ...", flush=True)
+            done = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", str(rows),
+                 "--backend", args.backend, "--repeats", str(args.repeats)],
+                cwd=workdir, env={**os.environ, 'PYTHONPATH': os.path.dirname(APP)},
+                capture_output=True, text=True
+            )
+            if done.returncode != 0:
+                sys.stderr.write(done.stderr)
+                raise SystemExit(f"benchmark at {rows} rows failed")
+            for r in json.loads(done.stdout):
+                results.append(r)
+                shown = r['median_s'] if r['median_s'] is not None else r['cold_s']
+                print(f"           {r['name']:<28} {shown * 1000:>10.2f} ms  (cold {r['cold_s'] * 1000:.2f} ms)")
+    finally:
+        if args.keep:
+            print(f"data kept in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': SEED,
+            'repeats': args.repeats,
+            'write_ops': WRITE_OPS
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"wrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,39 @@ import pandas as pd
 import numpy as np
 import os
 import io
+import re
+import csv
+import gzip
+import zipfile
+import hashlib
+import glob
+import time
+import json
+import atexit
+import sqlite3
+import threading
 from datetime import datetime, timedelta
+import sys
 import urllib.parse
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: Parquet export and the columnar orders snapshot
+    pa = pq = None
 
 # ============================================================================
 # 🏔️ NATUVISIO ADMIN OS - PRODUCTION EDITION
-# Dependencies: streamlit, pandas, numpy ONLY
+# Dependencies: streamlit, pandas, numpy (pyarrow optional, for Parquet)
 # All 15 Critical Features | Zero Errors | Production Ready
 # ============================================================================
 
@@ -26,12 +53,138 @@ st.set_page_config(
 ADMIN_PASS = "admin2025"
 CSV_ORDERS = "orders_complete.csv"
 CSV_PAYMENTS = "brand_payments.csv"
-CSV_LOGS = "system_logs.csv"
+CSV_LINE_ITEMS = "order_items.csv"
+CSV_ALLOCATIONS = "payment_allocations.csv"
+CSV_LOGS = "system_logs.csv"  # legacy single-file log, still read
+ORDERS_JOURNAL = "orders_complete.journal"
+ORDERS_JOURNAL_COMPACT_AT = 500
+# Optional Parquet copy of the orders table (needs pyarrow and
+# NATUVISIO_COLUMNAR=1), rewritten on journal compaction; rows appended since
+# are read from the CSV tail. ORDERS_GENERATION counts rewrites of the CSV and
+# is bumped on every rewrite, flag or not, so an older copy never validates.
+ORDERS_COLUMNAR = "orders_complete.parquet"
+ORDERS_GENERATION = "orders_generation"
+# Order_ID high-water mark. Each process reserves ORDER_ID_BLOCK ids at a
+# time and hands them out from memory; ids lost when a process exits are gaps.
+ORDER_SEQ_FILE = "order_seq"
+ORDER_ID_BLOCK = 64
+COLUMNAR_SNAPSHOT = os.environ.get("NATUVISIO_COLUMNAR") == "1"
+COLUMNAR_ROW_GROUP = 64 * 1024
+STORAGE_BACKEND = os.environ.get("NATUVISIO_STORAGE", "csv")
+SQLITE_DB = "natuvisio.db"
+CATALOG_FILE = os.environ.get("NATUVISIO_CATALOG", "catalog.json")
+LOG_DIR = "system_logs"
+# Cold tier: Completed orders older than ARCHIVE_AFTER_DAYS, moved out of the
+# orders table into gzip CSV batches, one directory per order month.
+ARCHIVE_DIR = "orders_archive"
+ARCHIVE_MANIFEST = os.path.join(ARCHIVE_DIR, "manifest.json")
+ARCHIVE_AFTER_DAYS = int(os.environ.get("NATUVISIO_ARCHIVE_DAYS", "90"))
+ARCHIVE_CACHE_BATCHES = 12
+LOG_SEGMENT_BYTES = 8 * 1024 * 1024
+LOG_MANIFEST = os.path.join(LOG_DIR, "manifest.json")
+LOG_ORDER_INDEX = os.path.join(LOG_DIR, "orders.idx")
+LOG_FLUSH_INTERVAL = 0.5
+LOG_FLUSH_BATCH = 200
+# Outbound brand notifications. With NOTIFY_URL unset, messages are opened
+# as wa.me links, NOTIFY_LINK_ORDERS orders per link, and marked sent by hand.
+NOTIFY_URL = os.environ.get("NATUVISIO_NOTIFY_URL")
+NOTIFY_TOKEN = os.environ.get("NATUVISIO_NOTIFY_TOKEN")
+NOTIFY_QUEUE_FILE = "notify_queue.jsonl"
+NOTIFY_WORKERS = 2
+NOTIFY_PER_MINUTE = 20
+NOTIFY_MAX_ATTEMPTS = 5
+NOTIFY_LINK_ORDERS = 10  # keeps the URL well under browser and wa.me limits
+NOTIFY_BACKOFF = 5.0
+NOTIFY_TIMEOUT = 10
+# Opt-in profiling: wall time per dashboard section plus file I/O and parse
+# counters, shown in a Diagnostics expander; NATUVISIO_TRACE=<path> also
+# appends one JSON line per rerun.
+TRACE_FILE = os.environ.get("NATUVISIO_TRACE")
+INSTRUMENT = os.environ.get("NATUVISIO_INSTRUMENT") == "1" or bool(TRACE_FILE)
+SLA_RULES_FILE = os.environ.get("NATUVISIO_SLA_RULES", "sla_rules.json")
+API_HOST = os.environ.get("NATUVISIO_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("NATUVISIO_API_PORT", "8502"))
+API_TOKEN = os.environ.get("NATUVISIO_API_TOKEN")
+API_PAGE_MAX = 500
+EXPORT_DIR = "exports"
+EXPORT_CHUNK_ROWS = 20000
 PHI = 1.618
 
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Schema registry: column -> kind, declared once per table. "category" for
+# low-cardinality labels, "datetime" parsed with TIME_FORMAT, "float" for
+# money and rates, "str" for free text and identifiers.
+ORDER_SCHEMA = {
+    "Order_ID": "str", "Time": "datetime", "Brand": "category", "Customer": "str",
+    "Phone": "str", "Address": "str", "Items": "str", "Total_Value": "float",
+    "Commission_Rate": "float", "Commission_Amt": "float", "Brand_Payout": "float",
+    "Status": "category", "WhatsApp_Sent": "category", "Tracking_Num": "str",
+    "Priority": "category", "Notes": "str", "Created_By": "category",
+    "Last_Modified": "datetime"
+}
+PAYMENT_SCHEMA = {
+    "Payment_ID": "str", "Time": "datetime", "Brand": "category", "Amount": "float",
+    "Method": "category", "Reference": "str", "Notes": "str"
+}
+LOG_SCHEMA = {
+    "Log_ID": "str", "Time": "datetime", "Action": "category", "User": "category",
+    "Order_ID": "str", "Details": "str"
+}
+# One row per product line of an order, written alongside the order.
+LINE_ITEM_SCHEMA = {
+    "Order_ID": "str", "SKU": "category", "Qty": "float", "Unit_Price": "float",
+    "Commission_Amt": "float"
+}
+# Which orders each payment paid for, written by the reconciliation ledger.
+ALLOCATION_SCHEMA = {
+    "Payment_ID": "str", "Order_ID": "str", "Brand": "category", "Amount": "float",
+    "Time": "datetime"
+}
+ORDER_COLUMNS = list(ORDER_SCHEMA)
+PAYMENT_COLUMNS = list(PAYMENT_SCHEMA)
+LOG_COLUMNS = list(LOG_SCHEMA)
+LINE_ITEM_COLUMNS = list(LINE_ITEM_SCHEMA)
+ALLOCATION_COLUMNS = list(ALLOCATION_SCHEMA)
+
 FIBO = {'xs': 8, 'sm': 13, 'md': 21, 'lg': 34, 'xl': 55}
 
-BRANDS = {
+ORDER_PAGE_SIZES = [10, 20, 50, 100]
+ORDER_PAGE_SIZE = 20
+BRAND_TILES_PER_ROW = 3
+BRAND_TILE_PAGE_SIZES = [6, 9, 18, 36]
+SUMMARY_COLUMNS = ["Order_ID", "Time", "Brand", "Customer", "Total_Value", "Status", "WhatsApp_Sent"]
+SUMMARY_PREVIEW_ROWS = 50  # backlog rows listed under the per-brand counts
+PRIORITIES = ["Standard", "🚨 URGENT", "🧊 Cold"]
+
+# Bulk import: one line item per row; rows sharing an External_ID form one order.
+# SLA rules (overridden by a JSON list in SLA_RULES_FILE). A rule matches
+# orders by any of status / brands / priority / whatsapp_sent (lists),
+# "missing" / "present" (columns that are blank / filled) and
+# "older_than_hours" (age from "age_from", default Time). "alert" is a
+# dashboard alert over all brands; "task" a to-do line, one per brand when
+# it mentions {brand}.
+DEFAULT_SLA_RULES = [
+    {"id": "not_notified", "whatsapp_sent": ["NO"], "level": "critical",
+     "alert": "{count} orders need notification", "task": "📲 Send {count} notification(s) to {brand}"},
+    {"id": "missing_tracking", "status": ["Notified"], "missing": ["Tracking_Num"], "level": "warning",
+     "alert": "{count} missing tracking", "task": "📦 Add tracking for {count} {brand} order(s)"},
+    {"id": "stuck_24h", "status": ["Pending", "Notified"], "older_than_hours": 24, "level": "warning",
+     "alert": "{count} stuck > 24h"},
+    {"id": "urgent_waiting_1h", "status": ["Pending"], "priority": ["🚨 URGENT"], "older_than_hours": 1,
+     "level": "critical", "alert": "{count} urgent waiting > 1h"},
+    {"id": "can_complete", "status": ["Dispatched"], "level": "info", "task": "✅ Mark {count} order(s) as completed"}
+]
+SLA_LEVEL_COLORS = {"critical": "#EF4444", "warning": "#F59E0B", "info": "#4ECDC4"}
+ALERTS_SHOWN = 6
+# Aging buckets for unpaid brand payouts, as upper bounds in days.
+AGING_DAYS = [30, 60, 90]
+AGING_LABELS = ["0-30d", "31-60d", "61-90d", "90d+"]
+IMPORT_COLUMNS = ["External_ID", "Customer", "Phone", "Address", "SKU", "Qty", "Priority", "Notes"]
+
+# Built-in catalog, used when CATALOG_FILE does not exist. BRANDS is rebound
+# to the compiled catalog's brands in section 4.
+DEFAULT_BRANDS = {
     "HAKI HEAL": {
         "phone": "601158976276",
         "color": "#4ECDC4",
@@ -223,88 +376,2497 @@ def load_css(theme="dark"):
 # 4. DATABASE
 # ============================================================================
 
-def init_databases():
-    if not os.path.exists(CSV_ORDERS):
-        pd.DataFrame(columns=[
-            "Order_ID", "Time", "Brand", "Customer", "Phone", "Address",
-            "Items", "Total_Value", "Commission_Rate", "Commission_Amt",
-            "Brand_Payout", "Status", "WhatsApp_Sent", "Tracking_Num",
-            "Priority", "Notes", "Created_By", "Last_Modified"
-        ]).to_csv(CSV_ORDERS, index=False)
-    
-    if not os.path.exists(CSV_PAYMENTS):
-        pd.DataFrame(columns=[
-            "Payment_ID", "Time", "Brand", "Amount", "Method", "Reference", "Notes"
-        ]).to_csv(CSV_PAYMENTS, index=False)
-    
-    if not os.path.exists(CSV_LOGS):
-        pd.DataFrame(columns=[
-            "Log_ID", "Time", "Action", "User", "Order_ID", "Details"
-        ]).to_csv(CSV_LOGS, index=False)
-
-def load_orders():
+# Snapshot cache: every CSV is parsed once per (mtime, size) signature and the
+# parsed frame is shared by all consumers, across reruns and sessions, until
+# the file changes on disk or one of our own writers invalidates it.
+# Consumers get shallow copies; with copy-on-write a consumer that assigns to
+# its copy never touches the shared snapshot.
+
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+@st.cache_resource
+def _data_layer():
+    return {'lock': threading.RLock(), 'snapshots': {}, 'version': 0}
+
+# Instrumentation: counters are kept per process and, for the script thread
+# of a rerun inside rerun_trace(), per rerun. Every helper is a no-op unless
+# INSTRUMENT is set.
+
+IO_COUNTERS = ('reads', 'read_bytes', 'writes', 'write_bytes', 'rows_parsed')
+
+@st.cache_resource
+def _instrumentation():
+    return {'lock': threading.Lock(), 'local': threading.local(), 'totals': dict.fromkeys(IO_COUNTERS, 0), 'reruns': 0}
+
+def count_io(**counts):
+    if not INSTRUMENT:
+        return
+    state = _instrumentation()
+    trace = getattr(state['local'], 'trace', None)
+    with state['lock']:
+        for name, value in counts.items():
+            state['totals'][name] += value
+            if trace is not None:
+                trace[name] += value
+
+@contextmanager
+def rerun_trace():
+    """Collect section timings and I/O counters for the rerun in this thread."""
+    if not INSTRUMENT:
+        yield None
+        return
+    state = _instrumentation()
+    trace = {'started': datetime.now().isoformat(timespec='milliseconds'), 'sections': {}, **dict.fromkeys(IO_COUNTERS, 0)}
+    state['local'].trace = trace
+    start = time.perf_counter()
     try:
-        if os.path.exists(CSV_ORDERS):
-            return pd.read_csv(CSV_ORDERS)
-    except: pass
-    return pd.DataFrame(columns=[
-        "Order_ID", "Time", "Brand", "Customer", "Phone", "Address",
-        "Items", "Total_Value", "Commission_Rate", "Commission_Amt",
-        "Brand_Payout", "Status", "WhatsApp_Sent", "Tracking_Num",
-        "Priority", "Notes", "Created_By", "Last_Modified"
-    ])
+        yield trace
+    finally:
+        state['local'].trace = None
+        trace['total_s'] = time.perf_counter() - start
+        with state['lock']:
+            state['reruns'] += 1
+        if TRACE_FILE:
+            try:
+                with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(trace) + "\n")
+            except OSError:
+                pass  # tracing must never break the dashboard
+
+@contextmanager
+def timed(section):
+    """Add the wall time of the block to `section` in the current rerun trace."""
+    trace = getattr(_instrumentation()['local'], 'trace', None) if INSTRUMENT else None
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace['sections'][section] = trace['sections'].get(section, 0.0) + time.perf_counter() - start
 
-def save_order(order_data):
+def current_trace():
+    return getattr(_instrumentation()['local'], 'trace', None) if INSTRUMENT else None
+
+_SCHEMAS = {
+    CSV_ORDERS: ORDER_SCHEMA,
+    CSV_PAYMENTS: PAYMENT_SCHEMA,
+    CSV_LOGS: LOG_SCHEMA,
+    CSV_LINE_ITEMS: LINE_ITEM_SCHEMA,
+    CSV_ALLOCATIONS: ALLOCATION_SCHEMA
+}
+
+def _schema_for(path):
+    if path in _SCHEMAS:
+        return _SCHEMAS[path]
+    if os.path.dirname(path) == LOG_DIR:
+        return LOG_SCHEMA
+    raise KeyError(path)
+
+def _file_signature(path):
     try:
-        df = load_orders()
-        df = pd.concat([df, pd.DataFrame([order_data])], ignore_index=True)
-        df.to_csv(CSV_ORDERS, index=False)
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+_READ_DTYPES = {"str": str, "float": float, "category": "category", "datetime": str}
+
+def _empty_frame(schema, columns=None):
+    frame = pd.DataFrame({c: pd.Series(dtype=_READ_DTYPES[schema[c]]) for c in columns or schema})
+    return _apply_schema(frame, schema)
+
+def _coerce(series, kind):
+    if kind == "datetime":
+        return pd.to_datetime(series, format=TIME_FORMAT, errors='coerce')
+    if kind == "float":
+        return pd.to_numeric(series, errors='coerce')
+    return series
+
+def _apply_schema(df, schema):
+    for col in df.columns:
+        kind = schema.get(col)
+        if kind == "category" and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+        elif kind in ("datetime", "float") and df[col].dtype.kind not in "Mf":
+            df[col] = _coerce(df[col], kind)
+    return df
+
+def _parse_csv(source, schema):
+    df = pd.read_csv(source, dtype={c: _READ_DTYPES[k] for c, k in schema.items()})
+    if INSTRUMENT:
+        # Paths and BytesIO hold file contents; StringIO is a re-parse of rows just written.
+        nbytes = os.path.getsize(source) if isinstance(source, str) else len(source.getbuffer()) if isinstance(source, io.BytesIO) else 0
+        count_io(reads=int(nbytes > 0), read_bytes=nbytes, rows_parsed=len(df))
+    for col, kind in schema.items():
+        if col not in df.columns:
+            df[col] = pd.Series(dtype=_READ_DTYPES[kind], index=df.index)
+    return _apply_schema(df, schema)
+
+def _concat_frames(frames, schema):
+    """Concatenate typed frames, keeping category columns categorical."""
+    frames = [f for f in frames if len(f)] or frames[:1]
+    df = pd.concat(frames, ignore_index=True)
+    for col in df.columns:
+        if schema.get(col) == "category" and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            try:
+                df[col] = pd.api.types.union_categoricals([f[col] for f in frames])
+            except TypeError:  # an all-empty column has no string categories
+                df[col] = df[col].astype("category")
+    return df
+
+def _get_snapshot(path, schema):
+    layer = _data_layer()
+    with layer['lock']:
+        snap = _current_snapshot(path, schema)
+        if snap['tail']:
+            snap['frame'] = _concat_frames([snap['frame']] + snap['tail'], schema)
+            snap['tail'] = []
+        return snap
+
+def _current_snapshot(path, schema):
+    # Rows appended since the last read stay in snap['tail'] as chunks;
+    # _get_snapshot folds them in on a real read.
+    layer = _data_layer()
+    with layer['lock']:
+        signature = _file_signature(path)
+        snap = layer['snapshots'].get(path)
+        if snap is None or snap['signature'] != signature:
+            if signature is None:
+                frame = _empty_frame(schema)
+            else:
+                try:
+                    frame = _parse_csv(path, schema)
+                except (OSError, ValueError, pd.errors.ParserError):
+                    return {'signature': None, 'frame': _empty_frame(schema), 'version': layer['version'], 'tail': []}
+            layer['version'] += 1
+            snap = {'signature': signature, 'frame': frame, 'version': layer['version'], 'tail': []}
+            layer['snapshots'][path] = snap
+        return snap
+
+@contextmanager
+def _file_lock(path):
+    """Cross-process exclusive lock on a sidecar file, so writers that replace
+    `path` (compaction) and writers that append to it exclude each other."""
+    with open(path + ".lock", 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+def _append_rows(path, rows):
+    """Append rows to a CSV without rereading it; O(len(rows)) whatever the file size.
+    
+    The write is serialized (thread lock + flock), fsync'ed, and mirrored into
+    the cached snapshot so the next read does not reparse the file.
+    """
+    schema = _schema_for(path)
+    columns = list(schema)
+    layer = _data_layer()
+    with layer['lock'], _file_lock(path):
+        snap = layer['snapshots'].get(path)
+        fresh = snap is not None and snap['signature'] == _file_signature(path)
+        
+        with open(path, 'a+', newline='', encoding='utf-8') as f:
+            f.seek(0)
+            header = next(csv.reader([f.readline()]), None) or columns
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                header = columns
+                csv.writer(f).writerow(header)
+            else:
+                with open(path, 'rb') as raw:
+                    raw.seek(-1, os.SEEK_END)
+                    if raw.read(1) not in (b'\n', b'\r'):
+                        f.write('\n')
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=header, extrasaction='ignore')
+            writer.writerows(rows)
+            start = f.tell()
+            f.write(buf.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+            count_io(writes=1, write_bytes=f.tell() - start)
+        
+        if fresh:
+            # Parse the exact bytes we wrote so the cached frame matches a reparse.
+            header_line = io.StringIO()
+            csv.writer(header_line).writerow(header)
+            added = _parse_csv(io.StringIO(header_line.getvalue() + buf.getvalue()), schema)
+            layer['version'] += 1
+            snap['tail'].append(added)
+            snap['signature'] = _file_signature(path)
+            snap['version'] = layer['version']
+        else:
+            layer['snapshots'].pop(path, None)
+
+def invalidate_snapshot(path):
+    layer = _data_layer()
+    with layer['lock']:
+        layer['snapshots'].pop(path, None)
+
+def snapshot_version(path=CSV_ORDERS):
+    # No fold: checking a version after an append must not cost O(rows).
+    return _current_snapshot(path, _schema_for(path))['version']
+
+def _time_brand_mask(df, since=None, until=None, brands=None):
+    """since <= Time < until and Brand in brands, as a boolean array."""
+    mask = np.ones(len(df), dtype=bool)
+    if since is not None:
+        mask &= (df['Time'] >= pd.Timestamp(since)).to_numpy()
+    if until is not None:
+        mask &= (df['Time'] < pd.Timestamp(until)).to_numpy()
+    if brands:
+        mask &= df['Brand'].isin(brands).to_numpy()
+    return mask
+
+def _filter_orders(df, brands=None, statuses=None, whatsapp_sent=None, search=None):
+    mask = pd.Series(True, index=df.index)
+    if brands:
+        mask &= df['Brand'].isin(brands)
+    if statuses:
+        mask &= df['Status'].isin(statuses)
+    if whatsapp_sent:
+        mask &= df['WhatsApp_Sent'].isin(whatsapp_sent)
+    if search:
+        mask &= (
+            df['Order_ID'].str.contains(search, case=False, na=False, regex=False) |
+            df['Customer'].str.contains(search, case=False, na=False, regex=False) |
+            df['Phone'].str.contains(search, case=False, na=False, regex=False)
+        )
+    return df[mask]
+
+# Storage engines: every read/write of orders, payments and logs goes through
+# get_storage(), selected by NATUVISIO_STORAGE ("csv" by default, or "sqlite").
+# Both engines expose the same methods and return frames typed by the schema
+# registry; `columns` projects a load down to what the caller needs.
+
+class CsvStorage:
+    name = "csv"
+    
+    def __init__(self):
+        self._log_segments = {}
+    
+    def init(self):
+        if not os.path.exists(CSV_ORDERS):
+            self._bump_generation()
+            pd.DataFrame(columns=ORDER_COLUMNS).to_csv(CSV_ORDERS, index=False)
+        
+        if not os.path.exists(CSV_PAYMENTS):
+            pd.DataFrame(columns=PAYMENT_COLUMNS).to_csv(CSV_PAYMENTS, index=False)
+        
+        if not os.path.exists(CSV_LINE_ITEMS):
+            pd.DataFrame(columns=LINE_ITEM_COLUMNS).to_csv(CSV_LINE_ITEMS, index=False)
+        
+        if not os.path.exists(CSV_ALLOCATIONS):
+            pd.DataFrame(columns=ALLOCATION_COLUMNS).to_csv(CSV_ALLOCATIONS, index=False)
+        
+        os.makedirs(LOG_DIR, exist_ok=True)
+    
+    def version(self, table='orders'):
+        if table == 'orders':
+            journal_size = os.path.getsize(ORDERS_JOURNAL) if os.path.exists(ORDERS_JOURNAL) else 0
+            return (snapshot_version(CSV_ORDERS), journal_size)
+        if table == 'payments':
+            return snapshot_version(CSV_PAYMENTS)
+        if table == 'line_items':
+            return snapshot_version(CSV_LINE_ITEMS)
+        if table == 'allocations':
+            return snapshot_version(CSV_ALLOCATIONS)
+        if table == 'archive':
+            return _file_signature(ARCHIVE_MANIFEST)
+        return tuple(snapshot_version(path) for path in log_segments())
+    
+    def signature(self, table='orders'):
+        """On-disk state of `table`, comparable across processes and restarts
+        (version() counts in memory and restarts at 1)."""
+        if table == 'orders':
+            return (self._generation(), _file_signature(CSV_ORDERS), _file_signature(ORDERS_JOURNAL))
+        paths = {
+            'payments': [CSV_PAYMENTS],
+            'line_items': [CSV_LINE_ITEMS],
+            'allocations': [CSV_ALLOCATIONS],
+            'archive': [ARCHIVE_MANIFEST]
+        }.get(table) or _log_partitions()
+        return tuple((path, _file_signature(path)) for path in paths)
+    
+    # Orders are the base CSV plus an append-only journal of per-order field
+    # updates (one JSON line per transition). Reads overlay the journal on the
+    # base snapshot; once it holds ORDERS_JOURNAL_COMPACT_AT entries it is
+    # folded into the base file and truncated.
+    
+    def _orders_frame(self):
+        layer = _data_layer()
+        with layer['lock']:
+            if CSV_ORDERS not in layer['snapshots']:
+                self._prime_from_columnar()
+            base = _get_snapshot(CSV_ORDERS, ORDER_SCHEMA)
+            state = layer.get('journal')
+            journal_size = os.path.getsize(ORDERS_JOURNAL) if os.path.exists(ORDERS_JOURNAL) else 0
+            if state is None or state['base_version'] != base['version'] or journal_size < state['offset']:
+                state = {'base_version': base['version'], 'offset': 0, 'entries': 0, 'frame': base['frame']}
+                layer['journal'] = state
+            if journal_size > state['offset']:
+                with open(ORDERS_JOURNAL, 'rb') as f:
+                    f.seek(state['offset'])
+                    chunk = f.read()
+                count_io(reads=1, read_bytes=len(chunk))
+                complete = chunk[:chunk.rfind(b'\n') + 1]
+                updates = [json.loads(line) for line in complete.splitlines() if line.strip()]
+                state['frame'] = _apply_order_updates(state['frame'], updates)
+                state['offset'] += len(complete)
+                state['entries'] += len(updates)
+            return state['frame']
+    
+    def load_orders(self, columns=None, since=None, until=None, brands=None):
+        filtered = since is not None or until is not None or brands
+        if filtered and CSV_ORDERS not in _data_layer()['snapshots']:
+            # Cold: push the filters down to the columnar snapshot
+            frame = self._read_columnar(columns, since, until, brands)
+            if frame is not None:
+                return frame
+        frame = self._orders_frame()
+        if filtered:
+            frame = frame[_time_brand_mask(frame, since, until, brands)]
+        return (frame[columns] if columns else frame).copy(deep=False)
+    
+    def count_orders(self):
+        return len(_get_snapshot(CSV_ORDERS, ORDER_SCHEMA)['frame'])
+    
+    def query_orders(self, brands=None, statuses=None, whatsapp_sent=None, search=None, newest_first=True):
+        filtered = _filter_orders(self.load_orders(), brands, statuses, whatsapp_sent, search)
+        return filtered.sort_values('Time', ascending=False) if newest_first else filtered
+    
+    def append_orders(self, rows):
+        _append_rows(CSV_ORDERS, rows)
+    
+    def update_orders(self, updates, from_statuses=None):
+        """Apply {Order_ID: fields} as one journal append; return the touched rows as they were."""
+        layer = _data_layer()
+        with layer['lock'], _file_lock(CSV_ORDERS):
+            # Catch up with other writers' journal entries before checking state.
+            frame = self._orders_frame()
+            current = frame[frame['Order_ID'].isin(list(updates))].drop_duplicates('Order_ID', keep='last')
+            if from_statuses is not None:
+                current = current[current['Status'].isin(from_statuses)]
+            previous = current.to_dict('records')
+            if not previous:
+                return []
+            entries = ''.join(
+                json.dumps({'Order_ID': row['Order_ID'], 'fields': updates[row['Order_ID']]}, default=str) + '\n'
+                for row in previous
+            )
+            with open(ORDERS_JOURNAL, 'a', encoding='utf-8') as f:
+                f.write(entries)
+                f.flush()
+                os.fsync(f.fileno())
+            count_io(writes=1, write_bytes=len(entries.encode('utf-8')))
+            self._orders_frame()
+            if layer['journal']['entries'] >= ORDERS_JOURNAL_COMPACT_AT:
+                self._compact_journal()
+        return previous
+    
+    def archive_orders(self, cutoff, archive):
+        """Move Completed orders with Time < cutoff into `archive`; returns how many moved."""
+        layer = _data_layer()
+        with layer['lock'], _file_lock(CSV_ORDERS):
+            frame = self._orders_frame()
+            old = ((frame['Status'] == 'Completed') & (frame['Time'] < cutoff)).to_numpy()
+            if not old.any():
+                return 0
+            archive.write(frame[old], cutoff)
+            self._replace_orders(frame[~old].reset_index(drop=True))
+            return int(old.sum())
+    
+    def _compact_journal(self):
+        self._replace_orders(_data_layer()['journal']['frame'])
+    
+    def _replace_orders(self, frame):
+        # Caller holds the data layer lock and the orders file lock.
+        layer = _data_layer()
+        tmp = CSV_ORDERS + ".tmp"
+        frame.to_csv(tmp, index=False, date_format=TIME_FORMAT)
+        with open(tmp, 'rb') as f:
+            os.fsync(f.fileno())
+        count_io(writes=1, write_bytes=os.path.getsize(tmp))
+        self._bump_generation()
+        os.replace(tmp, CSV_ORDERS)
+        # A crash before truncation only replays idempotent updates.
+        open(ORDERS_JOURNAL, 'w').close()
+        layer['version'] += 1
+        layer['snapshots'][CSV_ORDERS] = {
+            'signature': _file_signature(CSV_ORDERS), 'frame': frame, 'version': layer['version'], 'tail': []
+        }
+        layer['journal'] = None
+        if COLUMNAR_SNAPSHOT and pq is not None:
+            self._write_columnar()
+    
+    # Columnar snapshot: the resolved orders frame as Parquet, tagged with the
+    # CSV generation and length and the journal offset it covers. It stays
+    # usable while the CSV is only appended to (the tail after csv_bytes is
+    # parsed from the CSV) and is replayed against the journal like the CSV
+    # base; replaying entries it already contains is harmless. It is only
+    # read with COLUMNAR_SNAPSHOT set.
+    
+    def _generation(self):
+        try:
+            with open(ORDERS_GENERATION, encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            return -1  # torn write: matches no snapshot
+    
+    def _bump_generation(self):
+        # Before the CSV is replaced, so a crash in between only orphans the snapshot.
+        tmp = ORDERS_GENERATION + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(str(max(self._generation(), 0) + 1))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, ORDERS_GENERATION)
+    
+    def write_columnar_snapshot(self):
+        if pq is None:
+            raise RuntimeError("pyarrow is required for the columnar snapshot")
+        with _data_layer()['lock'], _file_lock(CSV_ORDERS):
+            return self._write_columnar()
+    
+    def _write_columnar(self):
+        # Caller holds the data layer lock and the orders file lock.
+        layer = _data_layer()
+        frame = self._orders_frame()
+        meta = {
+            'generation': self._generation(),
+            'csv_bytes': layer['snapshots'][CSV_ORDERS]['signature'][1],
+            'journal_bytes': layer['journal']['offset']
+        }
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({**table.schema.metadata, b'natuvisio': json.dumps(meta).encode()})
+        tmp = ORDERS_COLUMNAR + ".tmp"
+        pq.write_table(table, tmp, row_group_size=COLUMNAR_ROW_GROUP)
+        count_io(writes=1, write_bytes=os.path.getsize(tmp))
+        os.replace(tmp, ORDERS_COLUMNAR)
+        return len(frame)
+    
+    def _columnar_meta(self):
+        if not COLUMNAR_SNAPSHOT or pq is None or not os.path.exists(ORDERS_COLUMNAR) or not os.path.exists(CSV_ORDERS):
+            return None
+        try:
+            meta = json.loads(pq.read_schema(ORDERS_COLUMNAR).metadata[b'natuvisio'])
+        except (OSError, KeyError, TypeError, ValueError, pa.ArrowException):
+            return None
+        journal_size = os.path.getsize(ORDERS_JOURNAL) if os.path.exists(ORDERS_JOURNAL) else 0
+        if (meta.get('generation') != self._generation() or os.path.getsize(CSV_ORDERS) < meta['csv_bytes']
+                or journal_size < meta['journal_bytes']):
+            return None
+        return meta
+    
+    def _csv_tail(self, meta, size):
+        """Orders appended to the CSV after the columnar snapshot was taken."""
+        with open(CSV_ORDERS, 'rb') as f:
+            header = f.readline()
+            f.seek(meta['csv_bytes'])
+            data = f.read(size - meta['csv_bytes'])
+        if not data.strip():
+            return _empty_frame(ORDER_SCHEMA)
+        return _parse_csv(io.BytesIO(header + data), ORDER_SCHEMA)
+    
+    def _prime_from_columnar(self):
+        # Caller holds the data layer lock.
+        meta = self._columnar_meta()
+        if meta is None:
+            return
+        signature = _file_signature(CSV_ORDERS)
+        try:
+            frame = _apply_schema(pq.read_table(ORDERS_COLUMNAR).to_pandas(), ORDER_SCHEMA)
+        except (OSError, pa.ArrowException):
+            return
+        count_io(reads=1, read_bytes=os.path.getsize(ORDERS_COLUMNAR), rows_parsed=len(frame))
+        frame = _concat_frames([frame, self._csv_tail(meta, signature[1])], ORDER_SCHEMA)
+        layer = _data_layer()
+        layer['version'] += 1
+        layer['snapshots'][CSV_ORDERS] = {'signature': signature, 'frame': frame, 'version': layer['version'], 'tail': []}
+    
+    def _read_columnar(self, columns, since, until, brands):
+        """Filtered, projected read from the columnar snapshot, or None."""
+        meta = self._columnar_meta()
+        if meta is None:
+            return None
+        with open(ORDERS_JOURNAL, 'rb') if os.path.exists(ORDERS_JOURNAL) else io.BytesIO() as f:
+            f.seek(meta['journal_bytes'])
+            chunk = f.read()
+        updates = [json.loads(line) for line in chunk[:chunk.rfind(b'\n') + 1].splitlines() if line.strip()]
+        if any({'Time', 'Brand'} & set(update['fields']) for update in updates):
+            return None  # newer entries could move rows across the filter
+        read = list(dict.fromkeys(['Order_ID', 'Time', 'Brand'] + (columns or ORDER_COLUMNS)))
+        filters = []
+        if since is not None:
+            filters.append(('Time', '>=', pd.Timestamp(since)))
+        if until is not None:
+            filters.append(('Time', '<', pd.Timestamp(until)))
+        if brands:
+            filters.append(('Brand', 'in', list(brands)))
+        try:
+            frame = _apply_schema(pq.read_table(ORDERS_COLUMNAR, columns=read, filters=filters).to_pandas(), ORDER_SCHEMA)
+        except (OSError, pa.ArrowException):
+            return None
+        count_io(reads=1, rows_parsed=len(frame))  # row groups skipped by the filters are never read
+        tail = self._csv_tail(meta, os.path.getsize(CSV_ORDERS))[read]
+        frame = _concat_frames([frame, tail[_time_brand_mask(tail, since, until, brands)]], ORDER_SCHEMA)
+        updates = [{**u, 'fields': {c: v for c, v in u['fields'].items() if c in read}} for u in updates]
+        frame = _apply_order_updates(frame, updates)
+        return frame[columns or ORDER_COLUMNS]
+    
+    def load_payments(self, columns=None):
+        frame = _get_snapshot(CSV_PAYMENTS, PAYMENT_SCHEMA)['frame']
+        return (frame[columns] if columns else frame).copy(deep=False)
+    
+    def append_payments(self, rows):
+        _append_rows(CSV_PAYMENTS, rows)
+    
+    def load_line_items(self, columns=None):
+        frame = _get_snapshot(CSV_LINE_ITEMS, LINE_ITEM_SCHEMA)['frame']
+        return (frame[columns] if columns else frame).copy(deep=False)
+    
+    def append_line_items(self, rows):
+        _append_rows(CSV_LINE_ITEMS, rows)
+    
+    def load_allocations(self, columns=None):
+        frame = _get_snapshot(CSV_ALLOCATIONS, ALLOCATION_SCHEMA)['frame']
+        return (frame[columns] if columns else frame).copy(deep=False)
+    
+    def append_allocations(self, rows):
+        _append_rows(CSV_ALLOCATIONS, rows)
+    
+    def reserve_ids(self, count):
+        """Advance the Order_ID high-water mark by `count`; returns its previous value."""
+        with _file_lock(ORDER_SEQ_FILE):
+            try:
+                with open(ORDER_SEQ_FILE, encoding='utf-8') as f:
+                    last = int(f.read().strip() or 0)
+            except FileNotFoundError:
+                last = 0
+            if count:
+                tmp = ORDER_SEQ_FILE + ".tmp"
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write(str(last + count))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, ORDER_SEQ_FILE)
+        return last
+    
+    # Logs live in daily segments (system_logs/YYYY-MM-DD.csv), rotated to
+    # YYYY-MM-DD.N.csv once a segment passes LOG_SEGMENT_BYTES. LOG_MANIFEST
+    # records per partition (segment or legacy file) the days it covers, its
+    # size and row counts per Action; LOG_ORDER_INDEX is an append-only list
+    # of "Order_ID<TAB>partition" pairs. Both are updated on append, and a
+    # partition whose size no longer matches its entry is reindexed on read.
+    
+    def load_logs(self, day=None, actions=None):
+        if day is None and not actions:
+            frames = [_get_snapshot(path, LOG_SCHEMA)['frame'] for path in _log_partitions()]
+            return _concat_frames(frames, LOG_SCHEMA) if frames else _empty_frame(LOG_SCHEMA)
+        day = pd.Timestamp(day).strftime('%Y-%m-%d') if day is not None else None
+        manifest = self._manifest()
+        frames = []
+        for path in _log_partitions():
+            entry = manifest.get(path)
+            if entry is not None:
+                if day is not None and entry['first_day'] and not entry['first_day'] <= day <= entry['last_day']:
+                    continue
+                if actions and not any(entry['actions'].get(action) for action in actions):
+                    continue
+            frames.append(self._partition_actions(path, actions) if actions else _get_snapshot(path, LOG_SCHEMA)['frame'])
+        if not frames:
+            return _empty_frame(LOG_SCHEMA)
+        frame = _concat_frames(frames, LOG_SCHEMA)
+        if day is not None:
+            frame = frame[frame['Time'].dt.normalize() == pd.Timestamp(day)]
+        return frame
+    
+    def log_actions(self):
+        return sorted({action for entry in self._manifest().values() for action, n in entry['actions'].items() if n})
+    
+    def order_timeline(self, order_id):
+        partitions = self._order_index().get(order_id, ())
+        frames = []
+        for path in _log_partitions():
+            if path in partitions:
+                frame = _get_snapshot(path, LOG_SCHEMA)['frame']
+                frames.append(frame[_mentions_order(frame['Order_ID'], order_id)])
+        if not frames:
+            return _empty_frame(LOG_SCHEMA)
+        return _concat_frames(frames, LOG_SCHEMA).sort_values('Time', kind='stable')
+    
+    def append_logs(self, rows):
+        os.makedirs(LOG_DIR, exist_ok=True)
+        by_day = {}
+        for entry in rows:
+            by_day.setdefault(entry['Time'][:10], []).append(entry)
+        with _file_lock(LOG_MANIFEST):
+            manifest = dict(self._read_manifest())
+            pairs = []
+            for day, entries in by_day.items():
+                path = self._segment_for(day)
+                before = os.path.getsize(path) if os.path.exists(path) else 0
+                _append_rows(path, entries)
+                entry = manifest.get(path) or (_partition_entry(_empty_frame(LOG_SCHEMA), 0) if before == 0 else None)
+                if entry is None or entry['bytes'] != before:
+                    manifest.pop(path, None)  # written behind our back; reindexed on next read
+                    continue
+                manifest[path] = _extend_partition_entry(entry, entries, os.path.getsize(path))
+                pairs.extend((order_id, path) for order_id in {t for e in entries for t in _order_tokens(e.get('Order_ID'))})
+            self._write_manifest(manifest, pairs)
+    
+    def last_log_id(self):
+        segments = log_segments()
+        if not segments:
+            return None
+        try:
+            with open(segments[-1], 'rb') as f:
+                f.seek(max(0, os.path.getsize(segments[-1]) - 4096))
+                last = f.read().decode('utf-8', 'ignore').strip().splitlines()[-1]
+        except (OSError, IndexError):
+            return None
+        return last.split(',', 1)[0]
+    
+    def _read_manifest(self):
+        layer = _data_layer()
+        with layer['lock']:
+            signature = _file_signature(LOG_MANIFEST)
+            cached = layer.get('log_manifest')
+            if cached is None or cached[0] != signature:
+                try:
+                    with open(LOG_MANIFEST, encoding='utf-8') as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError):
+                    manifest = {}
+                cached = layer['log_manifest'] = (signature, manifest)
+            return cached[1]
+    
+    def _write_manifest(self, manifest, pairs=()):
+        # Caller holds the manifest lock.
+        if pairs:
+            with open(LOG_ORDER_INDEX, 'a', encoding='utf-8') as f:
+                f.writelines(f"{order_id}\t{path}\n" for order_id, path in pairs)
+                f.flush()
+                os.fsync(f.fileno())
+        tmp = LOG_MANIFEST + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, LOG_MANIFEST)
+        layer = _data_layer()
+        with layer['lock']:
+            layer['log_manifest'] = (_file_signature(LOG_MANIFEST), manifest)
+    
+    def _manifest(self):
+        """Manifest entries for every partition, reindexing stale ones."""
+        partitions = _log_partitions()
+        manifest = self._read_manifest()
+        if all(manifest.get(path, {}).get('bytes') == os.path.getsize(path) for path in partitions):
+            return manifest
+        os.makedirs(LOG_DIR, exist_ok=True)
+        with _file_lock(LOG_MANIFEST):
+            manifest = {path: entry for path, entry in self._read_manifest().items() if path in partitions}
+            pairs = []
+            for path in partitions:
+                if manifest.get(path, {}).get('bytes') == os.path.getsize(path):
+                    continue
+                snap = _get_snapshot(path, LOG_SCHEMA)
+                manifest[path] = _partition_entry(snap['frame'], snap['signature'][1] if snap['signature'] else 0)
+                order_ids = snap['frame']['Order_ID'].dropna().astype(str).str.split().explode().dropna().unique()
+                pairs.extend((order_id, path) for order_id in order_ids)
+            self._write_manifest(manifest, pairs)
+        return manifest
+    
+    def _order_index(self):
+        """{Order_ID: set of partitions}, read incrementally from LOG_ORDER_INDEX."""
+        self._manifest()
+        layer = _data_layer()
+        with layer['lock']:
+            state = layer.get('log_orders')
+            size = os.path.getsize(LOG_ORDER_INDEX) if os.path.exists(LOG_ORDER_INDEX) else 0
+            if state is None or size < state['offset']:
+                state = layer['log_orders'] = {'offset': 0, 'partitions': {}}
+            if size > state['offset']:
+                with open(LOG_ORDER_INDEX, 'rb') as f:
+                    f.seek(state['offset'])
+                    data = f.read(size - state['offset'])
+                complete = data.rfind(b'\n') + 1
+                for line in data[:complete].decode('utf-8').splitlines():
+                    order_id, _, path = line.partition('\t')
+                    state['partitions'].setdefault(order_id, set()).add(path)
+                state['offset'] += complete
+            return state['partitions']
+    
+    def _partition_actions(self, path, actions):
+        # Per-partition Action -> row positions, cached until the partition changes.
+        snap = _get_snapshot(path, LOG_SCHEMA)
+        layer = _data_layer()
+        with layer['lock']:
+            cache = layer.setdefault('log_actions', {})
+            cached = cache.get(path)
+            if cached is None or cached[0] != snap['signature']:
+                grouped = snap['frame'].groupby('Action', observed=True, sort=False).indices
+                cached = cache[path] = (snap['signature'], grouped)
+        hits = [cached[1][action] for action in actions if action in cached[1]]
+        return snap['frame'].take(np.sort(np.concatenate(hits)) if hits else [])
+    
+    def _segment_for(self, day):
+        path = self._log_segments.get(day)
+        if path is None:
+            existing = sorted(glob.glob(os.path.join(LOG_DIR, f"{day}*.csv")), key=_segment_order)
+            path = existing[-1] if existing else os.path.join(LOG_DIR, f"{day}.csv")
+        if os.path.exists(path) and os.path.getsize(path) >= LOG_SEGMENT_BYTES:
+            path = os.path.join(LOG_DIR, f"{day}.{_segment_order(path)[1] + 1}.csv")
+        self._log_segments[day] = path
+        return path
+
+def _apply_order_updates(frame, updates):
+    """Apply journal entries by Order_ID, last write wins per (order, column).
+    Vectorized per touched column, so cost does not grow with len(updates)."""
+    if not updates:
+        return frame
+    latest = {}
+    for update in updates:
+        for col, value in update['fields'].items():
+            latest.setdefault(col, {})[update['Order_ID']] = value
+    frame = frame.copy(deep=False)
+    for col, values in latest.items():
+        mask = frame['Order_ID'].isin(list(values))
+        if not mask.any():
+            continue
+        new = _coerce(frame.loc[mask, 'Order_ID'].map(values), ORDER_SCHEMA[col])
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            missing = set(new.dropna()) - set(frame[col].cat.categories)
+            if missing:
+                frame[col] = frame[col].cat.add_categories(sorted(missing))
+        frame.loc[mask, col] = new
+    return frame
+
+def _segment_order(path):
+    parts = os.path.basename(path)[:-4].split('.')
+    return (parts[0], int(parts[1]) if len(parts) > 1 else 0)
+
+def log_segments(log_dir=LOG_DIR):
+    return sorted(glob.glob(os.path.join(log_dir, "*.csv")), key=_segment_order)
+
+def _log_partitions():
+    partitions = log_segments()
+    if os.path.exists(CSV_LOGS):
+        partitions.insert(0, CSV_LOGS)
+    return partitions
+
+def _order_tokens(value):
+    # Bulk entries record several space-separated Order_IDs in one row.
+    return value.split() if isinstance(value, str) else []
+
+def _mentions_order(series, order_id):
+    pattern = rf"(?:^|\s){re.escape(order_id)}(?:\s|$)"
+    return series.fillna('').astype(str).str.contains(pattern, regex=True).to_numpy()
+
+def _partition_entry(frame, size):
+    days = frame['Time'].dropna()
+    return {
+        'first_day': days.min().strftime('%Y-%m-%d') if len(days) else None,
+        'last_day': days.max().strftime('%Y-%m-%d') if len(days) else None,
+        'rows': len(frame),
+        'bytes': size,
+        'actions': {str(k): int(v) for k, v in frame['Action'].value_counts().items() if v}
+    }
+
+def _extend_partition_entry(entry, rows, size):
+    days = [d for d in [entry['first_day'], entry['last_day']] + [str(r.get('Time') or '')[:10] for r in rows] if d]
+    actions = dict(entry['actions'])
+    for row in rows:
+        actions[row['Action']] = actions.get(row['Action'], 0) + 1
+    return {
+        'first_day': min(days) if days else None,
+        'last_day': max(days) if days else None,
+        'rows': entry['rows'] + len(rows),
+        'bytes': size,
+        'actions': actions
+    }
+
+class SqliteStorage:
+    """Single-file SQLite engine in WAL mode with indexes on the hot filter columns."""
+    
+    name = "sqlite"
+    TABLES = {
+        'orders': ORDER_SCHEMA,
+        'payments': PAYMENT_SCHEMA,
+        'logs': LOG_SCHEMA,
+        'line_items': LINE_ITEM_SCHEMA,
+        'allocations': ALLOCATION_SCHEMA
+    }
+    INDEXES = {
+        'orders': ["Order_ID", "Brand", "Status", "WhatsApp_Sent", "Time"],
+        'payments': ["Brand", "Time"],
+        'logs': ["Log_ID", "Time", "Action", "Order_ID"],
+        'line_items': ["Order_ID", "SKU"],
+        'allocations': ["Payment_ID", "Order_ID", "Brand"]
+    }
+    
+    def __init__(self, path=SQLITE_DB):
+        self.path = path
+        self._lock = threading.RLock()
+        self._cache = {}
+        self._writes = dict.fromkeys(self.TABLES, 0)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self.init()
+    
+    def init(self):
+        with self._lock, self._conn:
+            for table, schema in self.TABLES.items():
+                cols = ", ".join(f"{c} {'REAL' if kind == 'float' else 'TEXT'}" for c, kind in schema.items())
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+                for col in self.INDEXES[table]:
+                    self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{col.lower()} ON {table}({col})")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # Order_ID -> Log_ID pairs, one per ID mentioned by a log row.
+            self._conn.execute("CREATE TABLE IF NOT EXISTS log_orders (Order_ID TEXT, Log_ID TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_log_orders_order_id ON log_orders(Order_ID)")
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'log_orders_indexed'").fetchone() is None:
+                rows = self._conn.execute("SELECT Log_ID, Order_ID FROM logs WHERE Order_ID IS NOT NULL").fetchall()
+                self._insert_log_orders([{'Log_ID': log_id, 'Order_ID': order_id} for log_id, order_id in rows])
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('log_orders_indexed', '1')")
+            # Identifies this database, so write counters from a recreated file never repeat.
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('db_id', ?)", (os.urandom(8).hex(),))
+    
+    def version(self, table='orders'):
+        # data_version moves on commits from other connections; our own writes
+        # are counted per table so a log flush does not invalidate orders.
+        if table == 'archive':
+            return _file_signature(ARCHIVE_MANIFEST)
+        with self._lock:
+            return (self._conn.execute("PRAGMA data_version").fetchone()[0], self._writes[table])
+    
+    def signature(self, table='orders'):
+        """Per-table write counter kept in the database, comparable across
+        processes and restarts (version() counts in memory)."""
+        if table == 'archive':
+            return _file_signature(ARCHIVE_MANIFEST)
+        with self._lock:
+            return tuple(self._conn.execute(
+                "SELECT key, value FROM meta WHERE key IN ('db_id', ?) ORDER BY key", (f"writes:{table}",)
+            ).fetchall())
+    
+    def _count_write(self, table):
+        # Inside the writing transaction, so the stored counter commits with the rows.
+        self._writes[table] += 1
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (f"writes:{table}",)
+        )
+    
+    def _read(self, table, sql=None, params=(), columns=None):
+        schema = self.TABLES[table]
+        columns = columns or list(schema)
+        with self._lock:
+            df = pd.read_sql_query(sql or f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid", self._conn, params=params)
+        count_io(reads=1, rows_parsed=len(df))
+        return _apply_schema(df, schema)
+    
+    def _table(self, table, columns=None):
+        # Projected loads only SELECT the requested columns; cached per projection.
+        key = (table, tuple(columns or ()))
+        version = self.version(table)
+        cached = self._cache.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, self._read(table, columns=columns))
+            self._cache[key] = cached
+        return cached[1].copy(deep=False)
+    
+    def _insert(self, table, rows):
+        columns = list(self.TABLES[table])
+        values = [tuple(_sql_value(row.get(c)) for c in columns) for row in rows]
+        placeholders = ", ".join("?" * len(columns))
+        with self._lock, self._conn:
+            self._conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", values)
+            if table == 'logs':
+                self._insert_log_orders(rows)
+            self._count_write(table)
+        count_io(writes=1)
+    
+    def _insert_log_orders(self, rows):
+        self._conn.executemany(
+            "INSERT INTO log_orders (Order_ID, Log_ID) VALUES (?, ?)",
+            [(order_id, row['Log_ID']) for row in rows for order_id in _order_tokens(row.get('Order_ID'))]
+        )
+    
+    def load_orders(self, columns=None, since=None, until=None, brands=None):
+        if since is None and until is None and not brands:
+            return self._table('orders', columns)
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("Time >= ?")
+            params.append(pd.Timestamp(since).strftime(TIME_FORMAT))
+        if until is not None:
+            clauses.append("Time < ?")
+            params.append(pd.Timestamp(until).strftime(TIME_FORMAT))
+        if brands:
+            clauses.append(f"Brand IN ({', '.join('?' * len(brands))})")
+            params.extend(brands)
+        columns = columns or ORDER_COLUMNS
+        return self._read('orders', f"SELECT {', '.join(columns)} FROM orders WHERE {' AND '.join(clauses)} ORDER BY rowid", params, columns)
+    
+    def count_orders(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    
+    def archive_orders(self, cutoff, archive):
+        """Move Completed orders with Time < cutoff into `archive`; returns how many moved."""
+        where, params = "Status = 'Completed' AND Time < ?", (pd.Timestamp(cutoff).strftime(TIME_FORMAT),)
+        with self._lock, self._conn:
+            # Held from the read to the delete, so no row is deleted unarchived.
+            self._conn.execute("BEGIN IMMEDIATE")
+            old = self._read('orders', f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders WHERE {where} ORDER BY rowid", params)
+            if old.empty:
+                return 0
+            archive.write(old, cutoff)
+            self._conn.execute(f"DELETE FROM orders WHERE {where}", params)
+            self._count_write('orders')
+        count_io(writes=1)
+        return len(old)
+    
+    def query_orders(self, brands=None, statuses=None, whatsapp_sent=None, search=None, newest_first=True):
+        clauses, params = [], []
+        for col, values in (("Brand", brands), ("Status", statuses), ("WhatsApp_Sent", whatsapp_sent)):
+            if values:
+                clauses.append(f"{col} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        if search:
+            pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            clauses.append("(Order_ID LIKE ? ESCAPE '\\' OR Customer LIKE ? ESCAPE '\\' OR Phone LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 3)
+        sql = f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY Time DESC" if newest_first else " ORDER BY rowid"
+        return self._read('orders', sql, params)
+    
+    def append_orders(self, rows):
+        self._insert('orders', rows)
+    
+    def update_orders(self, updates, from_statuses=None):
+        status_clause, status_params = "", []
+        if from_statuses is not None:
+            status_clause = f" AND Status IN ({', '.join('?' * len(from_statuses))})"
+            status_params = list(from_statuses)
+        ids = list(updates)
+        previous = {}
+        with self._lock, self._conn:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders "
+                    f"WHERE Order_ID IN ({', '.join('?' * len(chunk))}){status_clause} ORDER BY rowid",
+                    chunk + status_params
+                ).fetchall()
+                previous.update((row[0], dict(zip(ORDER_COLUMNS, row))) for row in rows)
+            for order_id in previous:
+                fields = updates[order_id]
+                self._conn.execute(
+                    f"UPDATE orders SET {', '.join(f'{col} = ?' for col in fields)} WHERE Order_ID = ?{status_clause}",
+                    [_sql_value(v) for v in fields.values()] + [order_id] + status_params
+                )
+            self._count_write('orders')
+        return list(previous.values())
+    
+    def load_payments(self, columns=None):
+        return self._table('payments', columns)
+    
+    def append_payments(self, rows):
+        self._insert('payments', rows)
+    
+    def load_line_items(self, columns=None):
+        return self._table('line_items', columns)
+    
+    def append_line_items(self, rows):
+        self._insert('line_items', rows)
+    
+    def load_allocations(self, columns=None):
+        return self._table('allocations', columns)
+    
+    def append_allocations(self, rows):
+        self._insert('allocations', rows)
+    
+    def reserve_ids(self, count):
+        """Advance the Order_ID high-water mark by `count`; returns its previous value."""
+        with self._lock, self._conn:
+            (last,) = self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('order_seq', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + ? RETURNING value",
+                (count, count)
+            ).fetchone()
+        return int(last) - count
+    
+    def load_logs(self, day=None, actions=None):
+        if day is None and not actions:
+            return self._table('logs')
+        clauses, params = [], []
+        if day is not None:
+            start = pd.Timestamp(day).normalize()
+            clauses.append("Time >= ? AND Time < ?")
+            params.extend([start.strftime(TIME_FORMAT), (start + timedelta(days=1)).strftime(TIME_FORMAT)])
+        if actions:
+            clauses.append(f"Action IN ({', '.join('?' * len(actions))})")
+            params.extend(actions)
+        return self._read('logs', f"SELECT {', '.join(LOG_COLUMNS)} FROM logs WHERE {' AND '.join(clauses)} ORDER BY rowid", params)
+    
+    def log_actions(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT Action FROM logs WHERE Action IS NOT NULL ORDER BY Action")]
+    
+    def order_timeline(self, order_id):
+        return self._read(
+            'logs',
+            f"SELECT {', '.join(LOG_COLUMNS)} FROM logs WHERE Log_ID IN "
+            "(SELECT Log_ID FROM log_orders WHERE Order_ID = ?) ORDER BY Time, rowid",
+            [order_id]
+        )
+    
+    def append_logs(self, rows):
+        self._insert('logs', rows)
+    
+    def last_log_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT MAX(Log_ID) FROM logs").fetchone()[0]
+    
+    def is_empty(self):
+        with self._lock:
+            return all(
+                self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+                for table in self.TABLES
+            )
+    
+    def import_frames(self, frames):
+        """Bulk-load {table: DataFrame} in a single transaction."""
+        with self._lock, self._conn:
+            for table, df in frames.items():
+                columns = list(self.TABLES[table])
+                values = [tuple(_sql_value(row.get(c)) for c in columns) for row in df.to_dict('records')]
+                self._conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", values
+                )
+                if table == 'logs':
+                    self._insert_log_orders(df[['Log_ID', 'Order_ID']].to_dict('records'))
+                self._count_write(table)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_csv', ?)",
+                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),)
+            )
+
+def _sql_value(value):
+    # Empty strings and NaN/NaT are stored as NULL, matching how CSV parsing reads them.
+    if value is None or value is pd.NaT or value == '' or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, datetime):
+        return value.strftime(TIME_FORMAT)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def migrate_csv_to_sqlite(db_path=SQLITE_DB):
+    """One-shot copy of the CSV orders, payments, logs, line items and payment
+    allocations into a fresh SQLite database."""
+    target = SqliteStorage(db_path)
+    if not target.is_empty():
+        raise RuntimeError(f"{db_path} already contains data; migration runs only once")
+    source = CsvStorage()
+    frames = {
+        'orders': source.load_orders(),
+        'payments': source.load_payments(),
+        'logs': source.load_logs(),
+        'line_items': source.load_line_items(),
+        'allocations': source.load_allocations()
+    }
+    target.import_frames(frames)
+    target.reserve_ids(source.reserve_ids(0))
+    return {table: len(df) for table, df in frames.items()}
+
+# Order archive: the cold tier. Each archive run writes one gzip CSV batch per
+# order month (ARCHIVE_DIR/YYYY-MM/<run>.csv.gz); ARCHIVE_MANIFEST lists the
+# batches with their row counts, time spans, Order_ID ranges and brands, the
+# horizon (every archived order is older) and the rollup of all archived rows,
+# so totals never open a batch, reads open only the batches a range overlaps
+# and an Order_ID lookup opens only the batches whose id range holds it.
+# A batch is renamed into place before the manifest lists it, and the
+# manifest is replaced before the rows leave the hot table: a crash leaves
+# an unlisted file (ignored) or rows in both tiers (the hot copy wins).
+
+class OrderArchive:
+    def __init__(self, path=ARCHIVE_DIR):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.json")
+        self._lock = threading.Lock()
+        self._manifest = (None, {'horizon': None, 'batches': [], 'rollup': []})
+        self._batches = {}
+    
+    def manifest(self):
+        with self._lock:
+            signature = _file_signature(self.manifest_path)
+            if signature is None:
+                self._manifest = (None, {'horizon': None, 'batches': [], 'rollup': []})
+            elif self._manifest[0] != signature:
+                with open(self.manifest_path, encoding='utf-8') as f:
+                    self._manifest = (signature, json.load(f))
+            return self._manifest[1]
+    
+    def horizon(self):
+        horizon = self.manifest()['horizon']
+        return pd.Timestamp(horizon) if horizon else None
+    
+    def _overlapping(self, since=None, until=None, brands=None):
+        return [
+            batch for batch in self.manifest()['batches']
+            if (since is None or pd.Timestamp(batch['last']) >= pd.Timestamp(since))
+            and (until is None or pd.Timestamp(batch['first']) < pd.Timestamp(until))
+            and (not brands or not set(brands).isdisjoint(batch['brands']))
+        ]
+    
+    def needed(self, since=None, until=None, brands=None):
+        """True if archived orders can fall in since <= Time < until."""
+        return bool(self._overlapping(since, until, brands))
+    
+    def write(self, df, horizon):
+        """Add `df` (Completed orders older than `horizon`) as new batches
+        and record them in the manifest."""
+        manifest = self.manifest()
+        run = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        batches = list(manifest['batches'])
+        for month, part in df.groupby(df['Time'].dt.strftime('%Y-%m'), sort=True):
+            name = f"{month}/{run}.csv.gz"
+            path = os.path.join(self.path, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path + ".tmp", 'wt', encoding='utf-8', newline='') as f:
+                part[ORDER_COLUMNS].to_csv(f, index=False, date_format=TIME_FORMAT)
+            with open(path + ".tmp", 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            count_io(writes=1, write_bytes=os.path.getsize(path))
+            batches.append({
+                'file': name,
+                'rows': len(part),
+                'first': part['Time'].min().strftime(TIME_FORMAT),
+                'last': part['Time'].max().strftime(TIME_FORMAT),
+                'ids': [part['Order_ID'].min(), part['Order_ID'].max()],
+                'brands': sorted(part['Brand'].dropna().astype(str).unique().tolist())
+            })
+        rollup = {tuple(entry[:3]): entry[3:] for entry in manifest['rollup']}
+        for (brand, day, status), values in _keyed_rollup(df[ROLLUP_ORDER_COLUMNS], 'orders').items():
+            _rollup_adjust(rollup, (brand, day.strftime('%Y-%m-%d') if day is not None else None, status), values)
+        horizon = pd.Timestamp(horizon).strftime(TIME_FORMAT)
+        manifest = {
+            'horizon': max(horizon, manifest['horizon'] or horizon),
+            'batches': batches,
+            'rollup': [list(key) + values for key, values in rollup.items()]
+        }
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+    
+    def _batch(self, name):
+        with self._lock:
+            frame = self._batches.pop(name, None)
+            if frame is None:
+                frame = _parse_csv(os.path.join(self.path, name), ORDER_SCHEMA)
+            self._batches[name] = frame  # most recently used last
+            while len(self._batches) > ARCHIVE_CACHE_BATCHES:
+                self._batches.pop(next(iter(self._batches)))
+            return frame
+    
+    def load(self, columns=None, since=None, until=None, brands=None):
+        """Archived orders in since <= Time < until and Brand in `brands`."""
+        frames = [self._batch(batch['file']) for batch in self._overlapping(since, until, brands)]
+        if not frames:
+            return _empty_frame(ORDER_SCHEMA, columns)
+        df = _concat_frames([frame[_time_brand_mask(frame, since, until, brands)] for frame in frames], ORDER_SCHEMA)
+        df = df.drop_duplicates('Order_ID', keep='last')
+        return df[columns] if columns else df
+    
+    def find(self, order_id):
+        """The archived row for `order_id` (empty if none), newest batch first."""
+        for batch in reversed(self.manifest()['batches']):
+            # Batches written before ids were recorded have to be opened.
+            if 'ids' in batch and not batch['ids'][0] <= order_id <= batch['ids'][1]:
+                continue
+            frame = self._batch(batch['file'])
+            found = frame[frame['Order_ID'] == order_id]
+            if not found.empty:
+                return found.tail(1)
+        return _empty_frame(ORDER_SCHEMA)
+
+@st.cache_resource
+def order_archive():
+    return OrderArchive(ARCHIVE_DIR)
+
+def archive_orders(days=ARCHIVE_AFTER_DAYS, now=None):
+    """Move Completed orders older than `days` to the archive; returns how many moved."""
+    cutoff = pd.Timestamp(now or datetime.now()) - pd.Timedelta(days=days)
+    with _view_store()['lock']:
+        moved = get_storage().archive_orders(cutoff, order_archive())
+    if moved:
+        log_action("ARCHIVE", "admin", "", f"Archived {moved} completed orders placed before {cutoff:%Y-%m-%d}")
+    return moved
+
+@st.cache_resource
+def get_storage(backend=STORAGE_BACKEND):
+    if backend == "sqlite":
+        return SqliteStorage(SQLITE_DB)
+    return CsvStorage()
+
+class OrderIdAllocator:
+    """Hands out NV-00000001-style Order_IDs from blocks reserved in storage.
+    
+    A reservation is one locked read-modify-write of the persisted high-water
+    mark, so ids never repeat across processes or restarts; within a block
+    allocation is a counter bump under a thread lock.
+    """
+    
+    def __init__(self, storage, block=ORDER_ID_BLOCK):
+        self.storage = storage
+        self.block = block
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+    
+    def allocate(self, count=1):
+        with self._lock:
+            if self._end - self._next < count:
+                # Leftovers of the current block are dropped; a bulk request gets
+                # its own contiguous run plus a fresh block for the orders after it.
+                reserve = count + self.block
+                self._next = self.storage.reserve_ids(reserve) + 1
+                self._end = self._next + reserve
+            first = self._next
+            self._next += count
+        return [f"NV-{n:08d}" for n in range(first, first + count)]
+
+@st.cache_resource
+def order_id_allocator():
+    return OrderIdAllocator(get_storage())
+
+def new_order_ids(count=1):
+    return order_id_allocator().allocate(count)
+
+# Product catalog: BRANDS compiled into arrays indexed by integer product id
+# (price, commission rate, brand id), with SKU -> id and name -> id maps.
+# Loaded from CATALOG_FILE (JSON shaped like DEFAULT_BRANDS, or a CSV of
+# Brand, Product, SKU, Price, Commission_Rate) and recompiled when it changes.
+# Products without a SKU or a numeric price are left out of the compiled
+# catalog and listed in `skipped`, so one bad entry cannot stop pricing.
+
+BRAND_DEFAULTS = {"phone": "", "color": "#4ECDC4", "iban": ""}
+
+class ProductCatalog:
+    def __init__(self, brands):
+        self.brands = brands
+        self.brand_names = list(brands)
+        self.skipped = []
+        rows = []
+        for b, (brand, data) in enumerate(brands.items()):
+            for product, info in data['products'].items():
+                try:
+                    if not isinstance(info, dict) or str(info.get('sku') or '').strip() == '':
+                        raise ValueError("no sku")
+                    rows.append((b, product, str(info['sku']), float(info['price']), float(data['commission'])))
+                except (KeyError, TypeError, ValueError) as e:
+                    self.skipped.append(f"{brand} / {product}: {'no price' if isinstance(e, KeyError) else e}")
+        brand_ids, products, skus, prices, rates = zip(*rows) if rows else ((), (), (), (), ())
+        self.brand_ids = np.array(brand_ids, dtype=np.int32)
+        self.product_names = np.array(products, dtype=object)
+        self.skus = np.array(skus, dtype=object)
+        self.prices = np.array(prices, dtype=np.float64)
+        self.commission_rates = np.array(rates, dtype=np.float64)
+        self.sku_ids = {sku: i for i, sku in enumerate(skus)}
+        self.name_ids = {name: i for i, name in enumerate(products)}
+        for label, keys, ids in (("SKU", skus, self.sku_ids), ("product name", products, self.name_ids)):
+            if len(ids) != len(keys):
+                duplicate = pd.Series(keys)[pd.Series(keys).duplicated()].iloc[0]
+                raise ValueError(f"Duplicate {label} in catalog: {duplicate}")
+        self._sku_index = pd.Index(self.skus)
+        self._name_index = pd.Index(self.product_names)
+        self._brand_products = {
+            brand: np.flatnonzero(self.brand_ids == b) for b, brand in enumerate(self.brand_names)
+        }
+        # Brand registry: one row per vendor, for joins against per-brand aggregates.
+        self.registry = pd.DataFrame({
+            'color': [data.get('color') or BRAND_DEFAULTS['color'] for data in brands.values()],
+            'phone': [data.get('phone', '') for data in brands.values()],
+            'commission': [float(data['commission']) for data in brands.values()],
+            'products': np.bincount(self.brand_ids, minlength=len(self.brand_names))
+        }, index=pd.Index(self.brand_names, name='Brand'))
+    
+    def __len__(self):
+        return len(self.skus)
+    
+    def products_of(self, brand):
+        """Product names of `brand`, in catalog order."""
+        return self.product_names[self._brand_products[brand]].tolist()
+    
+    def ids_for_skus(self, skus):
+        """Product ids for an array of SKUs, -1 where unknown (one hash probe per SKU)."""
+        return self._sku_index.get_indexer(pd.Index(skus, dtype=object))
+    
+    def price(self, ids, qty):
+        """(line totals, commission amounts) for product ids and quantities, as one gather."""
+        totals = self.prices[ids] * qty
+        return totals, totals * self.commission_rates[ids]
+    
+    def ids_for_names(self, names):
+        return self._name_index.get_indexer(pd.Index(names, dtype=object))
+    
+    def brand_of(self, ids):
+        return np.array(self.brand_names, dtype=object)[self.brand_ids[ids]]
+
+def read_catalog_file(path):
+    """Brands dict (DEFAULT_BRANDS shape) from a JSON or CSV catalog file."""
+    if path.lower().endswith('.csv'):
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        missing = {'Brand', 'Product', 'SKU', 'Price', 'Commission_Rate'} - set(df.columns)
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(sorted(missing))}")
+        df['Price'] = pd.to_numeric(df['Price'], errors='raise')
+        df['Commission_Rate'] = pd.to_numeric(df['Commission_Rate'], errors='raise')
+        brands = {}
+        for brand, group in df.groupby('Brand', sort=False):
+            first = group.iloc[0]
+            brands[brand] = {
+                "phone": first.get('Phone', ''),
+                "color": first.get('Color', '') or BRAND_DEFAULTS['color'],
+                "commission": float(first['Commission_Rate']),
+                "iban": first.get('IBAN', ''),
+                "products": {
+                    product: {"sku": sku, "price": price}
+                    for product, sku, price in zip(group['Product'], group['SKU'], group['Price'])
+                }
+            }
+        return brands
+    with open(path, encoding='utf-8') as f:
+        brands = json.load(f)
+    for brand, data in brands.items():
+        if 'commission' not in data or not isinstance(data.get('products'), dict):
+            raise ValueError(f"{path}: brand {brand} needs 'commission' and 'products'")
+        for key, value in BRAND_DEFAULTS.items():
+            data.setdefault(key, value)
+    return brands
+
+@st.cache_resource
+def _catalog_cache():
+    return {'lock': threading.Lock(), 'signature': None, 'catalog': None}
+
+def get_catalog():
+    cache = _catalog_cache()
+    with cache['lock']:
+        signature = _file_signature(CATALOG_FILE)
+        if cache['catalog'] is None or cache['signature'] != signature:
+            brands = read_catalog_file(CATALOG_FILE) if signature else DEFAULT_BRANDS
+            cache['catalog'] = ProductCatalog(brands)
+            cache['signature'] = signature
+        return cache['catalog']
+
+BRANDS = get_catalog().brands
+
+def init_databases():
+    get_storage().init()
+
+def load_orders(columns=None, since=None, until=None, brands=None, archived=False):
+    """Orders, optionally projected to `columns` and limited to
+    since <= Time < until and Brand in `brands`. With `archived`, archived
+    orders are included, read only if the range reaches into the archive."""
+    hot = get_storage().load_orders(columns, since, until, brands)
+    archive = order_archive()
+    if not archived or not archive.needed(since, until, brands):
+        return hot
+    cold = archive.load(columns, since, until, brands)
+    if 'Order_ID' in hot.columns:  # rows left in both tiers by an interrupted archive run
+        cold = cold[~cold['Order_ID'].isin(hot['Order_ID'])]
+    return _concat_frames([cold, hot], ORDER_SCHEMA)
+
+def query_orders(**filters):
+    return get_storage().query_orders(**filters)
+
+def _append_order_rows(rows):
+    _write_with_views('orders', lambda: get_storage().append_orders(rows) or rows, {
+        'order_rollup': _rollup_add_orders,
+        'order_search': lambda index, rows: index.add_rows(rows),
+        'order_sla': lambda state, rows: state.add_rows(rows),
+        'payment_ledger': lambda ledger, rows: ledger.add_orders(rows)
+    })
+    reconcile_payments()
+
+def save_order(order_data, items=()):
+    """Persist one order and its line items (dicts with SKU, Qty, Unit_Price, Commission_Amt)."""
+    try:
+        _append_order_rows([order_data])
+        if items:
+            get_storage().append_line_items([{**item, 'Order_ID': order_data['Order_ID']} for item in items])
         log_action("CREATE_ORDER", "admin", order_data['Order_ID'], f"Created {order_data['Order_ID']}")
         return True
     except Exception as e:
         st.error(f"Save error: {e}")
         return False
 
-def update_orders(df):
+# Legal status moves, keyed by target status -> statuses it may come from.
+ORDER_TRANSITIONS = {
+    'Notified': ('Pending',),
+    'Dispatched': ('Notified',),
+    'Completed': ('Dispatched',)
+}
+
+# Bulk import: read_import_file -> prepare_import (validate + price, all
+# vectorized) -> commit_import (one append, one log entry). An order with
+# any invalid line is rejected whole, and every one of its lines is reported.
+
+def read_import_file(data, name):
+    """Line items from CSV or JSON bytes, as stripped strings in IMPORT_COLUMNS.
+    
+    JSON may be a list of line objects, or of orders carrying an "items" list.
+    """
+    if name.lower().endswith('.json'):
+        records = json.loads(data)
+        if isinstance(records, dict):
+            records = records.get('orders', [records])
+        lines = []
+        for record in records:
+            items = record.get('items')
+            if isinstance(items, list):
+                order = {k: v for k, v in record.items() if k != 'items'}
+                lines.extend({**order, **item} for item in items)
+            else:
+                lines.append(record)
+        df = pd.DataFrame(lines)
+    else:
+        df = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+    canonical = {c.lower(): c for c in IMPORT_COLUMNS}
+    df = df.rename(columns=lambda c: canonical.get(str(c).strip().lower(), c))
+    for col in IMPORT_COLUMNS:
+        if col not in df.columns:
+            df[col] = ''
+    return df[IMPORT_COLUMNS].fillna('').astype(str).apply(lambda col: col.str.strip()).reset_index(drop=True)
+
+def prepare_import(lines):
+    """Validate and price imported line items.
+    
+    Returns (orders, items, errors): orders has ORDER_COLUMNS minus the
+    fields commit_import assigns; items are the accepted lines keyed by
+    their order's position; errors has one row per rejected line.
+    """
+    catalog = get_catalog()
+    ids = catalog.ids_for_skus(lines['SKU'])
+    known = ids >= 0
+    qty = pd.to_numeric(lines['Qty'], errors='coerce')
+    # One gather per column over the catalog arrays
+    priced = lines.assign(Brand=None, Product=None, Line_Total=np.nan, Line_Commission=np.nan, Commission_Rate=np.nan)
+    if known.any():
+        hit = ids[known]
+        totals, commissions = catalog.price(hit, qty[known].to_numpy())
+        priced.loc[known, 'Brand'] = catalog.brand_of(hit)
+        priced.loc[known, 'Product'] = catalog.product_names[hit]
+        priced.loc[known, 'Line_Total'] = totals
+        priced.loc[known, 'Line_Commission'] = commissions
+        priced.loc[known, 'Commission_Rate'] = catalog.commission_rates[hit]
+    key = priced['External_ID'].where(priced['External_ID'] != '', '#' + (priced.index + 1).astype(str))
+    checks = pd.DataFrame({
+        "missing Customer": priced['Customer'] == '',
+        "missing Phone": priced['Phone'] == '',
+        "unknown SKU": priced['Brand'].isna(),
+        "Qty must be a positive whole number": ~((qty > 0) & (qty % 1 == 0)),
+        "unknown Priority": ~priced['Priority'].isin(PRIORITIES + ['']),
+        "order mixes brands": priced.groupby(key)['Brand'].transform('nunique') > 1
+    })
+    line_bad = checks.any(axis=1)
+    order_bad = line_bad.groupby(key).transform('any')
+    
+    reasons = pd.Series("another line of this order is invalid", index=priced.index)
+    for message, failed in checks.items():
+        reasons = reasons.mask(failed & line_bad, np.where(reasons.str.startswith("another"), message, reasons + "; " + message))
+    errors = pd.DataFrame({
+        'Row': priced.index[order_bad] + 1,
+        'External_ID': priced.loc[order_bad, 'External_ID'],
+        'SKU': priced.loc[order_bad, 'SKU'],
+        'Error': reasons[order_bad]
+    })
+    
+    ok = priced[~order_bad].assign(Qty=qty[~order_bad].astype('int64'))
+    items = pd.DataFrame({
+        'Order': pd.factorize(key[~order_bad])[0],  # position in `orders`
+        'SKU': ok['SKU'],
+        'Qty': ok['Qty'],
+        'Unit_Price': ok['Line_Total'] / ok['Qty'],
+        'Commission_Amt': ok['Line_Commission']
+    }).reset_index(drop=True)
+    ok = ok.assign(
+        Item=ok['Product'].astype(str) + ' (x' + ok['Qty'].astype(str) + ')',
+        Ref=('Ref ' + ok['External_ID']).where(ok['External_ID'] != '', '')
+    )
+    orders = ok.groupby(key[~order_bad], sort=False).agg(
+        Brand=('Brand', 'first'),
+        Customer=('Customer', 'first'),
+        Phone=('Phone', 'first'),
+        Address=('Address', 'first'),
+        Items=('Item', ', '.join),
+        Total_Value=('Line_Total', 'sum'),
+        Commission_Amt=('Line_Commission', 'sum'),
+        Commission_Rate=('Commission_Rate', 'first'),
+        Priority=('Priority', 'first'),
+        Notes=('Notes', 'first'),
+        Ref=('Ref', 'first')
+    ).reset_index(drop=True)
+    orders['Brand_Payout'] = orders['Total_Value'] - orders['Commission_Amt']
+    orders['Priority'] = orders['Priority'].replace('', 'Standard')
+    separator = pd.Series(' · ', index=orders.index).where((orders['Ref'] != '') & (orders['Notes'] != ''), '')
+    orders['Notes'] = orders['Ref'] + separator + orders['Notes']
+    return orders.drop(columns='Ref'), items, errors.reset_index(drop=True)
+
+def commit_import(orders, items, source):
+    """Write prepared orders and their line items in one append each, with one
+    BULK_IMPORT log entry; returns the new Order_IDs."""
+    stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ids = new_order_ids(len(orders))
+    rows = orders.assign(
+        Order_ID=ids,
+        Time=stamp,
+        Status='Pending',
+        WhatsApp_Sent='NO',
+        Tracking_Num='',
+        Created_By='admin',
+        Last_Modified=stamp
+    )[ORDER_COLUMNS].to_dict('records')
+    _append_order_rows(rows)
+    get_storage().append_line_items(
+        items.assign(Order_ID=np.array(ids, dtype=object)[items['Order'].to_numpy()])[LINE_ITEM_COLUMNS].to_dict('records')
+    )
+    log_action("BULK_IMPORT", "admin", " ".join(ids), f"Imported {len(rows)} orders from {source}")
+    return ids
+
+def load_line_items(columns=None):
+    return get_storage().load_line_items(columns)
+
+ITEM_PATTERN = r"^(?P<Product>.+) \(x(?P<Qty>\d+)\)$"
+
+def parse_items(orders):
+    """Line items recovered from the Items strings of `orders`.
+    
+    Products resolve through the catalog by name. Unit prices are catalog
+    prices scaled so each order's lines add up to its Total_Value, and its
+    Commission_Amt is split pro rata. Returns (items, unparsed Order_IDs);
+    an order with any unresolvable part is left out whole.
+    """
+    parts = orders[['Order_ID', 'Items', 'Total_Value', 'Commission_Amt']].reset_index(drop=True)
+    parts = parts.assign(Item=parts['Items'].fillna('').str.split(', ')).explode('Item')
+    found = parts['Item'].str.extract(ITEM_PATTERN)
+    catalog = get_catalog()
+    ids = catalog.ids_for_names(found['Product'].fillna(''))
+    qty = pd.to_numeric(found['Qty'], errors='coerce')
+    bad_part = (ids < 0) | qty.isna().to_numpy()
+    bad = pd.Series(bad_part, index=parts.index).groupby(level=0).transform('any').to_numpy()
+    
+    ok = parts[~bad].assign(Qty=qty[~bad], Product_ID=ids[~bad])
+    list_total = catalog.prices[ok['Product_ID'].to_numpy()] * ok['Qty'].to_numpy()
+    order_list_total = pd.Series(list_total, index=ok.index).groupby(level=0).transform('sum')
+    scale = (ok['Total_Value'] / order_list_total).where((order_list_total > 0) & ok['Total_Value'].notna(), 1.0)
+    line_total = list_total * scale
+    share = (line_total / ok['Total_Value']).where(ok['Total_Value'] > 0, 0.0)
+    items = pd.DataFrame({
+        'Order_ID': ok['Order_ID'],
+        'SKU': catalog.skus[ok['Product_ID'].to_numpy()],
+        'Qty': ok['Qty'],
+        'Unit_Price': line_total / ok['Qty'],
+        'Commission_Amt': ok['Commission_Amt'].fillna(0) * share
+    }).reset_index(drop=True)
+    return items, parts.loc[bad, 'Order_ID'].unique().tolist()
+
+def backfill_line_items():
+    """Parse line items for orders that have none; one append. Returns (lines written, unparsed Order_IDs)."""
+    orders = load_orders(columns=['Order_ID', 'Items', 'Total_Value', 'Commission_Amt'], archived=True)
+    missing = orders[~orders['Order_ID'].isin(load_line_items(columns=['Order_ID'])['Order_ID'])]
+    items, unparsed = parse_items(missing)
+    if len(items):
+        get_storage().append_line_items(items.to_dict('records'))
+        log_action("BACKFILL_ITEMS", "admin", "", f"Parsed {len(items)} line items for {items['Order_ID'].nunique()} orders")
+    return len(items), unparsed
+
+def transition_many(updates, to_status=None):
+    """Apply one status move to many orders in a single persisted write.
+    
+    `updates` maps Order_ID -> extra fields for that order (e.g. its
+    Tracking_Num). Orders whose current status cannot legally move to
+    `to_status` are skipped. Returns the Order_IDs that were updated.
+    """
     try:
-        df.to_csv(CSV_ORDERS, index=False)
-        return True
-    except: return False
+        return _transition_many(updates, to_status)
+    except (OSError, sqlite3.Error) as e:
+        st.error(f"Update error: {e}")
+        return []
+
+def _transition_many(updates, to_status=None):
+    # transition_many without the UI error handling: storage errors raise.
+    if to_status is not None and to_status not in ORDER_TRANSITIONS:
+        raise ValueError(f"Unknown status: {to_status}")
+    stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    extra = {'Status': to_status} if to_status is not None else {}
+    updates = {oid: {**fields, **extra, 'Last_Modified': stamp} for oid, fields in updates.items()}
+    if not updates:
+        return []
+    appliers = {
+        'order_rollup': lambda rollup, rows: _rollup_move_orders(rollup, rows, updates),
+        'order_search': lambda index, rows: index.apply_updates(rows, updates),
+        'order_sla': lambda state, rows: state.apply_updates(rows, updates)
+    }
+    if not any(col in fields for fields in updates.values() for col in PaymentLedger.ORDER_COLUMNS):
+        # Status, tracking and notification changes leave what an order is owed alone.
+        appliers['payment_ledger'] = lambda ledger, rows: None
+    previous = _write_with_views(
+        'orders',
+        lambda: get_storage().update_orders(updates, ORDER_TRANSITIONS.get(to_status)) or None,
+        appliers
+    )
+    return [row['Order_ID'] for row in previous or []]
+
+def transition(order_id, to_status=None, **fields):
+    """Update one order by Order_ID, persisting only that row.
+    
+    With `to_status`, the move must be legal from the order's current status;
+    returns False if it is not (e.g. another operator already moved it).
+    """
+    return order_id in transition_many({order_id: fields}, to_status)
+
+def load_payments(columns=None):
+    return get_storage().load_payments(columns)
 
-def load_payments():
+def save_payment(payment_data):
     try:
-        if os.path.exists(CSV_PAYMENTS):
-            return pd.read_csv(CSV_PAYMENTS)
-    except: pass
-    return pd.DataFrame()
+        _write_with_views('payments', lambda: get_storage().append_payments([payment_data]) or [payment_data], {
+            'payment_rollup': _rollup_add_payments,
+            'payment_ledger': lambda ledger, rows: ledger.add_payments(rows)
+        })
+        reconcile_payments()
+        log_action("PAYMENT", "admin", "", f"Paid {payment_data['Brand']}")
+        return True
+    except (OSError, ValueError, sqlite3.Error) as e:
+        st.error(f"Payment error: {e}")
+        return False
+
+# Derived views: structures computed from one or more tables (rollups,
+# search index, ledger) and tagged with the storage versions they reflect.
+# Writes made through this module patch every current view of the table in
+# place; a view is rebuilt from scratch only when one of its tables changed
+# behind our back.
+
+@st.cache_resource
+def _view_store():
+    return {'lock': threading.RLock(), 'data': {}, 'versions': {}, 'frames': {}}
+
+def _view_tables(name):
+    tables = _VIEW_TABLES[name]
+    return (tables,) if isinstance(tables, str) else tables
+
+def _view_version(storage, name):
+    return tuple(storage.version(table) for table in _view_tables(name))
+
+def _write_with_views(table, write, appliers):
+    """Run `write`, then fold its result into the views of `table`.
+    
+    `write` returns what each `appliers[name](view, result)` needs, or None
+    if nothing was written. Views without an applier are dropped and rebuilt
+    on next use.
+    """
+    store = _view_store()
+    storage = get_storage()
+    with store['lock']:
+        fresh = {
+            name for name in appliers
+            if store['data'].get(name) is not None and store['versions'].get(name) == _view_version(storage, name)
+        }
+        result = write()
+        if result is None:
+            return result
+        for name in _VIEW_TABLES:
+            if table not in _view_tables(name):
+                continue
+            if name in fresh:
+                appliers[name](store['data'][name], result)
+                store['versions'][name] = _view_version(storage, name)
+            else:
+                store['data'][name] = None
+            store['frames'].pop(name, None)
+        return result
+
+def _get_view(name):
+    store = _view_store()
+    storage = get_storage()
+    with store['lock']:
+        version = _view_version(storage, name)
+        if store['data'].get(name) is None or store['versions'].get(name) != version:
+            store['data'][name] = _VIEW_BUILDERS[name]()
+            store['versions'][name] = version
+            store['frames'].pop(name, None)
+        return store['data'][name]
+
+# Rollups: order totals per (Brand, Day, Status) and payment totals per
+# (Brand, Day), kept as {key: [measures]} and adjusted by every order write,
+# transition and payment.
+
+ORDER_MEASURES = ['Orders', 'Notified', 'Unnotified', 'Total_Value', 'Commission_Amt', 'Brand_Payout']
+PAYMENT_MEASURES = ['Payments', 'Amount']
+
+def _label(value):
+    return None if value is None or (not isinstance(value, str) and pd.isna(value)) else str(value)
+
+def _day(value):
+    ts = pd.to_datetime(value, format=TIME_FORMAT, errors='coerce') if isinstance(value, str) else pd.Timestamp(value) if value is not None else pd.NaT
+    return None if pd.isna(ts) else ts.normalize()
+
+def _amount(value):
+    value = pd.to_numeric(value, errors='coerce')
+    return 0.0 if pd.isna(value) else float(value)
+
+def _order_contribution(row):
+    key = (_label(row.get('Brand')), _day(row.get('Time')), _label(row.get('Status')))
+    return key, [
+        1,
+        int(row.get('WhatsApp_Sent') == 'YES'),
+        int(row.get('WhatsApp_Sent') == 'NO'),
+        _amount(row.get('Total_Value')),
+        _amount(row.get('Commission_Amt')),
+        _amount(row.get('Brand_Payout'))
+    ]
+
+def _rollup_adjust(rollup, key, values, sign=1):
+    current = rollup.setdefault(key, [0] * len(values))
+    for i, value in enumerate(values):
+        current[i] += sign * value
+    if current[0] == 0:
+        del rollup[key]
+
+def _rollup_add_orders(rollup, rows):
+    for row in rows:
+        _rollup_adjust(rollup, *_order_contribution(row))
+
+def _rollup_move_orders(rollup, previous, updates):
+    for row in previous:
+        _rollup_adjust(rollup, *_order_contribution(row), sign=-1)
+        _rollup_adjust(rollup, *_order_contribution({**row, **updates[row['Order_ID']]}))
+
+def _rollup_add_payments(rollup, rows):
+    for row in rows:
+        key = (_label(row.get('Brand')), _day(row.get('Time')))
+        _rollup_adjust(rollup, key, [1, _amount(row.get('Amount'))])
+
+ROLLUP_ORDER_COLUMNS = ['Brand', 'Time', 'Status', 'WhatsApp_Sent', 'Total_Value', 'Commission_Amt', 'Brand_Payout']
+
+def _build_rollup(table):
+    storage = get_storage()
+    if table == 'orders':
+        rollup = _keyed_rollup(storage.load_orders(columns=ROLLUP_ORDER_COLUMNS), table)
+        # Archived orders never change; their totals come from the manifest.
+        for brand, day, status, *values in order_archive().manifest()['rollup']:
+            _rollup_adjust(rollup, (brand, pd.Timestamp(day) if day else None, status), values)
+        return rollup
+    return _keyed_rollup(storage.load_payments(columns=['Brand', 'Time', 'Amount']), table)
+
+def _keyed_rollup(df, table):
+    if table == 'orders':
+        keyed = pd.DataFrame({
+            'Brand': df['Brand'].astype(object),
+            'Day': df['Time'].dt.normalize(),
+            'Status': df['Status'].astype(object),
+            'Orders': 1,
+            'Notified': (df['WhatsApp_Sent'] == 'YES').astype(int),
+            'Unnotified': (df['WhatsApp_Sent'] == 'NO').astype(int),
+            'Total_Value': df['Total_Value'].fillna(0),
+            'Commission_Amt': df['Commission_Amt'].fillna(0),
+            'Brand_Payout': df['Brand_Payout'].fillna(0)
+        })
+        keys, measures = ['Brand', 'Day', 'Status'], ORDER_MEASURES
+    else:
+        keyed = pd.DataFrame({
+            'Brand': df['Brand'].astype(object),
+            'Day': df['Time'].dt.normalize(),
+            'Payments': 1,
+            'Amount': df['Amount'].fillna(0)
+        })
+        keys, measures = ['Brand', 'Day'], PAYMENT_MEASURES
+    if keyed.empty:
+        return {}
+    grouped = keyed.groupby(keys, dropna=False, sort=False)[measures].sum()
+    return {
+        tuple(None if pd.isna(k) else k for k in key): values
+        for key, values in zip(grouped.index, grouped.to_numpy().tolist())
+    }
+
+def _rollup_frame(name):
+    rollup = _get_view(name)
+    store = _view_store()
+    with store['lock']:
+        if name not in store['frames']:
+            keys = ['Brand', 'Day', 'Status'] if name == 'order_rollup' else ['Brand', 'Day']
+            measures = ORDER_MEASURES if name == 'order_rollup' else PAYMENT_MEASURES
+            frame = pd.DataFrame([key + tuple(values) for key, values in rollup.items()], columns=keys + measures)
+            frame['Day'] = pd.to_datetime(frame['Day'])
+            store['frames'][name] = frame
+        return store['frames'][name]
+
+def order_rollup():
+    """Order counts and money totals per (Brand, Day, Status)."""
+    return _rollup_frame('order_rollup')
+
+def payment_rollup():
+    """Payment counts and amounts per (Brand, Day)."""
+    return _rollup_frame('payment_rollup')
+
+# Order search index: built once per orders version and patched on writes.
+# Order_IDs support exact and prefix lookup, customer names and ID parts
+# ("NV-0001" -> "nv", "0001") token-prefix lookup, phones substring lookup on
+# their digits (every suffix of PHONE_MIN_DIGITS or more is indexed, so a
+# prefix hit on a suffix is a match anywhere in the number). Brand and Status
+# filters are packed bitmaps. Positions refer to rows of load_orders().
+
+SEARCH_DELTA_MAX = 512
+PHONE_MIN_DIGITS = 3
+_TOKEN_SPLIT = re.compile(r"[\s\-_/.,]+")
+_TOP = "\U0010ffff"
+
+def _digit_suffixes(digits):
+    return [digits[i:] for i in range(len(digits) - PHONE_MIN_DIGITS + 1)]
+
+def _sorted_postings(keys, positions, dtype=object):
+    # dtype=str (fixed width) sorts several times faster; used for the short digit keys.
+    keys = np.asarray(keys, dtype=dtype)
+    order = np.argsort(keys, kind='stable')
+    return keys[order], np.asarray(positions, dtype=np.int64)[order]
+
+def _prefix_hits(keys, positions, delta, prefix, exact=False):
+    hi_key = prefix if exact else prefix + _TOP
+    lo = np.searchsorted(keys, prefix, 'left')
+    hi = np.searchsorted(keys, hi_key, 'right')
+    extra = [p for k, p in delta if (k == prefix if exact else k.startswith(prefix))]
+    return np.concatenate([positions[lo:hi], np.asarray(extra, dtype=np.int64)])
+
+class OrderSearchIndex:
+    FILTERS = ('Brand', 'Status', 'WhatsApp_Sent')
+    
+    def __init__(self, df):
+        df = df.reset_index(drop=True)
+        self.size = len(df)
+        positions = np.arange(self.size)
+        ids = df['Order_ID'].fillna('').astype(str).str.lower()
+        self.ids, self.id_pos = _sorted_postings(ids.to_numpy(), positions)
+        
+        words = pd.concat([
+            df['Customer'].fillna('').astype(str).str.lower(),
+            ids
+        ]).str.split(_TOKEN_SPLIT).explode()
+        words = words[words.fillna('') != '']
+        self.tokens, self.token_pos = _sorted_postings(words.to_numpy(), words.index.to_numpy())
+        
+        digits = df['Phone'].fillna('').astype(str).str.replace(r"\D", "", regex=True)
+        lengths = digits.str.len().to_numpy()
+        starts = range(max(0, int(lengths.max(initial=0)) - PHONE_MIN_DIGITS + 1))
+        keep = [lengths - start >= PHONE_MIN_DIGITS for start in starts]
+        self.phones, self.phone_pos = _sorted_postings(
+            np.concatenate([np.empty(0, dtype=str)] + [digits.str[start:].to_numpy(dtype=str)[k] for start, k in zip(starts, keep)]),
+            np.concatenate([np.empty(0, dtype=np.int64)] + [positions[k] for k in keep]),
+            str
+        )
+        
+        self.delta = {'ids': [], 'tokens': [], 'phones': []}
+        self.bitmaps = {}
+        for col in self.FILTERS:
+            values = df[col].astype(object).to_numpy()
+            self.bitmaps[col] = {
+                value: np.packbits(values == value, bitorder='little')
+                for value in pd.unique(values) if isinstance(value, str)
+            }
+    
+    def _set_bit(self, col, value, pos, on=True):
+        if not isinstance(value, str):
+            return
+        bitmap = self.bitmaps[col].get(value)
+        needed = (self.size + 7) // 8
+        if bitmap is None or len(bitmap) < needed:
+            grown = np.zeros(max(needed, 2 * (len(bitmap) if bitmap is not None else 0)), dtype=np.uint8)
+            if bitmap is not None:
+                grown[:len(bitmap)] = bitmap
+            bitmap = self.bitmaps[col][value] = grown
+        if on:
+            bitmap[pos >> 3] |= np.uint8(1 << (pos & 7))
+        else:
+            bitmap[pos >> 3] &= np.uint8(~(1 << (pos & 7)) & 0xFF)
+    
+    def add_rows(self, rows):
+        for row in rows:
+            pos = self.size
+            self.size += 1
+            oid = str(row.get('Order_ID') or '').lower()
+            self.delta['ids'].append((oid, pos))
+            for word in _TOKEN_SPLIT.split(f"{row.get('Customer') or ''} {oid}".lower()):
+                if word:
+                    self.delta['tokens'].append((word, pos))
+            digits = re.sub(r"\D", "", str(row.get('Phone') or ''))
+            self.delta['phones'].extend((suffix, pos) for suffix in _digit_suffixes(digits))
+            for col in self.FILTERS:
+                self._set_bit(col, row.get(col), pos)
+        if len(self.delta['tokens']) > SEARCH_DELTA_MAX:
+            self._merge_delta()
+    
+    def _merge_delta(self):
+        for name, keys, positions, dtype in (
+            ('ids', 'ids', 'id_pos', object), ('tokens', 'tokens', 'token_pos', object),
+            ('phones', 'phones', 'phone_pos', str)
+        ):
+            if self.delta[name]:
+                new_keys, new_pos = zip(*self.delta[name])
+                merged = _sorted_postings(
+                    np.concatenate([getattr(self, keys), np.asarray(new_keys, dtype=dtype)]),
+                    np.concatenate([getattr(self, positions), np.asarray(new_pos, dtype=np.int64)]),
+                    dtype
+                )
+                setattr(self, keys, merged[0])
+                setattr(self, positions, merged[1])
+                self.delta[name] = []
+    
+    def positions_of(self, order_id):
+        return _prefix_hits(self.ids, self.id_pos, self.delta['ids'], str(order_id).lower(), exact=True)
+    
+    def apply_updates(self, previous, updates):
+        for row in previous:
+            fields = updates[row['Order_ID']]
+            for col in self.FILTERS:
+                if col in fields and fields[col] != row.get(col):
+                    for pos in self.positions_of(row['Order_ID']):
+                        self._set_bit(col, row.get(col), pos, on=False)
+                        self._set_bit(col, fields[col], pos)
+    
+    def _text_hits(self, text):
+        text = text.strip().lower()
+        hits = None
+        for term in (t for t in _TOKEN_SPLIT.split(text) if t):
+            term_hits = _prefix_hits(self.tokens, self.token_pos, self.delta['tokens'], term)
+            hits = term_hits if hits is None else np.intersect1d(hits, term_hits)
+        hits = np.unique(np.concatenate([
+            hits if hits is not None else np.empty(0, dtype=np.int64),
+            _prefix_hits(self.ids, self.id_pos, self.delta['ids'], text)
+        ]))
+        digits = re.sub(r"\D", "", text)
+        if len(digits) >= PHONE_MIN_DIGITS and re.fullmatch(r"[\d\s+()\-.]+", text):
+            hits = np.union1d(hits, _prefix_hits(self.phones, self.phone_pos, self.delta['phones'], digits))
+        return hits
+    
+    def search(self, text=None, brands=None, statuses=None, whatsapp_sent=None):
+        """Return sorted row positions matching all given criteria."""
+        selected = None
+        for col, values in (('Brand', brands), ('Status', statuses), ('WhatsApp_Sent', whatsapp_sent)):
+            if values:
+                nbytes = (self.size + 7) // 8
+                combined = np.zeros(nbytes, dtype=np.uint8)
+                for value in values:
+                    bitmap = self.bitmaps[col].get(value)
+                    if bitmap is not None:
+                        combined[:min(nbytes, len(bitmap))] |= bitmap[:nbytes]
+                selected = combined if selected is None else selected & combined
+        if text and text.strip():
+            hits = self._text_hits(text)
+            if selected is not None:
+                hits = hits[(selected[hits >> 3] >> (hits & 7)) & 1 == 1]
+            return hits
+        if selected is None:
+            return np.arange(self.size)
+        return np.flatnonzero(np.unpackbits(selected, bitorder='little')[:self.size])
+
+def order_search_index():
+    return _get_view('order_search')
+
+def search_orders(text=None, brands=None, statuses=None, since=None, until=None):
+    """All Orders search through the index, newest first, limited to
+    since <= Time < until. A range reaching back past the archive horizon
+    also searches archived orders (by substring, like query_orders)."""
+    index = order_search_index()
+    df = load_orders()
+    if index.size != len(df):  # the table moved between the two reads
+        found = query_orders(brands=brands, statuses=statuses, search=text)
+    else:
+        found = df.iloc[index.search(text, brands, statuses)]
+    if since is not None or until is not None:
+        found = found[_time_brand_mask(found, since, until)]
+        archive = order_archive()
+        if (not statuses or 'Completed' in statuses) and archive.needed(since, until, brands):
+            cold = _filter_orders(archive.load(since=since, until=until, brands=brands), statuses=statuses, search=text)
+            found = _concat_frames([found, cold[~cold['Order_ID'].isin(df['Order_ID'])]], ORDER_SCHEMA)
+    return found.sort_values('Time', ascending=False)
+
+_VIEW_TABLES = {
+    'order_rollup': ('orders', 'archive'), 'payment_rollup': 'payments', 'order_search': 'orders', 'order_sla': 'orders',
+    'payment_ledger': ('orders', 'archive', 'payments', 'allocations')
+}
+_VIEW_BUILDERS = {
+    'order_rollup': lambda: _build_rollup('orders'),
+    'payment_rollup': lambda: _build_rollup('payments'),
+    'order_search': lambda: OrderSearchIndex(get_storage().load_orders(columns=['Order_ID', 'Customer', 'Phone', *OrderSearchIndex.FILTERS])),
+    'order_sla': lambda: sla_state(sla_rules()),
+    'payment_ledger': lambda: PaymentLedger(
+        load_orders(columns=PaymentLedger.ORDER_COLUMNS, archived=True),
+        get_storage().load_payments(columns=PaymentLedger.PAYMENT_COLUMNS),
+        get_storage().load_allocations(columns=['Payment_ID', 'Order_ID', 'Amount'])
+    )
+}
+
+# Audit log: entries are queued in memory and a background thread appends them
+# to the storage engine in batches.
+
+class AuditLogWriter:
+    def __init__(self, storage):
+        self.storage = storage
+        self.last_error = None
+        self._pending = []
+        self._cond = threading.Condition()  # guards _pending only, never held across I/O
+        self._flushing = threading.Lock()  # one flush at a time, so batches land in order
+        self._last_us = self._last_logged_us()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+    
+    def _last_logged_us(self):
+        last_id = self.storage.last_log_id()
+        try:
+            return round(datetime.strptime(last_id[4:], '%Y%m%d%H%M%S%f').timestamp() * 1_000_000)
+        except (TypeError, ValueError):
+            return 0
+    
+    def write(self, action, user, order_id, details):
+        with self._cond:
+            # Microsecond IDs, bumped on collision so they stay unique and monotonic.
+            self._last_us = max(self._last_us + 1, time.time_ns() // 1000)
+            stamp = datetime.fromtimestamp(self._last_us / 1_000_000)
+            log_id = f"LOG-{stamp.strftime('%Y%m%d%H%M%S%f')}"
+            self._pending.append({
+                'Log_ID': log_id,
+                'Time': stamp.strftime('%Y-%m-%d %H:%M:%S'),
+                'Action': action,
+                'User': user,
+                'Order_ID': order_id,
+                'Details': details
+            })
+            if len(self._pending) >= LOG_FLUSH_BATCH:
+                self._cond.notify()
+        return log_id
+    
+    def flush(self):
+        with self._flushing:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return True
+            try:
+                self.storage.append_logs(batch)
+                self.last_error = None
+                return True
+            except (OSError, sqlite3.Error) as e:
+                with self._cond:
+                    self._pending = batch + self._pending
+                self.last_error = f"{type(e).__name__}: {e}"
+                return False
+    
+    def close(self):
+        self._closed = True
+        with self._cond:
+            self._cond.notify()
+        self.flush()
+    
+    def _run(self):
+        while not self._closed:
+            with self._cond:
+                self._cond.wait(LOG_FLUSH_INTERVAL)
+            if not self.flush():
+                time.sleep(LOG_FLUSH_INTERVAL * 4)
+
+@st.cache_resource
+def get_log_writer():
+    writer = AuditLogWriter(get_storage())
+    atexit.register(writer.close)
+    return writer
+
+def load_logs(day=None, actions=None):
+    """Audit log rows, optionally for one day and/or a set of actions."""
+    get_log_writer().flush()
+    return get_storage().load_logs(day, actions)
+
+def log_actions():
+    get_log_writer().flush()
+    return get_storage().log_actions()
+
+def order_timeline(order_id):
+    """Every log row that mentions `order_id`, oldest first."""
+    get_log_writer().flush()
+    return get_storage().order_timeline(order_id)
+
+def log_action(action, user, order_id, details):
+    return get_log_writer().write(action, user, order_id, details)
+
+def export_to_csv(df):
+    csv = df.to_csv(index=False, date_format=TIME_FORMAT)
+    return csv
+
+# Exports are built on demand by a background thread: rows are filtered
+# first, then serialized EXPORT_CHUNK_ROWS at a time straight into a file
+# under EXPORT_DIR (plain CSV, gzip, or a zip bundle), so the full CSV is
+# never held as one string. A finished file is reused until the version of
+# its source table changes.
+
+EXPORTS = {
+    'orders': ('orders', None),
+    'commission': ('orders', ['Order_ID', 'Time', 'Brand', 'Commission_Amt', 'Status']),
+    'payments': ('payments', None)
+}
+EXPORT_EXTENSIONS = {'csv': 'csv', 'gzip': 'csv.gz', 'zip': 'zip', 'parquet': 'parquet'}
+EXPORT_MIME = {
+    'csv': 'text/csv',
+    'gzip': 'application/gzip',
+    'zip': 'application/zip',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+def export_frame(kind, start=None, end=None, brands=None):
+    """Rows of export `kind` with Time in [start, end] (days) and Brand in `brands`."""
+    table, columns = EXPORTS[kind]
+    until = pd.Timestamp(end) + pd.Timedelta(days=1) if end is not None else None
+    if table == 'orders':
+        return load_orders(columns, since=start, until=until, brands=brands, archived=True)
+    df = load_payments(columns)
+    mask = _time_brand_mask(df, start, until, brands)
+    return df if mask.all() else df[mask]
+
+def _write_csv_chunks(df, f, progress):
+    for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+        f.write(chunk.to_csv(index=False, header=start == 0, date_format=TIME_FORMAT).encode('utf-8'))
+        progress(len(chunk))
+
+def write_export(path, frames, fmt, progress=lambda n: None):
+    """Serialize {name: frame} to `path`: one CSV ('csv'/'gzip') or a zip of all."""
+    tmp = path + ".tmp"
+    if fmt == 'zip':
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as bundle:
+            for name, df in frames.items():
+                with bundle.open(f"{name}.csv", 'w', force_zip64=True) as f:
+                    _write_csv_chunks(df, f, progress)
+    elif fmt == 'parquet':
+        (df,) = frames.values()
+        schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+        with pq.ParquetWriter(tmp, schema) as writer:
+            for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+                chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                progress(len(chunk))
+    else:
+        (df,) = frames.values()
+        with (gzip.open if fmt == 'gzip' else open)(tmp, 'wb') as f:
+            _write_csv_chunks(df, f, progress)
+    os.replace(tmp, path)
+
+def read_export(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+@st.cache_resource
+def _export_jobs():
+    # Files from a previous process cannot be matched to a table version.
+    for path in glob.glob(os.path.join(EXPORT_DIR, "*")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return {'lock': threading.RLock(), 'jobs': {}}
+
+def export_job(key):
+    """The job for `key` = (name, fmt, filters, version), if it is usable."""
+    registry = _export_jobs()
+    with registry['lock']:
+        job = registry['jobs'].get(key)
+        if job is None or job['state'] == 'failed' or (job['state'] == 'done' and not os.path.exists(job['path'])):
+            return None
+        return job
+
+def start_export(key, frames):
+    """Serialize `frames` in a background thread; returns the job dict."""
+    name, fmt = key[:2]
+    registry = _export_jobs()
+    with registry['lock']:
+        job = export_job(key)
+        if job is not None:
+            return job
+        # Superseded versions of the same export are dropped with their files
+        for old_key in [k for k in registry['jobs'] if k[:3] == key[:3]]:
+            old = registry['jobs'].pop(old_key)
+            if old['state'] != 'running' and os.path.exists(old['path']):
+                os.remove(old['path'])
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        job = {
+            'state': 'running',
+            'done': 0,
+            'total': sum(len(df) for df in frames.values()),
+            'error': None,
+            'path': os.path.join(EXPORT_DIR, f"{name}_{digest}.{EXPORT_EXTENSIONS[fmt]}")
+        }
+        registry['jobs'][key] = job
+    
+    def progress(n):
+        job['done'] += n
+    
+    def run():
+        try:
+            write_export(job['path'], frames, fmt, progress)
+            job['state'] = 'done'
+        except Exception as e:  # a dying thread would leave the job 'running' forever
+            job['error'] = f"{type(e).__name__}: {e}"
+            job['state'] = 'failed'
+            for partial in (job['path'] + ".tmp", job['path']):
+                if os.path.exists(partial):
+                    os.remove(partial)
+    
+    threading.Thread(target=run, name=f"export-{name}", daemon=True).start()
+    return job
+
+# Brand notifications: one queued job per brand carries the Order_IDs to
+# announce; a worker pool sends one message listing them, spaced to
+# NOTIFY_PER_MINUTE, retrying with exponential backoff, then marks the orders
+# Notified in one write. Jobs are journaled to NOTIFY_QUEUE_FILE so queued and
+# retrying work survives a restart. Transports take (phone, text) and raise
+# on failure.
+
+class HttpTransport:
+    """POSTs {"to", "text"} JSON to a gateway URL (WhatsApp API bridge or the stub)."""
+    
+    def __init__(self, url, token=None, timeout=NOTIFY_TIMEOUT):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+    
+    def send(self, phone, text):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        body = json.dumps({'to': phone, 'text': text}).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+def whatsapp_link(phone, text):
+    digits = re.sub(r"\D", "", str(phone))
+    return f"https://wa.me/{digits}?text={urllib.parse.quote(text)}"
+
+def brand_message(brand, orders):
+    """One WhatsApp message listing every order in `orders` for the brand."""
+    lines = [f"NATUVISIO · {brand} · {len(orders)} new order(s)"]
+    for row in orders.to_dict('records'):
+        text = {k: '' if pd.isna(v) else v for k, v in row.items()}
+        lines.append(
+            f"• {text['Order_ID']} | {text['Customer']} | {text['Phone']} | {text['Address']}\n"
+            f"  {text['Items']} | {row['Total_Value']:,.0f}₺"
+            + (f" | {text['Priority']}" if text['Priority'] not in ('', 'Standard') else "")
+        )
+    return "\n".join(lines)
+
+class NotificationQueue:
+    def __init__(self, transport, path=NOTIFY_QUEUE_FILE, workers=NOTIFY_WORKERS, per_minute=NOTIFY_PER_MINUTE):
+        self.transport = transport
+        self.path = path
+        self.interval = 60.0 / per_minute
+        # brand -> {'orders', 'attempts', 'due', 'state', 'error', 'sent'}; 'sent'
+        # holds orders already messaged whose Notified write failed.
+        self.jobs = {}
+        self.sent = 0
+        self._cond = threading.Condition()
+        self._next_send = 0.0
+        self._closed = False
+        self._replay()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"notify-{n}", daemon=True) for n in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # torn last line
+                if event['op'] == 'done':
+                    self.jobs.pop(event['brand'], None)
+                else:
+                    self.jobs[event['brand']] = {**event['job'], 'state': 'failed' if event['op'] == 'failed' else 'queued'}
+        # Compact to one line per live job.
+        with _file_lock(self.path):
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for brand, job in self.jobs.items():
+                    f.write(json.dumps({'op': 'failed' if job['state'] == 'failed' else 'job', 'brand': brand, 'job': job}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+    
+    def _journal(self, op, brand, job=None):
+        # Caller holds self._cond.
+        with _file_lock(self.path), open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'op': op, 'brand': brand, 'job': job}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def enqueue(self, brand, order_ids):
+        """Queue `order_ids` for `brand`, merging into the brand's pending job."""
+        with self._cond:
+            job = self.jobs.get(brand)
+            if job is None or job['state'] == 'failed':
+                job = {'orders': [], 'attempts': 0, 'due': 0.0, 'error': None, 'state': 'queued'}
+            job['orders'] = list(dict.fromkeys([*job['orders'], *order_ids]))
+            if job['state'] != 'sending':
+                job['state'] = 'queued'
+            self.jobs[brand] = job
+            self._journal('job', brand, job)
+            self._cond.notify()
+    
+    def status(self):
+        with self._cond:
+            return {brand: dict(job) for brand, job in self.jobs.items()}
+    
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+    
+    def _claim(self):
+        # Caller holds self._cond; returns (brand, orders, sent) of a due job or None.
+        now = time.time()
+        for brand, job in self.jobs.items():
+            if job['state'] == 'queued' and job['due'] <= now:
+                job['state'] = 'sending'
+                return brand, list(job['orders']), list(job.get('sent', ()))
+        return None
+    
+    def _wait_for_slot(self):
+        with self._cond:
+            now = time.monotonic()
+            wait = max(0.0, self._next_send - now)
+            self._next_send = max(now, self._next_send) + self.interval
+        if wait:
+            time.sleep(wait)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                claimed = self._claim()
+                while claimed is None and not self._closed:
+                    due = [job['due'] for job in self.jobs.values() if job['state'] == 'queued']
+                    self._cond.wait(max(0.05, min(due) - time.time()) if due else None)
+                    claimed = self._claim()
+                if claimed is None:
+                    return
+            self._deliver(*claimed)
+    
+    def _mark_sent(self, brand, order_ids):
+        # Storage errors raise into _deliver, so the job is retried rather than dropped.
+        done = _transition_many({oid: {'WhatsApp_Sent': 'YES'} for oid in order_ids}, 'Notified')
+        if done:
+            log_action("NOTIFY", "queue", " ".join(done), f"Notified {brand} ({len(done)} orders)")
+    
+    def _deliver(self, brand, order_ids, sent):
+        try:
+            if sent:
+                # Messaged on an earlier attempt: only the write is retried.
+                self._mark_sent(brand, sent)
+                sent = []
+            orders = load_orders(columns=['Order_ID', 'Customer', 'Phone', 'Address', 'Items', 'Total_Value', 'Priority', 'WhatsApp_Sent'])
+            orders = orders[orders['Order_ID'].isin(order_ids) & (orders['WhatsApp_Sent'] == 'NO')]
+            if not orders.empty:
+                self._wait_for_slot()
+                self.transport.send(get_catalog().brands[brand]['phone'], brand_message(brand, orders))
+                sent = orders['Order_ID'].tolist()
+                self._mark_sent(brand, sent)
+                sent = []
+            error = None
+        except Exception as e:  # transport errors are open-ended; all of them retry
+            error = f"{type(e).__name__}: {e}"
+        with self._cond:
+            job = self.jobs[brand]
+            job['sent'] = sent
+            if error is None:
+                # Orders merged in while this message was in flight stay queued.
+                job['orders'] = [oid for oid in job['orders'] if oid not in order_ids]
+                job['attempts'], job['error'] = 0, None
+                if job['orders']:
+                    job['state'] = 'queued'
+                    self._journal('job', brand, job)
+                else:
+                    del self.jobs[brand]
+                    self._journal('done', brand)
+                self.sent += 1
+            else:
+                job['attempts'] += 1
+                job['error'] = error
+                if job['attempts'] >= NOTIFY_MAX_ATTEMPTS:
+                    job['state'] = 'failed'
+                    self._journal('failed', brand, job)
+                else:
+                    job['state'] = 'queued'
+                    job['due'] = time.time() + NOTIFY_BACKOFF * 2 ** (job['attempts'] - 1)
+                    self._journal('job', brand, job)
+            self._cond.notify_all()
 
-def save_payment(payment_data):
-    try:
-        df = load_payments()
-        df = pd.concat([df, pd.DataFrame([payment_data])], ignore_index=True)
-        df.to_csv(CSV_PAYMENTS, index=False)
-        log_action("PAYMENT", "admin", "", f"Paid {payment_data['Brand']}")
-        return True
-    except: return False
+@st.cache_resource
+def get_notifier():
+    if not NOTIFY_URL:
+        return None
+    queue = NotificationQueue(HttpTransport(NOTIFY_URL, NOTIFY_TOKEN))
+    atexit.register(queue.close)
+    return queue
 
-def log_action(action, user, order_id, details):
-    try:
-        df = pd.read_csv(CSV_LOGS) if os.path.exists(CSV_LOGS) else pd.DataFrame()
-        log_entry = {
-            'Log_ID': f"LOG-{datetime.now().strftime('%Y%m%d%H%M%S')}",
-            'Time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'Action': action,
-            'User': user,
-            'Order_ID': order_id,
-            'Details': details
-        }
-        df = pd.concat([df, pd.DataFrame([log_entry])], ignore_index=True)
-        df.to_csv(CSV_LOGS, index=False)
-    except: pass
+class _StubGatewayHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with server.lock:
+            server.requests += 1
+            fail = server.requests <= server.fail_first
+            if not fail:
+                server.messages.append(body)
+                if server.echo:
+                    print(f"→ {body.get('to')}\n{body.get('text')}\n", flush=True)
+        self.send_response(503 if fail else 200)
+        self.end_headers()
+    
+    def log_message(self, *args):
+        pass
 
-def export_to_csv(df):
-    csv = df.to_csv(index=False)
-    return csv
+def start_stub_gateway(port=0, fail_first=0, echo=False):
+    """Local stand-in for the WhatsApp gateway, for trying the queue by hand
+    (--notify-stub): records POSTed messages in `server.messages`; the first
+    `fail_first` requests get 503. Serves on a daemon thread; the URL is
+    http://127.0.0.1:<server.server_port>/."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), _StubGatewayHandler)
+    server.lock = threading.Lock()
+    server.messages, server.requests, server.fail_first, server.echo = [], 0, fail_first, echo
+    threading.Thread(target=server.serve_forever, name="notify-stub", daemon=True).start()
+    return server
 
 # ============================================================================
 # 5. SESSION STATE
@@ -323,134 +2885,665 @@ if 'theme' not in st.session_state:
 # 6. ANALYTICS
 # ============================================================================
 
-def get_alerts():
-    df = load_orders()
-    alerts = []
+def sku_velocity(now=None):
+    """Per-SKU sales from the line-items table: totals plus 7/30-day units
+    and units per day over 30 days. One merge for order times, one groupby."""
+    items = load_line_items()
+    if items.empty:
+        return pd.DataFrame(columns=['SKU', 'Product', 'Brand', 'Orders', 'Units', 'Revenue', 'Commission', 'Units_7d', 'Units_30d', 'Per_Day_30d'])
+    now = pd.Timestamp(now or datetime.now())
+    # Only order times inside the 30-day window matter, so the archive is never read.
+    orders = load_orders(columns=['Order_ID', 'Time'], since=now - pd.Timedelta(days=30)).drop_duplicates('Order_ID', keep='last')
+    lines = items.merge(orders, on='Order_ID', how='left')
+    age = now - lines['Time']
+    lines = lines.assign(
+        Revenue=lines['Qty'] * lines['Unit_Price'],
+        Units_7d=lines['Qty'].where(age <= pd.Timedelta(days=7), 0),
+        Units_30d=lines['Qty'].where(age <= pd.Timedelta(days=30), 0)
+    )
+    sales = lines.groupby('SKU', observed=True).agg(
+        Orders=('Order_ID', 'nunique'),
+        Units=('Qty', 'sum'),
+        Revenue=('Revenue', 'sum'),
+        Commission=('Commission_Amt', 'sum'),
+        Units_7d=('Units_7d', 'sum'),
+        Units_30d=('Units_30d', 'sum')
+    ).reset_index()
+    sales['SKU'] = sales['SKU'].astype(str)
+    catalog = get_catalog()
+    ids = catalog.ids_for_skus(sales['SKU'])
+    known = ids >= 0
+    sales.insert(1, 'Product', '')
+    sales.insert(2, 'Brand', '')
+    sales.loc[known, 'Product'] = catalog.product_names[ids[known]]
+    sales.loc[known, 'Brand'] = catalog.brand_of(ids[known])
+    sales['Per_Day_30d'] = sales['Units_30d'] / 30
+    return sales.sort_values('Revenue', ascending=False, ignore_index=True)
+
+# SLA engine: rules compile to per-column value sets; SlaState keeps, per
+# order row, a bool per rule for the time-independent part plus the two
+# timestamps ages are measured from. Order writes re-check only the rows
+# they touch (via the view store); evaluation tests ages on matching rows
+# and counts per (brand, rule) in one groupby.
+
+class SlaRules:
+    COLUMNS = ['Order_ID', 'Time', 'Last_Modified', 'Brand', 'Status', 'WhatsApp_Sent', 'Tracking_Num', 'Priority']
+    FILTERS = {'status': 'Status', 'brands': 'Brand', 'priority': 'Priority', 'whatsapp_sent': 'WhatsApp_Sent'}
+    KEYS = {'id', 'level', 'alert', 'task', 'missing', 'present', 'older_than_hours', 'age_from', *FILTERS}
     
-    if df.empty:
-        return alerts
+    def __init__(self, rules):
+        self.rules = rules
+        for rule in rules:
+            unknown = set(rule) - self.KEYS
+            if unknown or 'id' not in rule:
+                raise ValueError(f"SLA rule {rule.get('id', '?')}: unknown keys {sorted(unknown)}" if unknown else "SLA rule without id")
+            if rule.get('level', 'warning') not in SLA_LEVEL_COLORS:
+                raise ValueError(f"SLA rule {rule['id']}: level must be one of {list(SLA_LEVEL_COLORS)}")
+            if rule.get('age_from', 'Time') not in ('Time', 'Last_Modified'):
+                raise ValueError(f"SLA rule {rule['id']}: age_from must be Time or Last_Modified")
+            for col in (*rule.get('missing', ()), *rule.get('present', ())):
+                if col not in ORDER_SCHEMA:
+                    raise ValueError(f"SLA rule {rule['id']}: unknown column {col}")
+        # What the order_sla view loads: the base columns plus any a rule tests.
+        self.columns = list(dict.fromkeys(
+            self.COLUMNS + [col for rule in rules for col in (*rule.get('missing', ()), *rule.get('present', ()))]
+        ))
+        self.ids = [rule['id'] for rule in rules]
+        if len(set(self.ids)) != len(self.ids):
+            raise ValueError("SLA rule ids must be unique")
+        hours = [rule.get('older_than_hours') for rule in rules]
+        self.aged = np.array([h is not None for h in hours])
+        self.max_age = np.array([int((h or 0) * 3600e9) for h in hours], dtype=np.int64)
+        self.from_modified = np.array([rule.get('age_from') == 'Last_Modified' for rule in rules])
     
-    try:
-        df['Time'] = pd.to_datetime(df['Time'], errors='coerce')
-        now = datetime.now()
-        
-        no_notify = df[df['WhatsApp_Sent'] == 'NO']
-        if len(no_notify) > 0:
-            alerts.append({
-                'type': 'critical',
-                'count': len(no_notify),
-                'message': f"{len(no_notify)} orders need notification",
-                'color': '#EF4444'
-            })
-        
-        no_tracking = df[(df['Status'] == 'Notified') & (df['Tracking_Num'] == '')]
-        if len(no_tracking) > 0:
-            alerts.append({
-                'type': 'warning',
-                'count': len(no_tracking),
-                'message': f"{len(no_tracking)} missing tracking",
-                'color': '#F59E0B'
-            })
-        
-        stuck = df[df['Status'].isin(['Pending', 'Notified'])]
-        if len(stuck) > 0:
-            stuck['hours_old'] = (now - stuck['Time']).dt.total_seconds() / 3600
-            stuck_count = len(stuck[stuck['hours_old'] > 24])
-            if stuck_count > 0:
-                alerts.append({
-                    'type': 'warning',
-                    'count': stuck_count,
-                    'message': f"{stuck_count} stuck > 24h",
-                    'color': '#F59E0B'
-                })
-    except: pass
+    def __len__(self):
+        return len(self.rules)
     
-    return alerts
+    def static_matrix(self, df):
+        """bool[len(df), len(rules)]: the time-independent part of every rule."""
+        out = np.ones((len(df), len(self.rules)), dtype=bool)
+        blank = {}
+        for j, rule in enumerate(self.rules):
+            for key, col in self.FILTERS.items():
+                if key in rule:
+                    out[:, j] &= df[col].isin(rule[key]).to_numpy()
+            for cols, want in ((rule.get('missing', ()), True), (rule.get('present', ()), False)):
+                for col in cols:
+                    if col not in blank:
+                        # CSV reads give NaN for empty cells, inserts may carry '' or spaces.
+                        values = df[col] if col in df else pd.Series(np.nan, index=df.index)
+                        blank[col] = (values.isna() | (values.astype(str).str.strip() == '')).to_numpy()
+                    out[:, j] &= blank[col] if want else ~blank[col]
+        return out
 
-def get_vendor_health(brand):
-    df = load_orders()
-    if df.empty:
-        return {}
+def _ns(values):
+    # int64 nanoseconds; unparseable times never count as overdue.
+    stamps = pd.to_datetime(pd.Series(values), format=TIME_FORMAT, errors='coerce') if len(values) else pd.Series(dtype='datetime64[ns]')
+    ns = stamps.astype('datetime64[ns]').to_numpy().view(np.int64).copy()
+    ns[stamps.isna().to_numpy()] = np.iinfo(np.int64).max
+    return ns
+
+class SlaState:
+    def __init__(self, df, rules):
+        self.rules = rules
+        n = len(df)
+        self.size = 0
+        self.capacity = max(1024, n)
+        self.match = np.zeros((self.capacity, len(rules)), dtype=bool)
+        self.time = np.empty(self.capacity, dtype=np.int64)
+        self.modified = np.empty(self.capacity, dtype=np.int64)
+        self.brand = np.empty(self.capacity, dtype=object)
+        self.positions = {}
+        self.revision = 0
+        self._cached = None
+        self._store(df)
     
-    brand_df = df[df['Brand'] == brand]
-    if brand_df.empty:
-        return {}
+    def _store(self, df):
+        n = len(df)
+        if self.size + n > self.capacity:
+            self.capacity = max(self.size + n, self.capacity * 2)
+            for name in ('match', 'time', 'modified', 'brand'):
+                old = getattr(self, name)
+                new = np.zeros((self.capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+        rows = slice(self.size, self.size + n)
+        self._fill(rows, df)
+        self.positions.update(zip(df['Order_ID'], range(self.size, self.size + n)))
+        self.size += n
     
-    try:
-        total_orders = len(brand_df)
-        total_revenue = brand_df['Total_Value'].sum()
-        notified_pct = (len(brand_df[brand_df['WhatsApp_Sent'] == 'YES']) / total_orders * 100) if total_orders > 0 else 0
-        
-        payments_df = load_payments()
-        brand_payments = payments_df[payments_df['Brand'] == brand]
-        total_paid = brand_payments['Amount'].sum() if not brand_payments.empty else 0
-        total_owed = brand_df['Brand_Payout'].sum()
-        payout_pending = total_owed - total_paid
-        
-        return {
-            'total_orders': total_orders,
-            'total_revenue': total_revenue,
-            'payout_pending': payout_pending,
+    def _fill(self, rows, df):
+        self.match[rows] = self.rules.static_matrix(df)
+        self.time[rows] = _ns(df['Time'])
+        self.modified[rows] = _ns(df['Last_Modified'])
+        self.brand[rows] = df['Brand'].astype(object).to_numpy()
+        self.revision += 1
+    
+    def _frame(self, rows):
+        df = pd.DataFrame(rows).reindex(columns=self.rules.columns)
+        return df.astype({'Time': object, 'Last_Modified': object})
+    
+    def add_rows(self, rows):
+        self._store(self._frame(rows))
+    
+    def apply_updates(self, previous, updates):
+        current = [{**row, **updates[row['Order_ID']]} for row in previous]
+        positions = [self.positions.get(row['Order_ID']) for row in current]
+        known = [(pos, row) for pos, row in zip(positions, current) if pos is not None]
+        if known:
+            pos, rows = zip(*known)
+            self._fill(np.array(pos), self._frame(rows))
+    
+    def counts(self, now=None):
+        """DataFrame of violation counts, index Brand, one column per rule id."""
+        now = pd.Timestamp(now or datetime.now())
+        key = (self.revision, now.floor('min'))
+        if self._cached is not None and self._cached[0] == key:
+            return self._cached[1]
+        candidates = np.flatnonzero(self.match[:self.size].any(axis=1))
+        hits = self.match[candidates]
+        if self.rules.aged.any():
+            since = np.where(self.rules.from_modified[None, :], self.modified[candidates, None], self.time[candidates, None])
+            overdue = since <= np.int64(now.value) - self.rules.max_age[None, :]
+            hits = hits & (overdue | ~self.rules.aged[None, :])
+        counts = pd.DataFrame(hits, columns=self.rules.ids).groupby(self.brand[candidates], sort=False).sum()
+        self._cached = (key, counts)
+        return counts
+
+@st.cache_resource
+def _sla_rules_cache():
+    return {'lock': threading.Lock(), 'signature': None, 'rules': None}
+
+def sla_rules():
+    cache = _sla_rules_cache()
+    with cache['lock']:
+        signature = _file_signature(SLA_RULES_FILE)
+        if cache['rules'] is None or cache['signature'] != signature:
+            if signature:
+                with open(SLA_RULES_FILE, encoding='utf-8') as f:
+                    rules = json.load(f)
+            else:
+                rules = DEFAULT_SLA_RULES
+            cache['rules'] = SlaRules(rules)
+            cache['signature'] = signature
+        return cache['rules']
+
+def sla_state(rules):
+    return SlaState(get_storage().load_orders(columns=rules.columns), rules)
+
+def sla_counts(now=None):
+    """Per-brand violation counts for every SLA rule (brands as rows)."""
+    state = _get_view('order_sla')
+    if state.rules is not sla_rules():
+        store = _view_store()
+        with store['lock']:
+            store['data']['order_sla'] = None
+        state = _get_view('order_sla')
+    return state.counts(now)
+
+def get_alerts():
+    counts = sla_counts()
+    alerts = []
+    for rule in sla_rules().rules:
+        count = int(counts[rule['id']].sum()) if rule['id'] in counts else 0
+        if 'alert' in rule and count > 0:
+            level = rule.get('level', 'warning')
+            alerts.append({
+                'type': level,
+                'count': count,
+                'message': rule['alert'].format(count=count),
+                'color': SLA_LEVEL_COLORS[level]
+            })
+    return alerts
+
+@st.cache_resource
+def _brand_health_cache():
+    return {'lock': threading.Lock(), 'inputs': None, 'frame': None}
+
+def brand_health():
+    """Health of every registry brand plus any other brand with orders: one
+    groupby over each rollup and a join, recomputed only when a rollup or
+    the catalog changes. Brands without orders have NaN health."""
+    inputs = (order_rollup(), payment_rollup(), get_catalog())
+    cache = _brand_health_cache()
+    with cache['lock']:
+        if cache['inputs'] is not None and all(a is b for a, b in zip(cache['inputs'], inputs)):
+            return cache['frame']
+        roll, pay_roll, catalog = inputs
+        orders = roll.groupby('Brand')[['Orders', 'Notified', 'Total_Value', 'Brand_Payout']].sum()
+        paid = pay_roll.groupby('Brand')['Amount'].sum()
+        brands = catalog.registry.index.append(orders.index.difference(catalog.registry.index))
+        frame = orders.reindex(brands).fillna(0).join(paid.rename('Paid')).fillna({'Paid': 0})
+        total = frame['Orders']
+        notified_pct = (frame['Notified'] / total * 100).where(total > 0)
+        frame = pd.DataFrame({
+            'total_orders': total.astype(int),
+            'total_revenue': frame['Total_Value'],
+            'payout_pending': frame['Brand_Payout'] - frame['Paid'],
             'notified_pct': notified_pct,
-            'health_score': min(100, int(notified_pct))
-        }
-    except:
+            'health_score': notified_pct.clip(upper=100).apply(np.floor),
+            'color': catalog.registry['color'].reindex(brands).fillna(BRAND_DEFAULTS['color'])
+        }, index=brands)
+        cache['inputs'], cache['frame'] = inputs, frame
+        return frame
+
+def get_vendor_health(brand):
+    health = brand_health()
+    if brand not in health.index or health.at[brand, 'total_orders'] == 0:
         return {}
+    row = health.loc[brand]
+    return {
+        'total_orders': int(row['total_orders']),
+        'total_revenue': float(row['total_revenue']),
+        'payout_pending': float(row['payout_pending']),
+        'notified_pct': float(row['notified_pct']),
+        'health_score': int(row['health_score'])
+    }
 
 def get_commission_shortcuts():
-    df = load_orders()
-    if df.empty:
+    roll = order_rollup()
+    if roll.empty:
         return {'today': 0, 'week': 0, 'month': 0, 'pending': 0, 'paid': 0}
     
     try:
-        df['Time'] = pd.to_datetime(df['Time'], errors='coerce')
-        now = datetime.now()
-        
-        today = df[df['Time'].dt.date == now.date()]['Commission_Amt'].sum()
-        week_ago = now - timedelta(days=7)
-        week = df[df['Time'] >= week_ago]['Commission_Amt'].sum()
-        month_ago = now - timedelta(days=30)
-        month = df[df['Time'] >= month_ago]['Commission_Amt'].sum()
-        
-        pending = df[df['Status'] != 'Completed']['Commission_Amt'].sum()
-        paid = df[df['Status'] == 'Completed']['Commission_Amt'].sum()
+        # Day-level buckets: "week" is the last 7 calendar days including today's.
+        today = pd.Timestamp(datetime.now().date())
+        comm = roll['Commission_Amt']
         
         return {
-            'today': today,
-            'week': week,
-            'month': month,
-            'pending': pending,
-            'paid': paid
+            'today': comm[roll['Day'] == today].sum(),
+            'week': comm[roll['Day'] >= today - timedelta(days=6)].sum(),
+            'month': comm[roll['Day'] >= today - timedelta(days=30)].sum(),
+            'pending': comm[roll['Status'] != 'Completed'].sum(),
+            'paid': comm[roll['Status'] == 'Completed'].sum()
         }
-    except:
+    except (KeyError, TypeError, ValueError):
         return {'today': 0, 'week': 0, 'month': 0, 'pending': 0, 'paid': 0}
 
 def get_tasks():
-    df = load_orders()
+    counts = sla_counts()
     tasks = []
+    for rule in sla_rules().rules:
+        if 'task' not in rule or rule['id'] not in counts:
+            continue
+        per_brand = counts[rule['id']]
+        if '{brand}' in rule['task']:
+            tasks.extend(rule['task'].format(count=int(n), brand=brand) for brand, n in per_brand.items() if n > 0)
+        elif per_brand.sum() > 0:
+            tasks.append(rule['task'].format(count=int(per_brand.sum())))
+    return tasks
+
+# Payment reconciliation: each payment is allocated to its brand's unpaid
+# orders oldest first (FIFO), and every allocation is persisted as a row of
+# the allocations table. The ledger view keeps each brand's orders in FIFO
+# order with a running total of what they are owed, so the next allocation,
+# an order's paid amount and the aging of unpaid payouts are searchsorted
+# lookups and slices, never a rescan of the tables.
+
+LEDGER_EPS = 0.005  # amounts under half a kuruş count as settled
+
+class BrandLedger:
+    """One brand's orders in FIFO order.
+    
+    `due[i]` is what orders 0..i were owed when they entered the ledger and
+    `allocated` what has been allocated to them since, so order i is settled
+    once `allocated` reaches `due[i]`. `paid` is what each order had already
+    been allocated at that point. `credit` lists payments with money left to
+    allocate, oldest first, as [Payment_ID, amount].
+    """
+    
+    def __init__(self):
+        self.size = 0
+        self.ids = np.empty(64, dtype=object)
+        self.time = np.empty(64, dtype=np.int64)
+        self.paid = np.zeros(64)
+        self.due = np.zeros(64)
+        self.allocated = 0.0
+        self.credit = []
+    
+    @property
+    def total_due(self):
+        return float(self.due[self.size - 1]) if self.size else 0.0
+    
+    def add(self, ids, times, owed, paid):
+        n = len(ids)
+        if self.size + n > len(self.ids):
+            capacity = max(self.size + n, 2 * len(self.ids))
+            for name in ('ids', 'time', 'paid', 'due'):
+                old = getattr(self, name)
+                new = np.empty(capacity, dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, name, new)
+        rows = slice(self.size, self.size + n)
+        self.ids[rows] = ids
+        self.time[rows] = times
+        self.paid[rows] = paid
+        self.due[rows] = self.total_due + np.cumsum(owed)
+        self.size += n
+        return range(rows.start, rows.stop)
+    
+    def bounds(self, pos):
+        """(owed before, owed through) each position, as running totals."""
+        before = np.where(pos > 0, self.due[np.maximum(pos - 1, 0)], 0.0)
+        return before, self.due[pos]
+    
+    def settled(self, pos):
+        """Amount allocated to the orders at `pos`, and what they still owe."""
+        before, after = self.bounds(pos)
+        since = np.clip(self.allocated - before, 0.0, after - before)
+        return self.paid[pos] + since, after - before - since
+    
+    def first_open(self):
+        return int(np.searchsorted(self.due[:self.size], self.allocated + LEDGER_EPS, 'left'))
+    
+    def plan(self, brand, stamp):
+        """Allocation rows that spend the credit on the oldest unpaid orders."""
+        rows = []
+        start = self.allocated
+        for payment_id, amount in self.credit:
+            end = min(start + amount, self.total_due)
+            if end - start <= LEDGER_EPS:
+                break
+            due = self.due[:self.size]
+            pos = np.arange(np.searchsorted(due, start, 'right'), min(np.searchsorted(due, end, 'left'), self.size - 1) + 1)
+            before, after = self.bounds(pos)
+            amounts = np.minimum(after, end) - np.maximum(before, start)
+            rows += [
+                {'Payment_ID': payment_id, 'Order_ID': order_id, 'Brand': brand, 'Amount': float(amount), 'Time': stamp}
+                for order_id, amount in zip(self.ids[pos], amounts) if amount > 0
+            ]
+            start = end
+        return rows
     
-    if df.empty:
-        return tasks
+    def apply(self, row):
+        self.allocated += row['Amount']
+        if self.credit and self.credit[0][0] == row['Payment_ID']:
+            self.credit[0][1] -= row['Amount']
+            if self.credit[0][1] <= LEDGER_EPS:
+                self.credit.pop(0)
+
+class PaymentLedger:
+    ORDER_COLUMNS = ['Order_ID', 'Time', 'Brand', 'Brand_Payout']
+    PAYMENT_COLUMNS = ['Payment_ID', 'Time', 'Brand', 'Amount']
+    
+    def __init__(self, orders, payments, allocations):
+        self.books = {}
+        self.positions = {}
+        self.revision = 0
+        self._aging = None
+        paid = allocations.groupby('Order_ID')['Amount'].sum()
+        used = allocations.groupby('Payment_ID')['Amount'].sum()
+        self._add_orders(orders.sort_values('Time', kind='stable'), paid)
+        payments = payments.sort_values('Time', kind='stable')
+        left = payments['Amount'].fillna(0) - used.reindex(payments['Payment_ID']).fillna(0).to_numpy()
+        self._add_payments(payments.assign(Amount=left))
+    
+    def _book(self, brand):
+        if brand not in self.books:
+            self.books[brand] = BrandLedger()
+        return self.books[brand]
+    
+    def _add_orders(self, df, paid=None):
+        df = df[df['Brand'].notna()]
+        payout = df['Brand_Payout'].fillna(0).clip(lower=0).to_numpy(dtype=np.float64)
+        already = paid.reindex(df['Order_ID']).fillna(0).to_numpy() if paid is not None else np.zeros(len(df))
+        already = np.minimum(already, payout)
+        for brand, idx in df.groupby(df['Brand'].astype(object), sort=False).indices.items():
+            book = self._book(brand)
+            part = df.iloc[idx]
+            pos = book.add(part['Order_ID'].to_numpy(dtype=object), _ns(part['Time']), payout[idx] - already[idx], already[idx])
+            self.positions.update(zip(part['Order_ID'], ((brand, p) for p in pos)))
+        self.revision += 1
+    
+    def _add_payments(self, df):
+        for payment_id, brand, amount in zip(df['Payment_ID'], df['Brand'].astype(object), df['Amount']):
+            if isinstance(brand, str) and amount > LEDGER_EPS:
+                self._book(brand).credit.append([payment_id, float(amount)])
+        self.revision += 1
+    
+    def add_orders(self, rows):
+        self._add_orders(pd.DataFrame(rows).reindex(columns=self.ORDER_COLUMNS).assign(
+            Brand_Payout=lambda df: pd.to_numeric(df['Brand_Payout'], errors='coerce')
+        ))
+    
+    def add_payments(self, rows):
+        self._add_payments(pd.DataFrame(rows).reindex(columns=self.PAYMENT_COLUMNS).assign(
+            Amount=lambda df: pd.to_numeric(df['Amount'], errors='coerce').fillna(0)
+        ))
+    
+    def pending(self):
+        """True if some brand has unallocated credit and unpaid orders."""
+        return any(book.credit and book.total_due - book.allocated > LEDGER_EPS for book in self.books.values())
     
+    def plan(self, stamp):
+        return [row for brand, book in self.books.items() if book.credit for row in book.plan(brand, stamp)]
+    
+    def apply_allocations(self, rows):
+        for row in rows:
+            self.books[row['Brand']].apply(row)
+        self.revision += 1
+    
+    def status(self, order_ids):
+        """Paid and Unpaid amounts and a Paid / Partial / Unpaid status per order."""
+        found = [self.positions.get(order_id) for order_id in order_ids]
+        paid, unpaid = np.full(len(found), np.nan), np.full(len(found), np.nan)
+        by_brand = {}
+        for i, hit in enumerate(found):
+            if hit is not None:
+                by_brand.setdefault(hit[0], []).append((i, hit[1]))
+        for brand, hits in by_brand.items():
+            at, pos = (np.array(v) for v in zip(*hits))
+            paid[at], unpaid[at] = self.books[brand].settled(pos)
+        state = np.select([unpaid <= LEDGER_EPS, paid > LEDGER_EPS], ['Paid', 'Partial'], 'Unpaid')
+        return pd.DataFrame({
+            'Order_ID': list(order_ids),
+            'Paid': paid,
+            'Unpaid': unpaid,
+            'Payment_Status': np.where(np.isnan(unpaid), None, state)
+        })
+    
+    def balances(self):
+        """Per brand: unpaid payout, unallocated credit, and net balance owed."""
+        frame = pd.DataFrame({
+            'Unpaid': [book.total_due - book.allocated for book in self.books.values()],
+            'Credit': [sum((amount for _, amount in book.credit), 0.0) for book in self.books.values()]
+        }, index=pd.Index(list(self.books), name='Brand'))
+        return frame.assign(Balance=frame['Unpaid'] - frame['Credit'])
+    
+    def unpaid(self, brand, limit=None):
+        """The brand's unpaid orders, oldest first, with what each still owes."""
+        book = self.books.get(brand)
+        if book is None:
+            return pd.DataFrame(columns=['Order_ID', 'Time', 'Paid', 'Unpaid'])
+        pos = np.arange(book.first_open(), book.size if limit is None else min(book.size, book.first_open() + limit))
+        paid, unpaid = book.settled(pos)
+        keep = unpaid > LEDGER_EPS
+        return pd.DataFrame({
+            'Order_ID': book.ids[pos][keep],
+            'Time': pd.to_datetime(book.time[pos][keep]),
+            'Paid': paid[keep],
+            'Unpaid': unpaid[keep]
+        })
+    
+    def aging(self, now=None):
+        """Unpaid payout per brand (rows) and AGING_LABELS bucket (columns)."""
+        now = pd.Timestamp(now or datetime.now())
+        key = (self.revision, now.floor('h'))
+        if self._aging is not None and self._aging[0] == key:
+            return self._aging[1]
+        limits = np.int64(now.value) - np.array(AGING_DAYS[::-1], dtype=np.int64) * 86_400_000_000_000
+        rows = {}
+        for brand, book in self.books.items():
+            pos = np.arange(book.first_open(), book.size)
+            _, unpaid = book.settled(pos)
+            # Bucket 0 is the newest: an order newer than every cutoff lands there.
+            bucket = len(AGING_DAYS) - np.searchsorted(limits, book.time[pos], 'right')
+            rows[brand] = np.bincount(bucket, weights=unpaid, minlength=len(AGING_LABELS))
+        aging = pd.DataFrame.from_dict(rows, orient='index', columns=AGING_LABELS).rename_axis('Brand')
+        self._aging = (key, aging)
+        return aging
+
+def reconcile_payments():
+    """Allocate unallocated payment credit to the oldest unpaid orders; returns the rows written."""
+    store = _view_store()
+    with store['lock']:
+        rows = _get_view('payment_ledger').plan(datetime.now().strftime(TIME_FORMAT))
+        if rows:
+            _write_with_views('allocations', lambda: get_storage().append_allocations(rows) or rows, {
+                'payment_ledger': lambda ledger, rows: ledger.apply_allocations(rows)
+            })
+        return rows
+
+def payment_ledger():
+    ledger = _get_view('payment_ledger')
+    if ledger.pending():
+        reconcile_payments()
+    return ledger
+
+# Read-only JSON API (`--api`) for the warehouse scanner and brand systems:
+# paginated orders, per-brand balances and alerts, answered by the same
+# functions the dashboard uses. Each response carries an ETag built from the
+# on-disk signatures of the tables and files it depends on, so a poll whose
+# If-None-Match still matches gets a 304 without loading or filtering
+# anything, and an ETag from before a restart never covers changed data.
+
+def _json_records(df):
+    out = df.copy(deep=False)
+    for col in out.columns:
+        if out[col].dtype.kind == 'M':
+            out[col] = out[col].dt.strftime(TIME_FORMAT)
+    return json.loads(out.to_json(orient='records'))  # NaN -> null, categories -> labels
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.strftime(TIME_FORMAT)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _page_params(params):
     try:
-        needs_notify = df[df['WhatsApp_Sent'] == 'NO']
-        if len(needs_notify) > 0:
-            for brand in needs_notify['Brand'].unique():
-                count = len(needs_notify[needs_notify['Brand'] == brand])
-                tasks.append(f"📲 Send {count} notification(s) to {brand}")
-        
-        needs_tracking = df[(df['Status'] == 'Notified') & (df['Tracking_Num'] == '')]
-        if len(needs_tracking) > 0:
-            for brand in needs_tracking['Brand'].unique():
-                count = len(needs_tracking[needs_tracking['Brand'] == brand])
-                tasks.append(f"📦 Add tracking for {count} {brand} order(s)")
-        
-        can_complete = df[df['Status'] == 'Dispatched']
-        if len(can_complete) > 0:
-            tasks.append(f"✅ Mark {len(can_complete)} order(s) as completed")
-    except: pass
+        page = int(params.get('page', ['1'])[0])
+        per_page = int(params.get('per_page', ['50'])[0])
+    except ValueError:
+        raise ValueError("page and per_page must be integers")
+    if page < 1 or not 1 <= per_page <= API_PAGE_MAX:
+        raise ValueError(f"page must be >= 1 and per_page between 1 and {API_PAGE_MAX}")
+    return page, per_page
+
+def api_orders(params):
+    """?q=&brand=&status=&since=&until=&page=&per_page= ; brand and status
+    may repeat, since/until are dates (until inclusive)."""
+    page, per_page = _page_params(params)
+    since, until = params.get('since', [None])[0], params.get('until', [None])[0]
+    try:
+        since = pd.Timestamp(since) if since else None
+        until = pd.Timestamp(until) + pd.Timedelta(days=1) if until else None
+    except ValueError:
+        raise ValueError("since and until must be dates (YYYY-MM-DD)")
+    found = search_orders(params.get('q', [None])[0], params.get('brand'), params.get('status'), since, until)
+    start = (page - 1) * per_page
+    return {
+        'total': len(found),
+        'page': page,
+        'per_page': per_page,
+        'orders': _json_records(found.iloc[start:start + per_page])
+    }
+
+def api_order(order_id):
+    orders = load_orders()
+    found = orders[orders['Order_ID'] == order_id].tail(1)
+    if found.empty:
+        found = order_archive().find(order_id)
+    if found.empty:
+        return None
+    status = payment_ledger().status([order_id]).drop(columns='Order_ID')
+    return {**_json_records(found)[0], **_json_records(status)[0]}
+
+def api_balances(params):
+    health = brand_health()
+    health = health[health['total_orders'] > 0].drop(columns='color')
+    ledger = payment_ledger()
+    balances = ledger.balances()[['Unpaid', 'Credit']].rename(columns={'Unpaid': 'payout_unpaid', 'Credit': 'payment_credit'})
+    return {
+        'brands': _json_records(health.join(balances).rename_axis('brand').reset_index()),
+        'aging': ledger.aging().round(2).to_dict('index'),
+        'commission': get_commission_shortcuts()
+    }
+
+def api_alerts(params):
+    return {'alerts': get_alerts(), 'tasks': get_tasks()}
+
+# path -> (handler, tables whose versions key the ETag, seconds the answer
+# may change with no write, e.g. "stuck > 24h" as time passes, config files
+# the answer is computed from)
+API_ROUTES = {
+    '/api/orders': (api_orders, ('orders', 'archive'), None, ()),
+    '/api/balances': (api_balances, ('orders', 'payments', 'allocations'), 3600, (CATALOG_FILE,)),
+    '/api/alerts': (api_alerts, ('orders',), 60, (SLA_RULES_FILE,))
+}
+
+def api_etag(path, query, tables, period=None, files=()):
+    storage = get_storage()
+    key = [path, sorted(urllib.parse.parse_qsl(query)), [storage.signature(t) for t in tables]]
+    key += [_file_signature(f) for f in files]
+    if period:
+        key.append(int(time.time() // period))
+    return '"' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20] + '"'
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    server_version = "NatuvisioAPI/1"
     
-    return tasks
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if API_TOKEN and self.headers.get('Authorization') != f"Bearer {API_TOKEN}":
+            return self._send(401, {'error': 'unauthorized'})
+        try:
+            if url.path.startswith('/api/orders/'):
+                order_id = urllib.parse.unquote(url.path[len('/api/orders/'):])
+                etag = api_etag(url.path, '', ('orders', 'archive', 'payments', 'allocations'))
+                if self._not_modified(etag):
+                    return
+                order = api_order(order_id)
+                return self._send(200, order, etag) if order else self._send(404, {'error': f"no order {order_id}"})
+            route = API_ROUTES.get(url.path.rstrip('/'))
+            if route is None:
+                return self._send(404, {'error': 'not found', 'endpoints': sorted(API_ROUTES) + ['/api/orders/<Order_ID>']})
+            handler, tables, period, files = route
+            etag = api_etag(url.path, url.query, tables, period, files)
+            if self._not_modified(etag):
+                return
+            self._send(200, handler(urllib.parse.parse_qs(url.query)), etag)
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:  # answer in JSON rather than drop the connection
+            self._send(500, {'error': f"{type(e).__name__}: {e}"})
+    
+    def _not_modified(self, etag):
+        if etag not in (tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')):
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return True
+    
+    def _send(self, status, payload, etag=None):
+        body = json.dumps(payload, default=_json_default, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+def serve_api(host=API_HOST, port=API_PORT):
+    init_databases()
+    return ThreadingHTTPServer((host, port), _ApiHandler)
 
 # ============================================================================
 # 7. LOGIN
@@ -497,6 +3590,9 @@ def dashboard():
     load_css()
     init_databases()
     
+    if get_log_writer().last_error:
+        st.warning(f"⚠️ Audit log writes are failing and being retried: {get_log_writer().last_error}")
+    
     # HEADER
     col_h1, col_h2, col_h3 = st.columns([5, 1, 1])
     
@@ -529,12 +3625,19 @@ def dashboard():
     
     st.markdown(f"<div style='height: {FIBO['md']}px'></div>", unsafe_allow_html=True)
     
+    skipped = get_catalog().skipped
+    if skipped:
+        st.warning(f"{len(skipped)} catalog product(s) skipped: " + "; ".join(skipped[:5]) + (" …" if len(skipped) > 5 else ""))
+    
     # ALERTS
-    alerts = get_alerts()
+    with timed('alerts'):
+        alerts = get_alerts()
     if alerts:
         st.markdown("### 🚨 Attention Required")
-        cols = st.columns(len(alerts))
-        for idx, alert in enumerate(alerts):
+        alerts = sorted(alerts, key=lambda a: list(SLA_LEVEL_COLORS).index(a['type']))
+        shown, more = alerts[:ALERTS_SHOWN], alerts[ALERTS_SHOWN:]
+        cols = st.columns(len(shown))
+        for idx, alert in enumerate(shown):
             with cols[idx]:
                 st.markdown(f"""
                 <div class="glass-card alert-card" style="border-top: 3px solid {alert['color']};">
@@ -548,29 +3651,35 @@ def dashboard():
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
+        if more:
+            with st.expander(f"➕ {len(more)} more alert(s)", expanded=False):
+                for alert in more:
+                    st.markdown(f"• {alert['message']}")
     
     # TASKS
-    tasks = get_tasks()
+    with timed('tasks'):
+        tasks = get_tasks()
     if tasks:
         with st.expander("📋 Tasks", expanded=False):
             for task in tasks[:5]:
                 st.markdown(f"• {task}")
     
     # METRICS
-    df = load_orders()
+    with timed('metrics'):
+        roll = order_rollup()
+        comm = get_commission_shortcuts() if not roll.empty else None
     
-    if not df.empty:
-        comm = get_commission_shortcuts()
+    if not roll.empty:
         
         col_m1, col_m2, col_m3, col_m4, col_m5, col_m6 = st.columns(6)
         
         metrics_data = [
-            (col_m1, len(df), "Total Orders", None),
+            (col_m1, int(roll['Orders'].sum()), "Total Orders", None),
             (col_m2, f"{comm['week']:,.0f}₺", "Week Comm", "#4ECDC4"),
             (col_m3, f"{comm['month']:,.0f}₺", "Month Comm", "#10B981"),
             (col_m4, f"{comm['pending']:,.0f}₺", "Pending", "#F59E0B"),
-            (col_m5, len(df[df['WhatsApp_Sent'] == 'NO']), "New Orders", "#EF4444"),
-            (col_m6, len(df[pd.to_datetime(df['Time'], errors='coerce').dt.date == datetime.now().date()]), "Today", None)
+            (col_m5, int(roll['Unnotified'].sum()), "New Orders", "#EF4444"),
+            (col_m6, int(roll.loc[roll['Day'] == pd.Timestamp(datetime.now().date()), 'Orders'].sum()), "Today", None)
         ]
         
         for col, value, label, color in metrics_data:
@@ -589,35 +3698,8 @@ def dashboard():
     # BRAND HEALTH
     st.markdown("### 📊 Brand Performance")
     
-    brand_cols = st.columns(3)
-    for idx, brand in enumerate(BRANDS.keys()):
-        health = get_vendor_health(brand)
-        if health:
-            with brand_cols[idx]:
-                color = '#10B981' if health['health_score'] > 80 else '#F59E0B'
-                st.markdown(f"""
-                <div class="glass-card">
-                    <h4 style="color: {BRANDS[brand]['color']}; margin-bottom: {FIBO['sm']}px;">{brand}</h4>
-                    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: {FIBO['xs']}px;">
-                        <div>
-                            <div style="font-size: 10px; opacity: 0.6;">ORDERS</div>
-                            <div style="font-size: {FIBO['md']}px; font-weight: 700;">{health['total_orders']}</div>
-                        </div>
-                        <div>
-                            <div style="font-size: 10px; opacity: 0.6;">REVENUE</div>
-                            <div style="font-size: {FIBO['md']}px; font-weight: 700;">{health['total_revenue']:,.0f}₺</div>
-                        </div>
-                        <div>
-                            <div style="font-size: 10px; opacity: 0.6;">PENDING</div>
-                            <div style="font-size: {FIBO['md']}px; font-weight: 700; color: #F59E0B;">{health['payout_pending']:,.0f}₺</div>
-                        </div>
-                        <div>
-                            <div style="font-size: 10px; opacity: 0.6;">HEALTH</div>
-                            <div style="font-size: {FIBO['md']}px; font-weight: 700; color: {color};">{health['health_score']}%</div>
-                        </div>
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+    with timed('brand_tiles'):
+        render_brand_tiles()
     
     st.markdown(f"<div style='height: {FIBO['md']}px'></div>", unsafe_allow_html=True)
     
@@ -633,28 +3715,28 @@ def dashboard():
         "📜 LOGS"
     ])
     
-    with tabs[0]:
+    with tabs[0], timed('tab_new_dispatch'):
         render_new_dispatch()
     
-    with tabs[1]:
+    with tabs[1], timed('tab_new_orders'):
         render_new_orders()
     
-    with tabs[2]:
+    with tabs[2], timed('tab_processing'):
         render_processing()
     
-    with tabs[3]:
+    with tabs[3], timed('tab_all_orders'):
         render_all_orders()
     
-    with tabs[4]:
+    with tabs[4], timed('tab_financials'):
         render_financials()
     
-    with tabs[5]:
+    with tabs[5], timed('tab_export'):
         render_export()
     
-    with tabs[6]:
+    with tabs[6], timed('tab_analytics'):
         render_analytics()
     
-    with tabs[7]:
+    with tabs[7], timed('tab_logs'):
         render_logs()
     
     # FOOTER
@@ -665,14 +3747,199 @@ def dashboard():
     with col_f2:
         st.markdown(f"{get_icon('clock', '#4ECDC4', 16)} **Updated:** {datetime.now().strftime('%H:%M:%S')}", unsafe_allow_html=True)
     with col_f3:
-        st.markdown(f"**Cache:** {len(load_orders())} records")
+        trace = current_trace()
+        if trace is not None:
+            st.markdown(f"**Rerun:** {sum(trace['sections'].values()) * 1000:,.0f} ms")
+        else:
+            st.markdown(f"**Orders:** {get_storage().count_orders()}")
     with col_f4:
         st.markdown(f"**Theme:** {st.session_state.theme.capitalize()}")
+    
+    if trace is not None:
+        render_diagnostics(trace)
+
+def render_diagnostics(trace):
+    state = _instrumentation()
+    with st.expander("🩺 Diagnostics", expanded=False):
+        sections = pd.Series(trace['sections'], name='ms').sort_values(ascending=False) * 1000
+        col_d1, col_d2 = st.columns(2)
+        with col_d1:
+            st.markdown("**Section timings (this rerun)**")
+            st.dataframe(sections.round(1), use_container_width=True)
+        with col_d2:
+            st.markdown("**I/O**")
+            with state['lock']:
+                totals = dict(state['totals'])
+                reruns = state['reruns']
+            st.dataframe(pd.DataFrame({
+                'This rerun': [trace[c] for c in IO_COUNTERS],
+                f'Process ({reruns} reruns)': [totals[c] for c in IO_COUNTERS]
+            }, index=list(IO_COUNTERS)), use_container_width=True)
+        if TRACE_FILE:
+            st.caption(f"Tracing to {TRACE_FILE}")
 
 # ============================================================================
 # 9. TAB RENDERERS
 # ============================================================================
 
+BRAND_TILE_SORTS = {
+    "Worst health first": ('health_score', True),
+    "Highest pending payout": ('payout_pending', False),
+    "Most orders": ('total_orders', False),
+    "Name": (None, True)
+}
+
+def render_brand_tiles():
+    health = brand_health()
+    if health.empty:
+        return
+    col_t1, col_t2, col_t3, col_t4 = st.columns([2, 2, 1, 1])
+    with col_t1:
+        sort = st.selectbox("Sort", list(BRAND_TILE_SORTS), key="tile_sort")
+    with col_t2:
+        name = st.text_input("Brand", key="tile_filter", placeholder="Filter brands")
+    with col_t3:
+        page_size = st.selectbox("Per page", BRAND_TILE_PAGE_SIZES, index=1, key="tile_size")
+    column, ascending = BRAND_TILE_SORTS[sort]
+    if name:
+        health = health[health.index.str.contains(name, case=False, regex=False)]
+    health = health.sort_index() if column is None else health.sort_values(column, ascending=ascending, na_position='last', kind='stable')
+    pages = max(1, -(-len(health) // page_size))
+    if st.session_state.get("tile_page", 1) > pages:
+        st.session_state["tile_page"] = pages
+    with col_t4:
+        page = st.number_input("Page", 1, pages, key="tile_page")
+    shown = health.iloc[(page - 1) * page_size:page * page_size]
+    
+    for start in range(0, len(shown), BRAND_TILES_PER_ROW):
+        cols = st.columns(BRAND_TILES_PER_ROW)
+        for col, (brand, row) in zip(cols, shown.iloc[start:start + BRAND_TILES_PER_ROW].iterrows()):
+            with col:
+                if row['total_orders'] == 0:
+                    score, color = "—", "#9CA3AF"
+                else:
+                    score, color = f"{row['health_score']:.0f}%", '#10B981' if row['health_score'] > 80 else '#F59E0B'
+                st.markdown(f"""
+                <div class="glass-card">
+                    <h4 style="color: {row['color']}; margin-bottom: {FIBO['sm']}px;">{brand}</h4>
+                    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: {FIBO['xs']}px;">
+                        <div>
+                            <div style="font-size: 10px; opacity: 0.6;">ORDERS</div>
+                            <div style="font-size: {FIBO['md']}px; font-weight: 700;">{row['total_orders']}</div>
+                        </div>
+                        <div>
+                            <div style="font-size: 10px; opacity: 0.6;">REVENUE</div>
+                            <div style="font-size: {FIBO['md']}px; font-weight: 700;">{row['total_revenue']:,.0f}₺</div>
+                        </div>
+                        <div>
+                            <div style="font-size: 10px; opacity: 0.6;">PENDING</div>
+                            <div style="font-size: {FIBO['md']}px; font-weight: 700; color: #F59E0B;">{row['payout_pending']:,.0f}₺</div>
+                        </div>
+                        <div>
+                            <div style="font-size: 10px; opacity: 0.6;">HEALTH</div>
+                            <div style="font-size: {FIBO['md']}px; font-weight: 700; color: {color};">{score}</div>
+                        </div>
+                    </div>
+                </div>
+                """, unsafe_allow_html=True)
+    if pages > 1:
+        st.caption(f"{len(health)} brands · page {page}/{pages}")
+
+def paginate_orders(df, key):
+    """Render the count header and page controls; return (page, rest).
+    
+    Only `page` gets full cards and widgets; `rest` is only counted and
+    previewed, so rerun cost is bounded by the page size, not the backlog.
+    """
+    total = len(df)
+    col_c, col_s, col_p = st.columns([3, 1, 1])
+    with col_s:
+        page_size = st.selectbox("Per page", ORDER_PAGE_SIZES, index=ORDER_PAGE_SIZES.index(ORDER_PAGE_SIZE), key=f"{key}_size")
+    pages = max(1, -(-total // page_size))
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with col_p:
+        page = st.number_input("Page", 1, pages, key=f"{key}_page")
+    start = (page - 1) * page_size
+    with col_c:
+        st.markdown(f"**{total}** orders · showing {start + 1}–{min(start + page_size, total)} · page {page}/{pages}")
+    return df.iloc[start:start + page_size], pd.concat([df.iloc[:start], df.iloc[start + page_size:]])
+
+def render_backlog_summary(rest):
+    if not rest.empty:
+        with st.expander(f"📋 {len(rest)} more order(s) on other pages"):
+            # Brands x statuses, whatever the backlog size; rows only up to the preview cap.
+            counts = rest.groupby(['Brand', 'Status'], observed=True).size().unstack(fill_value=0)
+            counts.columns = counts.columns.astype(str)  # plain labels, not a categorical header
+            st.dataframe(counts, use_container_width=True)
+            st.dataframe(rest[SUMMARY_COLUMNS].head(SUMMARY_PREVIEW_ROWS), use_container_width=True, hide_index=True)
+            if len(rest) > SUMMARY_PREVIEW_ROWS:
+                st.caption(f"First {SUMMARY_PREVIEW_ROWS} shown; page through for the other {len(rest) - SUMMARY_PREVIEW_ROWS}.")
+
+def order_widget_keys(page):
+    """Widget key suffix per row: the Order_ID, disambiguated if it repeats."""
+    seen = page.groupby('Order_ID', sort=False).cumcount()
+    return [oid if n == 0 else f"{oid}_{n}" for oid, n in zip(page['Order_ID'], seen)]
+
+def parse_tracking_lines(text):
+    """Parse pasted 'ORDER_ID TRACKING' lines (space, tab, comma or ; separated)."""
+    pairs, bad = {}, []
+    for line in text.splitlines():
+        parts = line.replace(',', ' ').replace(';', ' ').split()
+        if not parts:
+            continue
+        if len(parts) != 2:
+            bad.append(line.strip())
+            continue
+        pairs[parts[0]] = parts[1]
+    return pairs, bad
+
+def render_bulk_actions(active):
+    with st.expander("⚡ Bulk Actions", expanded=False):
+        unsent = active.loc[(active['WhatsApp_Sent'] == 'NO') & (active['Status'] == 'Pending'), 'Order_ID'].tolist()
+        notified = set(active.loc[active['Status'] == 'Notified', 'Order_ID'])
+        dispatched = active.loc[active['Status'] == 'Dispatched', 'Order_ID'].tolist()
+        
+        col_b1, col_b2, col_b3 = st.columns(3)
+        
+        with col_b1:
+            st.markdown("**📲 Mark Sent**")
+            if st.checkbox(f"All {len(unsent)} unsent", key="bulk_sent_all"):
+                ids = unsent
+            else:
+                ids = st.multiselect("Orders", unsent, key="bulk_sent_ids")
+            if st.button(f"✅ Mark {len(ids)} sent", key="bulk_sent_btn", disabled=not ids):
+                done = transition_many({oid: {'WhatsApp_Sent': 'YES'} for oid in ids}, 'Notified')
+                if done:
+                    log_action("BULK_NOTIFIED", "admin", " ".join(done), f"Marked {len(done)} order(s)")
+                st.rerun()
+        
+        with col_b2:
+            st.markdown("**📦 Ship Pasted**")
+            pasted = st.text_area("ORDER_ID TRACKING, one per line", key="bulk_tracking", height=100)
+            pairs, bad = parse_tracking_lines(pasted)
+            skipped = [oid for oid in pairs if oid not in notified]
+            ship = {oid: {'Tracking_Num': tracking} for oid, tracking in pairs.items() if oid in notified}
+            if bad or skipped:
+                st.caption(f"⚠️ Skipping {len(bad)} malformed line(s) and {len(skipped)} order(s) not awaiting tracking")
+            if st.button(f"📦 Ship {len(ship)}", key="bulk_ship_btn", disabled=not ship):
+                done = transition_many(ship, 'Dispatched')
+                if done:
+                    log_action("BULK_DISPATCH", "admin", " ".join(done), f"Shipped {len(done)} order(s)")
+                st.rerun()
+        
+        with col_b3:
+            st.markdown("**✅ Complete**")
+            if st.checkbox(f"All {len(dispatched)} dispatched", key="bulk_done_all"):
+                ids = dispatched
+            else:
+                ids = st.multiselect("Orders", dispatched, key="bulk_done_ids")
+            if st.button(f"✅ Complete {len(ids)}", key="bulk_done_btn", disabled=not ids):
+                done = transition_many({oid: {} for oid in ids}, 'Completed')
+                if done:
+                    log_action("BULK_COMPLETE", "admin", " ".join(done), f"Completed {len(done)} order(s)")
+                st.rerun()
+
 def render_new_dispatch():
     col_L, col_R = st.columns([PHI, 1])
     
@@ -690,14 +3957,15 @@ def render_new_dispatch():
         st.markdown('<div class="glass-card">', unsafe_allow_html=True)
         st.markdown("#### 🛒 Products")
         
+        catalog = get_catalog()
         if st.session_state.cart:
             st.info(f"🔒 {st.session_state.brand_lock}")
             active_brand = st.session_state.brand_lock
         else:
-            active_brand = st.selectbox("Brand", list(BRANDS.keys()), key="brand_sel")
+            # Brands whose every product was skipped have nothing to sell.
+            active_brand = st.selectbox("Brand", [b for b in BRANDS if catalog.products_of(b)], key="brand_sel")
         
-        brand_data = BRANDS[active_brand]
-        products = list(brand_data["products"].keys())
+        products = catalog.products_of(active_brand)
         
         col_p, col_q = st.columns([3, 1])
         with col_p:
@@ -705,9 +3973,8 @@ def render_new_dispatch():
         with col_q:
             qty = st.number_input("Qty", 1, value=1, key="qty")
         
-        prod_details = brand_data["products"][prod]
-        line_total = prod_details['price'] * qty
-        comm_amt = line_total * brand_data['commission']
+        product_id = catalog.name_ids[prod]
+        line_total, comm_amt = (float(v) for v in catalog.price(product_id, qty))
         
         st.markdown(f"""
         <div style="background: rgba(255,255,255,0.05); border-radius: 8px; padding: 13px;">
@@ -726,7 +3993,7 @@ def render_new_dispatch():
             st.session_state.cart.append({
                 "brand": active_brand,
                 "product": prod,
-                "sku": prod_details['sku'],
+                "sku": catalog.skus[product_id],
                 "qty": qty,
                 "subtotal": line_total,
                 "comm_amt": comm_amt
@@ -761,11 +4028,11 @@ def render_new_dispatch():
             </div>
             """, unsafe_allow_html=True)
             
-            priority = st.selectbox("Priority", ["Standard", "🚨 URGENT", "🧊 Cold"], key="priority")
+            priority = st.selectbox("Priority", PRIORITIES, key="priority")
             
             if st.button("⚡ CREATE", type="primary", key="create_btn"):
                 if cust_name and cust_phone:
-                    order_id = f"NV-{datetime.now().strftime('%m%d%H%M%S')}"
+                    order_id = new_order_ids()[0]
                     items_str = ", ".join([f"{i['product']} (x{i['qty']})" for i in st.session_state.cart])
                     
                     order_data = {
@@ -789,7 +4056,11 @@ def render_new_dispatch():
                         'Last_Modified': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                     }
                     
-                    if save_order(order_data):
+                    items = [
+                        {'SKU': i['sku'], 'Qty': i['qty'], 'Unit_Price': i['subtotal'] / i['qty'], 'Commission_Amt': i['comm_amt']}
+                        for i in st.session_state.cart
+                    ]
+                    if save_order(order_data, items):
                         st.success(f"✅ {order_id}")
                         st.session_state.cart = []
                         st.session_state.brand_lock = None
@@ -805,22 +4076,92 @@ def render_new_dispatch():
             st.info("Empty")
         
         st.markdown('</div>', unsafe_allow_html=True)
+    
+    render_bulk_import()
+
+def render_bulk_import():
+    with st.expander("📥 Bulk import (CSV / JSON)"):
+        st.caption(f"One line item per row: {', '.join(IMPORT_COLUMNS)}. Rows sharing an External_ID become one order.")
+        upload = st.file_uploader("File", type=["csv", "json"], key="import_file")
+        if upload is None:
+            return
+        try:
+            lines = read_import_file(upload.getvalue(), upload.name)
+        except (ValueError, pd.errors.ParserError) as e:
+            st.error(f"Cannot read {upload.name}: {e}")
+            return
+        orders, items, errors = prepare_import(lines)
+        
+        st.markdown(f"**{len(orders)}** orders from **{len(lines) - len(errors)}** lines · **{len(errors)}** lines rejected")
+        if not errors.empty:
+            st.dataframe(errors, use_container_width=True, hide_index=True)
+        if orders.empty:
+            return
+        st.dataframe(orders.head(ORDER_PAGE_SIZE), use_container_width=True, hide_index=True)
+        
+        if st.session_state.get('imported_file') == upload.file_id:
+            st.info("This file was already imported")
+        elif st.button(f"⚡ IMPORT {len(orders)}", type="primary", key="import_btn"):
+            try:
+                ids = commit_import(orders, items, upload.name)
+            except (OSError, sqlite3.Error) as e:
+                st.error(f"Import error: {e}")
+                return
+            st.session_state.imported_file = upload.file_id
+            st.success(f"✅ Imported {len(ids)} orders ({ids[0]} … {ids[-1]})")
+
+def render_brand_notify(new_orders):
+    """One batched message per brand: queued for the gateway, or a wa.me link when none is configured."""
+    notifier = get_notifier()
+    jobs = notifier.status() if notifier else {}
+    with st.expander("📲 Notify Brands", expanded=True):
+        for brand, orders in new_orders.groupby('Brand', observed=True, sort=True):
+            ids = orders['Order_ID'].tolist()
+            job = jobs.get(brand)
+            col_n1, col_n2 = st.columns([3, 1])
+            with col_n1:
+                st.markdown(f"**{brand}** · {len(ids)} waiting")
+                if job and job['state'] == 'failed':
+                    st.caption(f"❌ Failed after {job['attempts']} attempts: {job['error']}")
+                elif job and job['attempts']:
+                    st.caption(f"🔁 Retry {job['attempts']}/{NOTIFY_MAX_ATTEMPTS} at {datetime.fromtimestamp(job['due']):%H:%M:%S}: {job['error']}")
+                elif job:
+                    st.caption(f"⏳ {job['state'].capitalize()} ({len(job['orders'])} orders)")
+            with col_n2:
+                if notifier:
+                    if st.button("📤 Send", key=f"queue_{brand}", disabled=bool(job) and job['state'] != 'failed'):
+                        notifier.enqueue(brand, ids)
+                        st.rerun()
+                else:
+                    # One link per NOTIFY_LINK_ORDERS; marking it sent brings up the next.
+                    page = orders.head(NOTIFY_LINK_ORDERS)
+                    phone = get_catalog().brands.get(brand, {}).get('phone', '')
+                    label = "💬 WhatsApp" if len(page) == len(ids) else f"💬 WhatsApp ({len(page)} of {len(ids)})"
+                    st.link_button(label, whatsapp_link(phone, brand_message(brand, page)))
+                    if st.button("✅ Mark sent", key=f"brand_sent_{brand}"):
+                        done = transition_many({oid: {'WhatsApp_Sent': 'YES'} for oid in page['Order_ID']}, 'Notified')
+                        if done:
+                            log_action("NOTIFY", "admin", " ".join(done), f"Notified {brand} ({len(done)} orders)")
+                        st.rerun()
 
 def render_new_orders():
     st.markdown("### 🔴 New Orders")
     
-    df = load_orders()
-    if df.empty:
+    if get_storage().count_orders() == 0:
         st.info("No orders")
         return
     
-    new_orders = df[df['WhatsApp_Sent'] == 'NO'].sort_values('Time', ascending=False)
+    new_orders = query_orders(whatsapp_sent=['NO'])
     
     if new_orders.empty:
         st.success("✅ All processed!")
         return
     
-    for idx, row in new_orders.iterrows():
+    render_brand_notify(new_orders)
+    
+    page, rest = paginate_orders(new_orders, "new_orders")
+    
+    for wkey, (_, row) in zip(order_widget_keys(page), page.iterrows()):
         st.markdown(f"""
         <div class="glass-card alert-card">
             <div style="display: flex; justify-content: space-between;">
@@ -838,24 +4179,32 @@ def render_new_orders():
         </div>
         """, unsafe_allow_html=True)
         
-        if st.button(f"📲 Notify", key=f"notify_{idx}"):
-            df.at[idx, 'WhatsApp_Sent'] = 'YES'
-            df.at[idx, 'Status'] = 'Notified'
-            update_orders(df)
-            log_action("NOTIFY", "admin", row['Order_ID'], f"Notified {row['Brand']}")
-            st.rerun()
+        if st.button(f"📲 Notify", key=f"notify_{wkey}"):
+            if transition(row['Order_ID'], 'Notified', WhatsApp_Sent='YES'):
+                log_action("NOTIFY", "admin", row['Order_ID'], f"Notified {row['Brand']}")
+                st.rerun()
+            else:
+                st.warning(f"{row['Order_ID']} was already updated")
+    
+    render_backlog_summary(rest)
 
 def render_processing():
     st.markdown("### ✅ Processing")
     
-    df = load_orders()
-    if df.empty:
+    if get_storage().count_orders() == 0:
         st.info("No orders")
         return
     
-    active = df[df['Status'].isin(['Pending', 'Notified', 'Dispatched'])]
+    active = query_orders(statuses=['Pending', 'Notified', 'Dispatched'], newest_first=False)
+    if active.empty:
+        st.success("✅ Nothing in progress")
+        return
+    
+    render_bulk_actions(active)
     
-    for idx, row in active.iterrows():
+    page, rest = paginate_orders(active, "processing")
+    
+    for wkey, (_, row) in zip(order_widget_keys(page), page.iterrows()):
         card_class = "order-card-red" if row['WhatsApp_Sent'] == 'NO' else "order-card-green"
         
         st.markdown(f"""
@@ -877,152 +4226,227 @@ def render_processing():
         
         with col_a1:
             if row['WhatsApp_Sent'] == 'NO':
-                if st.button("✅ Sent", key=f"sent_{idx}"):
-                    df.at[idx, 'WhatsApp_Sent'] = 'YES'
-                    df.at[idx, 'Status'] = 'Notified'
-                    update_orders(df)
-                    log_action("NOTIFIED", "admin", row['Order_ID'], "Marked")
-                    st.rerun()
+                if st.button("✅ Sent", key=f"sent_{wkey}"):
+                    if transition(row['Order_ID'], 'Notified', WhatsApp_Sent='YES'):
+                        log_action("NOTIFIED", "admin", row['Order_ID'], "Marked")
+                        st.rerun()
+                    else:
+                        st.warning(f"{row['Order_ID']} was already updated")
         
         with col_a2:
             if row['Status'] == 'Notified':
-                tracking = st.text_input("Track", key=f"track_{idx}")
-                if st.button("📦 Ship", key=f"ship_{idx}"):
+                tracking = st.text_input("Track", key=f"track_{wkey}")
+                if st.button("📦 Ship", key=f"ship_{wkey}"):
                     if tracking:
-                        df.at[idx, 'Tracking_Num'] = tracking
-                        df.at[idx, 'Status'] = 'Dispatched'
-                        update_orders(df)
-                        log_action("DISPATCH", "admin", row['Order_ID'], tracking)
-                        st.rerun()
+                        if transition(row['Order_ID'], 'Dispatched', Tracking_Num=tracking):
+                            log_action("DISPATCH", "admin", row['Order_ID'], tracking)
+                            st.rerun()
+                        else:
+                            st.warning(f"{row['Order_ID']} was already updated")
         
         with col_a3:
             if row['Status'] == 'Dispatched':
-                if st.button("✅ Done", key=f"done_{idx}"):
-                    df.at[idx, 'Status'] = 'Completed'
-                    update_orders(df)
-                    log_action("COMPLETE", "admin", row['Order_ID'], "Done")
-                    st.rerun()
+                if st.button("✅ Done", key=f"done_{wkey}"):
+                    if transition(row['Order_ID'], 'Completed'):
+                        log_action("COMPLETE", "admin", row['Order_ID'], "Done")
+                        st.rerun()
+                    else:
+                        st.warning(f"{row['Order_ID']} was already updated")
+    
+    render_backlog_summary(rest)
 
 def render_all_orders():
     st.markdown("### 📦 All Orders")
     
-    col_s1, col_s2, col_s3 = st.columns(3)
+    col_s1, col_s2, col_s3, col_s4 = st.columns(4)
     with col_s1:
         search = st.text_input("🔍 Search", key="search")
     with col_s2:
         brand_filt = st.multiselect("Brand", list(BRANDS.keys()), key="brand_f")
     with col_s3:
         status_filt = st.multiselect("Status", ["Pending", "Notified", "Dispatched", "Completed"], key="status_f")
+    with col_s4:
+        dates = st.date_input("Date range", (), key="date_f")
     
-    df = load_orders()
-    if df.empty:
+    archive = order_archive()
+    if get_storage().count_orders() == 0 and not archive.needed():
         st.info("No orders")
         return
     
-    filtered = df.copy()
-    
-    if search:
-        filtered = filtered[
-            filtered['Order_ID'].str.contains(search, case=False, na=False) |
-            filtered['Customer'].str.contains(search, case=False, na=False) |
-            filtered['Phone'].str.contains(search, case=False, na=False)
-        ]
-    
-    if brand_filt:
-        filtered = filtered[filtered['Brand'].isin(brand_filt)]
-    
-    if status_filt:
-        filtered = filtered[filtered['Status'].isin(status_filt)]
+    dates = list(dates) if isinstance(dates, (list, tuple)) else [dates]
+    since = pd.Timestamp(dates[0]) if dates else None
+    until = pd.Timestamp(dates[-1]) + pd.Timedelta(days=1) if dates else None
+    filtered = search_orders(search, brands=brand_filt, statuses=status_filt, since=since, until=until)
     
     st.markdown(f"**{len(filtered)}** orders")
-    st.dataframe(filtered.sort_values('Time', ascending=False), use_container_width=True, hide_index=True)
+    st.dataframe(filtered, use_container_width=True, hide_index=True)
+    
+    col_h1, col_h2 = st.columns([3, 1])
+    with col_h1:
+        horizon = archive.horizon()
+        if horizon is not None:
+            st.caption(f"Orders completed before {horizon:%Y-%m-%d} are archived; pick a date range to include them.")
+    with col_h2:
+        if st.button(f"🗄️ Archive completed > {ARCHIVE_AFTER_DAYS}d", key="archive_run"):
+            moved = archive_orders()
+            st.success(f"✅ Archived {moved} orders")
+            st.rerun()
 
 def render_financials():
     st.markdown("### 💰 Financials")
     
-    df = load_orders()
-    df_pay = load_payments()
+    roll = order_rollup()
     
-    if df.empty:
+    if roll.empty:
         st.info("No data")
         return
     
     col_f1, col_f2, col_f3, col_f4 = st.columns(4)
     
     with col_f1:
-        st.metric("Sales", f"{df['Total_Value'].sum():,.0f}₺")
+        st.metric("Sales", f"{roll['Total_Value'].sum():,.0f}₺")
     with col_f2:
-        st.metric("Commission", f"{df['Commission_Amt'].sum():,.0f}₺")
+        st.metric("Commission", f"{roll['Commission_Amt'].sum():,.0f}₺")
     with col_f3:
-        st.metric("Payout", f"{df['Brand_Payout'].sum():,.0f}₺")
+        st.metric("Payout", f"{roll['Brand_Payout'].sum():,.0f}₺")
     with col_f4:
-        rate = df['Commission_Amt'].sum() / df['Total_Value'].sum() * 100
+        rate = roll['Commission_Amt'].sum() / roll['Total_Value'].sum() * 100
         st.metric("Rate", f"{rate:.1f}%")
     
     st.markdown("---")
     
+    by_brand = roll.groupby('Brand')[['Total_Value', 'Commission_Amt', 'Brand_Payout']].sum()
+    ledger = payment_ledger()
+    balances = ledger.balances()
+    
     for brand in BRANDS.keys():
-        brand_df = df[df['Brand'] == brand]
-        if not brand_df.empty:
+        if brand in by_brand.index:
+            totals = by_brand.loc[brand]
             st.markdown(f"**{brand}**")
             col_b1, col_b2, col_b3 = st.columns(3)
             with col_b1:
-                st.metric("Sales", f"{brand_df['Total_Value'].sum():,.0f}₺")
+                st.metric("Sales", f"{totals['Total_Value']:,.0f}₺")
             with col_b2:
-                st.metric("Comm", f"{brand_df['Commission_Amt'].sum():,.0f}₺")
+                st.metric("Comm", f"{totals['Commission_Amt']:,.0f}₺")
             with col_b3:
-                owed = brand_df['Brand_Payout'].sum()
-                paid_df = df_pay[df_pay['Brand'] == brand]
-                paid = paid_df['Amount'].sum() if not paid_df.empty else 0
-                st.metric("Balance", f"{(owed - paid):,.0f}₺")
+                balance = balances['Balance'].get(brand, totals['Brand_Payout'])
+                st.metric("Balance", f"{balance:,.0f}₺")
+    
+    st.markdown("---")
+    render_reconciliation(ledger, balances)
+
+def render_reconciliation(ledger, balances):
+    st.markdown("#### 🧾 Reconciliation")
+    
+    aging = ledger.aging()
+    if not aging.empty:
+        table = aging.join(balances[['Credit', 'Balance']])
+        st.dataframe(table[table.abs().sum(axis=1) > LEDGER_EPS].round(0), use_container_width=True)
+    
+    col_r1, col_r2 = st.columns(2)
+    
+    with col_r1:
+        st.markdown("**Record payment**")
+        brand = st.selectbox("Brand", list(BRANDS.keys()), key="pay_brand")
+        amount = st.number_input("Amount (₺)", 0.0, step=100.0, key="pay_amount")
+        method = st.selectbox("Method", ["Bank Transfer", "EFT", "Cash"], key="pay_method")
+        reference = st.text_input("Reference", key="pay_ref")
+        if st.button("💳 Save payment", key="pay_save", disabled=amount <= 0):
+            stamp = datetime.now()
+            saved = save_payment({
+                'Payment_ID': f"PAY-{stamp.strftime('%Y%m%d%H%M%S%f')}",
+                'Time': stamp.strftime('%Y-%m-%d %H:%M:%S'),
+                'Brand': brand,
+                'Amount': amount,
+                'Method': method,
+                'Reference': reference,
+                'Notes': ''
+            })
+            if saved:
+                st.success(f"✅ {amount:,.0f}₺ allocated to {brand}")
+                st.rerun()
+    
+    with col_r2:
+        st.markdown("**Unpaid orders**")
+        brand = st.selectbox("Brand", list(ledger.books) or list(BRANDS.keys()), key="unpaid_brand")
+        unpaid = ledger.unpaid(brand, limit=ORDER_PAGE_SIZES[-1])
+        if unpaid.empty:
+            st.success("✅ Fully paid")
+        else:
+            st.dataframe(unpaid.round({'Paid': 2, 'Unpaid': 2}), use_container_width=True, hide_index=True)
 
 def render_export():
     st.markdown("### 📥 Export")
     
-    df_orders = load_orders()
-    df_pay = load_payments()
+    col_f1, col_f2, col_f3 = st.columns(3)
+    with col_f1:
+        dates = st.date_input("Date range", (), key="exp_dates")
+    with col_f2:
+        brands = st.multiselect("Brand", list(BRANDS.keys()), key="exp_brands")
+    with col_f3:
+        formats = ["csv", "gzip"] + (["parquet"] if pq is not None else [])
+        fmt = st.radio("Format", formats, horizontal=True, key="exp_fmt",
+                       format_func={"csv": "CSV", "gzip": "CSV (gzip)", "parquet": "Parquet"}.get)
+    
+    dates = list(dates) if isinstance(dates, (list, tuple)) else [dates]
+    start = dates[0] if dates else None
+    end = dates[-1] if dates else None
+    filters = (start, end, tuple(brands))
     
-    col_e1, col_e2, col_e3 = st.columns(3)
+    col_e1, col_e2, col_e3, col_e4 = st.columns(4)
     
     with col_e1:
         st.markdown("**Orders**")
-        if not df_orders.empty:
-            csv = export_to_csv(df_orders)
-            st.download_button(
-                "📄 Download",
-                csv,
-                f"orders_{datetime.now().strftime('%Y%m%d')}.csv",
-                key="dl_orders"
-            )
+        render_export_job("orders", ["orders"], fmt, filters, "📄")
     
     with col_e2:
         st.markdown("**Commission**")
-        if not df_orders.empty:
-            comm = df_orders[['Order_ID', 'Time', 'Brand', 'Commission_Amt', 'Status']]
-            csv = export_to_csv(comm)
-            st.download_button(
-                "💰 Download",
-                csv,
-                f"commission_{datetime.now().strftime('%Y%m%d')}.csv",
-                key="dl_comm"
-            )
+        render_export_job("commission", ["commission"], fmt, filters, "💰")
     
     with col_e3:
         st.markdown("**Payments**")
-        if not df_pay.empty:
-            csv = export_to_csv(df_pay)
-            st.download_button(
-                "💳 Download",
-                csv,
-                f"payments_{datetime.now().strftime('%Y%m%d')}.csv",
-                key="dl_pay"
-            )
+        render_export_job("payments", ["payments"], fmt, filters, "💳")
+    
+    with col_e4:
+        st.markdown("**All (zip)**")
+        render_export_job("natuvisio_export", list(EXPORTS), "zip", filters, "🗜️")
+
+def render_export_job(name, kinds, fmt, filters, icon):
+    """Prepare button, then progress, then download for one export."""
+    version = tuple(get_storage().version(EXPORTS[kind][0]) for kind in kinds) + (get_storage().version('archive'),)
+    key = (name, fmt, filters, version)
+    job = export_job(key)
+    if job is None:
+        if not st.button(f"{icon} Prepare", key=f"exp_{name}"):
+            return
+        job = start_export(key, {kind: export_frame(kind, *filters) for kind in kinds})
+    # Poll only while the job runs; the fragment reruns alone, not the page
+    polling = job['state'] == 'running'
+    st.fragment(render_export_status, run_every=1.0 if polling else None)(name, key, job, polling)
+
+def render_export_status(name, key, job, polling):
+    if job['state'] == 'running':
+        st.progress(job['done'] / max(job['total'], 1), text=f"{job['done']:,} / {job['total']:,} rows")
+        return
+    if polling:
+        st.rerun()
+    if job['state'] == 'failed':
+        st.error(job['error'])
+        return
+    path = job['path']
+    st.download_button(
+        f"⬇️ Download ({job['total']:,} rows)",
+        lambda: read_export(path),  # read only when clicked
+        f"{name}_{datetime.now().strftime('%Y%m%d')}.{EXPORT_EXTENSIONS[key[1]]}",
+        mime=EXPORT_MIME[key[1]],
+        key=f"dl_{name}"
+    )
 
 def render_analytics():
     st.markdown("### 📊 Analytics")
     
-    df = load_orders()
-    if df.empty:
+    roll = order_rollup()
+    if roll.empty:
         st.info("No data")
         return
     
@@ -1030,52 +4454,74 @@ def render_analytics():
     
     with col_a1:
         st.markdown("**Sales by Brand**")
-        brand_sales = df.groupby('Brand')['Total_Value'].sum()
+        brand_sales = roll.groupby('Brand')['Total_Value'].sum()
         st.bar_chart(brand_sales)
     
     with col_a2:
         st.markdown("**Orders by Brand**")
-        brand_orders = df['Brand'].value_counts()
+        brand_orders = roll.groupby('Brand')['Orders'].sum().sort_values(ascending=False)
         st.bar_chart(brand_orders)
     
     st.markdown("**Status Distribution**")
-    status_dist = df['Status'].value_counts()
+    status_dist = roll.groupby('Status')['Orders'].sum().sort_values(ascending=False)
     st.bar_chart(status_dist)
     
-    if len(df) > 5:
+    if roll['Orders'].sum() > 5:
         st.markdown("**Orders Over Time**")
-        df['Time'] = pd.to_datetime(df['Time'], errors='coerce')
-        df['Date'] = df['Time'].dt.date
-        daily = df.groupby('Date').size()
+        daily = roll.groupby(roll['Day'].dt.date)['Orders'].sum()
         st.line_chart(daily)
+    
+    st.markdown("**SKU Sales**")
+    sales = sku_velocity()
+    missing = int(roll['Orders'].sum()) - load_line_items(columns=['Order_ID'])['Order_ID'].nunique()
+    if missing > 0:
+        col_b1, col_b2 = st.columns([3, 1])
+        with col_b1:
+            st.caption(f"{missing} orders have no line items yet (created before line items were recorded)")
+        with col_b2:
+            if st.button("🧩 Backfill", key="backfill_items"):
+                written, unparsed = backfill_line_items()
+                st.success(f"✅ {written} line items" + (f" · {len(unparsed)} orders not parseable" if unparsed else ""))
+                st.rerun()
+    if sales.empty:
+        st.info("No line items")
+        return
+    
+    col_a3, col_a4 = st.columns(2)
+    with col_a3:
+        st.bar_chart(sales.head(10).set_index('SKU')['Revenue'])
+    with col_a4:
+        st.markdown("**Velocity (units/day, 30d)**")
+        st.bar_chart(sales.sort_values('Per_Day_30d', ascending=False).head(10).set_index('SKU')['Per_Day_30d'])
+    st.dataframe(sales, use_container_width=True, hide_index=True)
 
 def render_logs():
     st.markdown("### 📜 Logs")
     
     try:
-        df = pd.read_csv(CSV_LOGS) if os.path.exists(CSV_LOGS) else pd.DataFrame()
+        actions = log_actions()
         
-        if df.empty:
+        if not actions:
             st.info("No logs")
             return
         
-        col_l1, col_l2 = st.columns(2)
+        col_l1, col_l2, col_l3 = st.columns(3)
         with col_l1:
-            actions = df['Action'].unique().tolist() if 'Action' in df.columns else []
             action_f = st.multiselect("Action", actions, key="log_act")
         with col_l2:
             date_f = st.date_input("Date", datetime.now(), key="log_date")
+        with col_l3:
+            order_f = st.text_input("Order ID", key="log_order").strip()
         
-        filtered = df.copy()
-        
-        if action_f:
-            filtered = filtered[filtered['Action'].isin(action_f)]
-        
-        if date_f:
-            filtered['Time'] = pd.to_datetime(filtered['Time'], errors='coerce')
-            filtered = filtered[filtered['Time'].dt.date == date_f]
+        if order_f:
+            # Full timeline of one order, across all days
+            filtered = order_timeline(order_f)
+            if action_f:
+                filtered = filtered[filtered['Action'].isin(action_f)]
+        else:
+            filtered = load_logs(day=date_f or None, actions=action_f).sort_values('Time', ascending=False)
         
-        st.dataframe(filtered.sort_values('Time', ascending=False), use_container_width=True, hide_index=True)
+        st.dataframe(filtered, use_container_width=True, hide_index=True)
         st.markdown(f"**{len(filtered)}** logs")
         
     except Exception as e:
@@ -1086,7 +4532,29 @@ def render_logs():
 # ============================================================================
 
 if __name__ == "__main__":
-    if not st.session_state.admin_logged_in:
+    if "--migrate-sqlite" in sys.argv:
+        counts = migrate_csv_to_sqlite()
+        print(f"Migrated {counts['orders']} orders, {counts['payments']} payments, {counts['logs']} logs, {counts['line_items']} line items, {counts['allocations']} payment allocations into {SQLITE_DB}")
+    elif "--columnar-snapshot" in sys.argv:
+        rows = CsvStorage().write_columnar_snapshot()
+        print(f"Wrote {rows} orders to {ORDERS_COLUMNAR}")
+    elif "--notify-stub" in sys.argv:
+        server = start_stub_gateway(int(os.environ.get("NATUVISIO_STUB_PORT", "8765")), echo=True)
+        print(f"Stub gateway on http://127.0.0.1:{server.server_port}/ (set NATUVISIO_NOTIFY_URL to this)")
+        threading.Event().wait()
+    elif "--api" in sys.argv:
+        server = serve_api()
+        print(f"Serving the read-only API on http://{API_HOST}:{server.server_port}/api/")
+        server.serve_forever()
+    elif "--backfill-items" in sys.argv:
+        written, unparsed = backfill_line_items()
+        print(f"Wrote {written} line items; {len(unparsed)} orders could not be parsed")
+    elif "--archive" in sys.argv:
+        init_databases()
+        moved = archive_orders()
+        print(f"Archived {moved} orders completed more than {ARCHIVE_AFTER_DAYS} days ago into {ARCHIVE_DIR}/")
+    elif not st.session_state.admin_logged_in:
         login_screen()
     else:
-        dashboard()
+        with rerun_trace():
+            dashboard()